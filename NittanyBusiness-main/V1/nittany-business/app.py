@@ -1,13 +1,18 @@
 from flask import (
     Flask, render_template, request, redirect, url_for,
-    flash, get_flashed_messages, session, jsonify, abort,current_app
+    flash, get_flashed_messages, session, jsonify, abort,current_app,
+    stream_template
 )
 
 # Main Imports
 import sqlite3 as sql
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 import hashlib
-from functools import wraps
+import heapq
+import hmac
+import json
+from functools import wraps, lru_cache
+from collections import namedtuple
 import os
 import requests  # <-- ADD
 
@@ -28,6 +33,29 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'change-me-in-env')
 # Demo switcher on login (set ENABLE_TECH_DEMO=1 in env to show it)
 app.config['ENABLE_TECH_DEMO'] = os.getenv('ENABLE_TECH_DEMO', '0') == '1'
 
+# jsonify() through orjson when it's installed (stdlib json otherwise).
+# Anything orjson doesn't handle natively (Decimal, datetimes) goes through
+# Flask's default hook, so the output matches the stock provider.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    from flask.json.provider import DefaultJSONProvider
+
+    class OrjsonProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            opts = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+            if self.sort_keys:
+                opts |= orjson.OPT_SORT_KEYS
+            return orjson.dumps(obj, default=self.default, option=opts).decode()
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app.json = OrjsonProvider(app)
+
 
 # Status.py
 # --- UTIL: estado legible, fechas cortas y "hace X" -----------------
@@ -220,19 +248,21 @@ USE_PG = bool(DATABASE_URL)
 # ---------------------------- Device detection ----------------------------
 MOBILE_COOKIE = "view_mode"   # 'mobile' | 'desktop' | 'auto'
 
-def _detect_device_from_ua(ua_string: str) -> dict:
+# (is_phone, is_tablet) -> class. "mobile" includes phones; tablets we treat separately
+_UA_CLS = {(True, False): "mobile", (False, True): "tablet", (False, False): "desktop"}
+
+@lru_cache(maxsize=1024)
+def _ua_class(ua_string: str) -> str:
+    """Parse a UA once; the same few UA strings repeat on every request."""
     try:
-        ua = parse_ua(ua_string or "")
-        # "mobile" includes phones; tablets we treat separately
-        if ua.is_mobile and not ua.is_tablet:
-            cls = "mobile"
-        elif ua.is_tablet:
-            cls = "tablet"
-        else:
-            cls = "desktop"
-        return {"class": cls, "is_mobile": cls == "mobile", "is_tablet": cls == "tablet", "is_desktop": cls == "desktop"}
+        ua = parse_ua(ua_string)
     except Exception:
-        return {"class":"desktop","is_mobile":False,"is_tablet":False,"is_desktop":True}
+        return "desktop"
+    return _UA_CLS[(bool(ua.is_mobile and not ua.is_tablet), bool(ua.is_tablet))]
+
+def _detect_device_from_ua(ua_string: str) -> dict:
+    cls = _ua_class(ua_string or "")
+    return {"class": cls, "is_mobile": cls == "mobile", "is_tablet": cls == "tablet", "is_desktop": cls == "desktop"}
 
 def _decide_view_mode(req):
     # 1) explicit ?view=mobile|desktop|auto overrides (and we persist via cookie)
@@ -247,8 +277,8 @@ def _decide_view_mode(req):
     if cv in ("mobile","desktop"):
         return cv
 
-    # 3) auto from UA
-    dev = _detect_device_from_ua(req.headers.get("User-Agent",""))
+    # 3) auto from UA (already detected in _inject_device)
+    dev = getattr(g, "device", None) or _detect_device_from_ua(req.headers.get("User-Agent",""))
     return "mobile" if dev["is_mobile"] else "desktop"
 
 @app.before_request
@@ -265,15 +295,55 @@ def _persist_view_cookie(resp):
         resp.set_cookie(MOBILE_COOKIE, v, max_age=30*24*3600, samesite="Lax")
     return resp
 
+# Read-only GETs that tolerate a little staleness: browser-side max-age (seconds)
+CHART_API_MAX_AGE = 30
+TECH_TOOLS_MAX_AGE = 3600
+
+def _cache_max_age(path: str) -> int | None:
+    if path.startswith('/api/supervisor/') or path == '/pms/guest':
+        return CHART_API_MAX_AGE
+    if path.startswith('/tecnico/') and path.endswith('/tools'):
+        return TECH_TOOLS_MAX_AGE
+    return None
+
+@app.after_request
+def _add_cache_headers(resp):
+    if request.method != 'GET' or resp.status_code != 200 or resp.direct_passthrough:
+        return resp
+    max_age = _cache_max_age(request.path)
+    if max_age is None:
+        return resp
+    # private: responses are per-user (session scoped)
+    resp.headers['Cache-Control'] = f'private, max-age={max_age}'
+    resp.add_etag()
+    return resp.make_conditional(request)
+
+@lru_cache(maxsize=512)
+def _resolve_template(names: tuple[str, ...]) -> str:
+    """First existing template name in order (else the last one); cached per order."""
+    try:
+        return app.jinja_env.select_template(names).name
+    except TemplateNotFound:
+        return names[-1]
+
 def render_best(templates: list[str], **ctx):
     """Try templates in order; fall back to last item if none found."""
-    last = templates[-1]
-    for name in templates:
-        try:
-            return render_template(name, **ctx)
-        except TemplateNotFound:
-            continue
-    return render_template(last, **ctx)
+    names = tuple(templates)
+    # Skip the cache in debug so newly added templates are picked up
+    name = _resolve_template.__wrapped__(names) if app.debug else _resolve_template(names)
+    return render_template(name, **ctx)
+
+def stream_best(templates: list[str], **ctx):
+    """
+    render_best() as a streamed response: the page is sent as Jinja renders it.
+    Iterables in ctx are consumed lazily, so templates must not use `| length`
+    on them (pass a precomputed count instead).
+    """
+    names = tuple(templates)
+    name = _resolve_template.__wrapped__(names) if app.debug else _resolve_template(names)
+    # Pop flashes now: the session cookie goes out with the headers, before the body.
+    get_flashed_messages()
+    return app.response_class(stream_template(name, **ctx))
 
 
 # --- DSN helpers & pooler detection ---
@@ -381,6 +451,11 @@ if USE_PG:
 
 PG_POOL = None  # created lazily on first use
 
+# Plain tuple cursor for Postgres: cheaper per row than RealDictCursor when a
+# caller only reads columns by position (KPI counts). SQLite rows already
+# support positional access, so it's ignored there.
+TUPLE_CURSOR = pg.extensions.cursor if pg is not None else None
+
 # --- WhatsApp notify service (the webhook app you shared) ---
 WA_NOTIFY_BASE  = os.getenv('WA_NOTIFY_BASE', 'https://hestia-whatsapp-webhook.onrender.com/').rstrip('/')   # ej: https://hestia-wa.onrender.com
 WA_NOTIFY_TOKEN = os.getenv('WA_NOTIFY_TOKEN', '200220022002')              # must match INTERNAL_NOTIFY_TOKEN there
@@ -419,9 +494,37 @@ def _notify_guest_final(to_phone: str, ticket_id: int, huesped_nombre: str | Non
     })
 
 
+# --- Password hashing ---------------------------------------------------------
+# New hashes use scrypt ("scrypt$n$r$p$salt$hash"); legacy rows hold a plain
+# SHA-256 hex digest and are re-hashed on the next successful login.
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2**14, 8, 1
+
 def hp(password: str) -> str:
+    """Legacy SHA-256 digest. Only used to verify old hashes."""
     return hashlib.sha256(password.encode('utf-8')).hexdigest()
 
+def hash_password(password: str) -> str:
+    salt = os.urandom(16)
+    dk = hashlib.scrypt(password.encode('utf-8'), salt=salt,
+                        n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, dklen=32)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${dk.hex()}"
+
+def verify_password(password: str, stored: str | None) -> bool:
+    if not stored:
+        return False
+    if stored.startswith("scrypt$"):
+        try:
+            _, n, r, p, salt, digest = stored.split("$")
+            dk = hashlib.scrypt(password.encode('utf-8'), salt=bytes.fromhex(salt),
+                                n=int(n), r=int(r), p=int(p), dklen=len(digest) // 2)
+        except Exception:
+            return False
+        return hmac.compare_digest(dk.hex(), digest)
+    return hmac.compare_digest(hp(password), stored)
+
+def password_needs_rehash(stored: str | None) -> bool:
+    return not (stored or "").startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
 # --- Postgres pool init & connection helpers ---
 def _init_pg_pool():
     """Create the global pool once. Keep pool tiny when using Supabase pgbouncer (6543)."""
@@ -446,7 +549,7 @@ def _init_pg_pool():
 
 
 import time
-from contextlib import suppress
+from contextlib import suppress, contextmanager
 
 def _db_conn_with_retry(tries: int = 3, backoff: float = 0.35):
     """Retry on transient pooler hiccups with exponential backoff."""
@@ -470,6 +573,9 @@ def _db_conn_with_retry(tries: int = 3, backoff: float = 0.35):
 
 
 
+# Per-connection prepared-statement cache size for SQLite (default is 128)
+SQLITE_STMT_CACHE = int(os.getenv('SQLITE_STMT_CACHE', '1024'))
+
 def db():
     """
     Get a DB connection:
@@ -478,26 +584,43 @@ def db():
     """
     if USE_PG:
         return _db_conn_with_retry(tries=2)
-    conn = sql.connect(DATABASE, check_same_thread=False)
+    conn = sql.connect(DATABASE, check_same_thread=False, cached_statements=SQLITE_STMT_CACHE)
     conn.row_factory = sql.Row
     conn.execute("PRAGMA foreign_keys = ON;")
     return conn
 
 
-def _execute(conn, query, params=()):
+def _execute(conn, query, params=(), cursor_factory=None):
     """Run a query on either backend. Converts '?' -> '%s' for Postgres."""
     if USE_PG:
-        cur = conn.cursor(cursor_factory=pg_extras.RealDictCursor)
+        cur = conn.cursor(cursor_factory=cursor_factory or pg_extras.RealDictCursor)
         cur.execute(query.replace('?', '%s'), params)
         return cur
     else:
         return conn.execute(query, params)
 
-def fetchone(query, params=()):
+def _executemany(conn, query, seq_of_params, page_size: int = 100):
+    """executemany on an open connection (e.g. inside db_transaction())."""
+    if USE_PG:
+        with conn.cursor() as cur:
+            pg_extras.execute_batch(cur, query.replace('?', '%s'), seq_of_params, page_size=page_size)
+    else:
+        conn.executemany(query, seq_of_params)
+
+def _in_clause(col: str, values) -> tuple[str, list]:
+    """
+    `col IN (values)` with a single placeholder, so the SQL text (and its cached
+    plan) doesn't change with len(values). Postgres binds an array; SQLite a JSON list.
+    """
+    if USE_PG:
+        return f"{col} = ANY(?)", [list(values)]
+    return f"{col} IN (SELECT value FROM json_each(?))", [json.dumps(list(values))]
+
+def fetchone(query, params=(), cursor_factory=None):
     conn = db()
     try:
         if USE_PG:
-            cur = _execute(conn, query, params)
+            cur = _execute(conn, query, params, cursor_factory)
             row = cur.fetchone()
             cur.close()
             conn.commit()
@@ -514,11 +637,11 @@ def fetchone(query, params=()):
             try: conn.close()
             except Exception: pass
 
-def fetchall(query, params=()):
+def fetchall(query, params=(), cursor_factory=None):
     conn = db()
     try:
         if USE_PG:
-            cur = _execute(conn, query, params)
+            cur = _execute(conn, query, params, cursor_factory)
             rows = cur.fetchall()
             cur.close()
             conn.commit()
@@ -554,6 +677,30 @@ def execute(query, params=()):
             try: conn.close()
             except Exception: pass
 
+@contextmanager
+def db_transaction():
+    """
+    One connection, one transaction: commits on success, rolls back on error.
+    Use with _execute(conn, ...) to group several statements into a single commit.
+    """
+    conn = db()
+    try:
+        if not USE_PG:
+            conn.execute("BEGIN IMMEDIATE")
+        yield conn
+        conn.commit()
+    except Exception:
+        with suppress(Exception):
+            conn.rollback()
+        raise
+    finally:
+        if USE_PG:
+            try: PG_POOL.putconn(conn)
+            except Exception: pass
+        else:
+            try: conn.close()
+            except Exception: pass
+
 def insert_and_get_id(query, params=()):
     """
     Run an INSERT and return the new primary key id on both backends.
@@ -596,21 +743,31 @@ def date_key(v):
     return str(v)[:10]                  # por si viene como texto
 
 
-def is_critical(now: datetime, due_at) -> bool:
+CRITICAL_WINDOW = timedelta(minutes=10)
+
+def critical_cutoff_iso(now: datetime) -> str:
+    """due_at <= this  <=>  is_critical(now, due_at). Lets SQL compute the flag."""
+    return (now + CRITICAL_WINDOW).isoformat()
+
+def critical_check(now: datetime):
     """
-    Accepts either ISO string (SQLite) or datetime (Postgres) for due_at.
+    Per-row predicate for loops: the cutoff is computed once and ISO strings
+    (SQLite) are compared lexically instead of parsed row by row.
     crítico si faltan <=10 min o ya vencido
     """
-    if not due_at:
-        return False
-    try:
-        if isinstance(due_at, datetime):
-            due = due_at
-        else:
-            due = datetime.fromisoformat(str(due_at))
-    except Exception:
-        return False
-    return now >= (due - timedelta(minutes=10))
+    cutoff = now + CRITICAL_WINDOW
+    cutoff_iso = cutoff.isoformat()
+    def check(due_at) -> bool:
+        if not due_at:
+            return False
+        if isinstance(due_at, datetime):        # Postgres
+            return due_at <= cutoff
+        return str(due_at) <= cutoff_iso
+    return check
+
+def is_critical(now: datetime, due_at) -> bool:
+    """Single-value form of critical_check(); accepts ISO string or datetime."""
+    return critical_check(now)(due_at)
 
 def sla_minutes(area: str, prioridad: str) -> int | None:
     r = fetchone("SELECT max_minutes FROM SLARules WHERE area=? AND prioridad=?", (area, prioridad))
@@ -713,6 +870,13 @@ def role_effective_perms(role_code: str) -> set[str]:
 
 
 
+def current_scope() -> tuple[int | None, int | None]:
+    """(org_id, hotel_id) the user is operating in."""
+    a = getattr(g, 'auth', None)
+    if a:
+        return a.org_id, a.hotel_id
+    return session.get('org_id'), session.get('hotel_id')
+
 def current_org_role() -> str | None:
     """Return the OrgUsers.role for this user in current org, or SUPERADMIN."""
     u = session.get('user'); org_id = session.get('org_id')
@@ -722,6 +886,11 @@ def current_org_role() -> str | None:
         return "SUPERADMIN"
     if not org_id:
         return None
+    a = getattr(g, 'auth', None)
+    if a:
+        return a.role
+    if _scope_cache_valid():
+        return session['cached_role']
     r = fetchone("SELECT role FROM OrgUsers WHERE org_id=? AND user_id=?", (org_id, u['id']))
     return r['role'] if r else None
 
@@ -730,6 +899,12 @@ def user_area_codes(org_id: int, user_id: int) -> set[str]:
     Areas asignadas al usuario en la org (multi-área).
     Fallback a OrgUsers.default_area si OrgUserAreas no existe.
     """
+    u = session.get('user') or {}
+    a = getattr(g, 'auth', None)
+    if a and org_id == a.org_id and user_id == u.get('id'):
+        return set(a.areas)
+    if _scope_cache_valid() and org_id == session.get('org_id') and user_id == u.get('id'):
+        return set(session['cached_areas'])
     try:
         rows = fetchall("SELECT area_code FROM OrgUserAreas WHERE org_id=? AND user_id=?", (org_id, user_id))
         if rows:
@@ -768,9 +943,14 @@ def default_area_for_user() -> str | None:
     u = session.get("user"); org_id = session.get("org_id")
     if not u:
         return None
+    a = getattr(g, 'auth', None)
+    if a:
+        return a.default_area
+    if _scope_cache_valid():
+        return session['cached_default_area']
     # explicit default on membership
     r = fetchone("SELECT default_area FROM OrgUsers WHERE org_id=? AND user_id=?", (org_id, u["id"]))
-    if r and r.get("default_area"): return r["default_area"]
+    if r and r["default_area"]: return r["default_area"]
     # multi-area table
     areas = user_area_codes(org_id, u["id"])
     if areas: return sorted(list(areas))[0]
@@ -779,12 +959,92 @@ def default_area_for_user() -> str | None:
 
 
 def has_perm(code: str) -> bool:
+    a = getattr(g, 'auth', None)
+    if a and a.role:
+        return ("*" in a.perms) or (code in a.perms)
     role = current_org_role()
     if not role:
         return False
-    eff = role_effective_perms(role)
+    if _scope_cache_valid():
+        eff = session['cached_perms']
+    else:
+        eff = role_effective_perms(role)
     return ("*" in eff) or (code in eff)
 
+
+# ---------------------------- Session scope cache ----------------------------
+# Role, areas and perms rarely change, so resolve them once and keep them in the
+# session. Re-resolve on login, whenever the org changes, when the membership row
+# no longer matches the cached role (checked every request, so a demoted or removed
+# member loses access right away) and at least every SCOPE_CACHE_TTL seconds
+# (area and role-permission edits).
+SCOPE_CACHE_KEYS = ('cached_org_id', 'cached_role', 'cached_areas', 'cached_default_area', 'cached_perms',
+                    'cached_at')
+SCOPE_CACHE_TTL = 300
+
+def _scope_cache_valid() -> bool:
+    return ('cached_org_id' in session and session['cached_org_id'] == session.get('org_id')
+            and time.time() - session.get('cached_at', 0) < SCOPE_CACHE_TTL)
+
+def _membership_changed(u) -> bool:
+    """True when OrgUsers no longer holds the cached role (role edited or membership removed)."""
+    org_id = session.get('org_id')
+    if u.get('is_superadmin') or not org_id:
+        return False
+    r = fetchone("SELECT role FROM OrgUsers WHERE org_id=? AND user_id=?", (org_id, u['id']))
+    return (r['role'] if r else None) != session.get('cached_role')
+
+def clear_scope_cache():
+    for k in SCOPE_CACHE_KEYS:
+        session.pop(k, None)
+    g.auth = None
+
+def cache_scope_in_session():
+    """Resolve role/areas/default area/perms from DB and store them in session."""
+    clear_scope_cache()
+    u = session.get('user')
+    if not u:
+        return
+    org_id = session.get('org_id')
+    role = current_org_role()
+    areas = sorted(user_area_codes(org_id, u['id'])) if org_id else []
+    default_area = default_area_for_user()
+    perms = sorted(role_effective_perms(role)) if role else []
+    session['cached_role'] = role
+    session['cached_areas'] = areas
+    session['cached_default_area'] = default_area
+    session['cached_perms'] = perms
+    session['cached_org_id'] = org_id
+    session['cached_at'] = time.time()
+    _set_auth_ctx()
+
+# Request-scoped view of the session cache: built once per request so the
+# role/perm checks below are attribute reads and set lookups.
+AuthCtx = namedtuple('AuthCtx', 'org_id hotel_id role perms areas default_area')
+
+@app.before_request
+def _load_auth_ctx():
+    g.auth = None
+    u = session.get('user')
+    if not u or request.endpoint == 'static':
+        return
+    if _scope_cache_valid() and not _membership_changed(u):
+        _set_auth_ctx()
+    else:
+        cache_scope_in_session()
+
+def _set_auth_ctx():
+    g.auth = None
+    if _scope_cache_valid():
+        g.auth = AuthCtx(
+            org_id=session['cached_org_id'],
+            hotel_id=session.get('hotel_id'),
+            role=session['cached_role'],
+            perms=frozenset(session['cached_perms']),
+            areas=frozenset(session['cached_areas']),
+            default_area=session['cached_default_area'],
+        )
+
 def require_perm(code):
     def deco(fn):
         @wraps(fn)
@@ -832,12 +1092,10 @@ def index():
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     message, success = None, False
-    flashed = get_flashed_messages()
+    flashed = get_flashed_messages(with_categories=True)
     if flashed:
-        try:
-            message, success = flashed[0]
-        except Exception:
-            message = flashed[0]
+        category, message = flashed[0]
+        success = (category == 'success')
 
     if request.method == 'POST':
         ident = request.form.get('email')  # email o username
@@ -855,7 +1113,14 @@ def login():
         is_active = bool(row["activo"]) if row else False
         is_super  = bool(row["is_superadmin"]) if row else False
 
-        if row and hp(password) == row["password_hash"] and is_active:
+        # Cheap checks first: no hash work for unknown or inactive users
+        if row and is_active and verify_password(password, row["password_hash"]):
+            if password_needs_rehash(row["password_hash"]):
+                try:
+                    execute("UPDATE Users SET password_hash=? WHERE id=?",
+                            (hash_password(password), row['id']))
+                except Exception as e:
+                    app.logger.warning(f"password rehash failed for user {row['id']}: {e}")
             session['user'] = {
                 'id': row['id'],
                 'name': row['username'],
@@ -882,6 +1147,8 @@ def login():
                     h = fetchone("SELECT id FROM Hotels WHERE org_id=? ORDER BY id LIMIT 1", (org['id'],))
                     session['hotel_id'] = h['id'] if h else None
 
+            cache_scope_in_session()
+
             if session['user']['is_superadmin']:
                 return redirect(url_for('admin_super'))
             return redirect(url_for('dashboard'))
@@ -930,6 +1197,7 @@ def demo_tecnico():
         session['hotel_id'] = h['id'] if h else None
     else:
         session['hotel_id'] = None
+    cache_scope_in_session()
 
     # Use the device/view cookie mechanism you already have:
     # app.before_request sees ?view=... and sets the cookie for future pages.
@@ -946,6 +1214,7 @@ def healthz():
 # ---------------------------- role data helpers ----------------------------
 # I have it double, incongruence then
 OPEN_STATES = ('PENDIENTE_APROBACION','PENDIENTE','ASIGNADO','ACEPTADO','EN_CURSO','PAUSADO','DERIVADO')
+_OPEN_STATES_PH = ",".join(["?"] * len(OPEN_STATES))
 
 
 def get_global_kpis():
@@ -956,29 +1225,30 @@ def get_global_kpis():
         return {"critical": 0, "active": 0, "resolved_today": 0, "by_area": {}}, {"resolved_last7": []}
 
     active = fetchall(
-        f"SELECT id, due_at FROM Tickets WHERE org_id=? AND estado IN ({','.join(['?']*len(OPEN_STATES))})",
-        (org_id, *OPEN_STATES)
+        f"SELECT due_at FROM Tickets WHERE org_id=? AND estado IN ({_OPEN_STATES_PH})",
+        (org_id, *OPEN_STATES), cursor_factory=TUPLE_CURSOR
     )
     total_active = len(active)
-    critical = sum(1 for r in active if is_critical(now, r['due_at']))
+    check = critical_check(now)
+    critical = sum(1 for r in active if check(r[0]))
 
     start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
     resolved_today = fetchone(
         "SELECT COUNT(1) c FROM Tickets WHERE org_id=? AND estado='RESUELTO' AND finished_at >= ?",
-        (org_id, start_of_day)
-    )['c']
+        (org_id, start_of_day), cursor_factory=TUPLE_CURSOR
+    )[0]
 
     by_area = fetchall("""
         SELECT area, COUNT(1) c
         FROM Tickets
         WHERE org_id=? AND estado IN ('PENDIENTE','ASIGNADO','ACEPTADO','EN_CURSO','PAUSADO','DERIVADO','RESUELTO')
         GROUP BY area
-    """, (org_id,))
+    """, (org_id,), cursor_factory=TUPLE_CURSOR)
     kpis = {
         "critical": critical,
         "active": total_active,
         "resolved_today": resolved_today,
-        "by_area": {r["area"]: r["c"] for r in by_area}
+        "by_area": {r[0]: r[1] for r in by_area}
     }
 
     # Serie de resueltos últimos 7 días (DB-agnóstico: calculado en Python)
@@ -987,12 +1257,12 @@ def get_global_kpis():
         SELECT finished_at
         FROM Tickets
         WHERE org_id=? AND estado='RESUELTO' AND finished_at >= ?
-    """, (org_id, cutoff))
+    """, (org_id, cutoff), cursor_factory=TUPLE_CURSOR)
 
     from collections import Counter
     cnt = Counter()
     for r in rows or []:
-        key = date_key(r["finished_at"])
+        key = date_key(r[0])
         if key:
             cnt[key] += 1
 
@@ -1009,6 +1279,8 @@ def get_area_data(area: str | None):
     if not org_id:
         return {"area": area, "critical": 0, "active": 0, "resolved_24h": 0}, []
 
+    # one clock read per call so every critical flag in this response agrees
+    now = datetime.now()
     params = [org_id]
     where = ["org_id=?"]
     # If you want to limit by hotel, uncomment:
@@ -1016,27 +1288,27 @@ def get_area_data(area: str | None):
     if area:
         where.append("area=?"); params.append(area)
 
-    now = datetime.now()
     active = fetchall(
         f"""
-        SELECT id, due_at
+        SELECT due_at
         FROM Tickets
         WHERE {' AND '.join(where)}
           AND estado IN ('PENDIENTE','ASIGNADO','ACEPTADO','EN_CURSO','PAUSADO','DERIVADO')
-        """, params
+        """, params, cursor_factory=TUPLE_CURSOR
     )
     total_active = len(active)
-    critical = sum(1 for r in active if is_critical(now, r['due_at']))
+    check = critical_check(now)
+    critical = sum(1 for r in active if check(r[0]))
 
-    cut24 = (datetime.now() - timedelta(days=1)).isoformat()
+    cut24 = (now - timedelta(days=1)).isoformat()
     resolved_24 = fetchone(
         f"""
         SELECT COUNT(1) c
         FROM Tickets
         WHERE {' AND '.join(where)} AND estado='RESUELTO'
         AND finished_at >= ?
-        """, params + [cut24]
-    )['c']
+        """, params + [cut24], cursor_factory=TUPLE_CURSOR
+    )[0]
 
 
     kpis = {
@@ -1058,7 +1330,7 @@ def get_area_data(area: str | None):
     tickets = [{
         "id": r["id"], "area": r["area"], "prioridad": r["prioridad"], "estado": r["estado"],
         "detalle": r["detalle"], "ubicacion": r["ubicacion"], "created_at": r["created_at"],
-        "due_at": r["due_at"], "is_critical": is_critical(datetime.now(), r["due_at"]),
+        "due_at": r["due_at"], "is_critical": check(r["due_at"]),
         "assigned_to": r["assigned_to"],
         "canal": r["canal_origen"],
     } for r in rows]
@@ -1097,10 +1369,11 @@ def get_assigned_tickets_for_area(user_id: int, area: str | None):
           created_at ASC
     """, tuple(params))
 
+    check = critical_check(now)
     return [{
         "id": r["id"], "area": r["area"], "prioridad": r["prioridad"], "estado": r["estado"],
         "detalle": r["detalle"], "ubicacion": r["ubicacion"], "created_at": r["created_at"],
-        "due_at": r["due_at"], "is_critical": is_critical(now, r["due_at"])
+        "due_at": r["due_at"], "is_critical": check(r["due_at"])
     } for r in rows]
 
 
@@ -1132,10 +1405,11 @@ def get_in_progress_tickets_for_user(user_id: int, area: str | None):
             created_at ASC
     """, tuple(params))
 
+    check = critical_check(now)
     return [{
         "id": r["id"], "area": r["area"], "prioridad": r["prioridad"], "estado": r["estado"],
         "detalle": r["detalle"], "ubicacion": r["ubicacion"], "created_at": r["created_at"],
-        "due_at": r["due_at"], "is_critical": is_critical(now, r["due_at"])
+        "due_at": r["due_at"], "is_critical": check(r["due_at"])
     } for r in rows]
 
 
@@ -1176,11 +1450,11 @@ def get_area_available_tickets(area: str, only_unassigned: bool = False):
         """, tuple(params))
 
 
-    now = datetime.now()
+    check = critical_check(datetime.now())
     return [{
         "id": r["id"], "area": r["area"], "prioridad": r["prioridad"], "estado": r["estado"],
         "detalle": r["detalle"], "ubicacion": r["ubicacion"], "created_at": r["created_at"],
-        "due_at": r["due_at"], "is_critical": is_critical(now, r["due_at"])
+        "due_at": r["due_at"], "is_critical": check(r["due_at"])
     } for r in rows]
 
 
@@ -1196,18 +1470,14 @@ def get_history_tickets_for_user(user_id: int, area: str | None, days: int = 7):
     if area:
         where.append("area=?")
         params.append(area)
-    rows = fetchall(f"""
-        SELECT id, area, prioridad, estado, detalle, ubicacion, created_at, due_at, finished_at
+    # Columns already match what the templates read; no per-row rebuild.
+    return fetchall(f"""
+        SELECT id, area, prioridad, estado, detalle, ubicacion, created_at, due_at, finished_at,
+               0 AS is_critical
         FROM Tickets
         WHERE {' AND '.join(where)}
         ORDER BY finished_at DESC
     """, tuple(params))
-    return [{
-        "id": r["id"], "area": r["area"], "prioridad": r["prioridad"], "estado": r["estado"],
-        "detalle": r["detalle"], "ubicacion": r["ubicacion"], "created_at": r["created_at"],
-        "due_at": r["due_at"], "finished_at": r.get("finished_at"),
-        "is_critical": False
-    } for r in rows]
 
 
 
@@ -1224,10 +1494,11 @@ def get_assigned_tickets(user_id: int):
           AND estado IN ('PENDIENTE','ASIGNADO','ACEPTADO','EN_CURSO','PAUSADO','DERIVADO')
         ORDER BY created_at DESC
     """, (org_id, user_id))
+    check = critical_check(now)
     return [{
         "id": r["id"], "area": r["area"], "prioridad": r["prioridad"], "estado": r["estado"],
         "detalle": r["detalle"], "ubicacion": r["ubicacion"], "created_at": r["created_at"],
-        "due_at": r["due_at"], "is_critical": is_critical(now, r["due_at"])
+        "due_at": r["due_at"], "is_critical": check(r["due_at"])
     } for r in rows]
 
     
@@ -1339,41 +1610,41 @@ def tech_history(slug):
                        section="history", area=area, slug=slug, user=session['user'],
                        device=g.device, view=g.view_mode, tickets=tickets, days=days)
 
+# Contenido “tools” por área (puedes reemplazar por datos desde DB)
+TOOLS_BY_AREA: dict[str, tuple[tuple[str, str], ...]] = {
+    "HOUSEKEEPING": (
+        ("Checklist de salida", "#"),
+        ("Mapa de carros / pisos", "#"),
+        ("Protocolo de textiles", "#"),
+        ("Señalética & Seguridad", "#"),
+        ("Reportes de pérdida", "#"),
+        ("Guía de amenities", "#"),
+    ),
+    "MANTENCION": (
+        ("Guía de circuitos eléctricos", "#"),
+        ("Planos y tableros", "#"),
+        ("Protocolo lock-out/tag-out", "#"),
+        ("Manual de calderas / bombas", "#"),
+        ("Inventario de repuestos", "#"),
+        ("Ficha de herramientas", "#"),
+    ),
+    "ROOMSERVICE": (
+        ("Menú actual & alérgenos", "#"),
+        ("Checklist de bandeja", "#"),
+        ("Rutas de entrega por piso", "#"),
+        ("Menú nocturno", "#"),
+        ("Stock de amenities/extras", "#"),
+        ("Protocolos de higiene", "#"),
+    ),
+}
+
 @app.get('/tecnico/<slug>/tools')
 def tech_tools(slug):
     if 'user' not in session:
         return redirect(url_for('login'))
     area = _area_or_404(slug)
 
-    # Contenido “tools” por área (puedes reemplazar por datos desde DB)
-    tools = []
-    if area == "HOUSEKEEPING":
-        tools = [
-            ("Checklist de salida", "#"),
-            ("Mapa de carros / pisos", "#"),
-            ("Protocolo de textiles", "#"),
-            ("Señalética & Seguridad", "#"),
-            ("Reportes de pérdida", "#"),
-            ("Guía de amenities", "#"),
-        ]
-    elif area == "MANTENCION":
-        tools = [
-            ("Guía de circuitos eléctricos", "#"),
-            ("Planos y tableros", "#"),
-            ("Protocolo lock-out/tag-out", "#"),
-            ("Manual de calderas / bombas", "#"),
-            ("Inventario de repuestos", "#"),
-            ("Ficha de herramientas", "#"),
-        ]
-    elif area == "ROOMSERVICE":
-        tools = [
-            ("Menú actual & alérgenos", "#"),
-            ("Checklist de bandeja", "#"),
-            ("Rutas de entrega por piso", "#"),
-            ("Menú nocturno", "#"),
-            ("Stock de amenities/extras", "#"),
-            ("Protocolos de higiene", "#"),
-        ]
+    tools = TOOLS_BY_AREA.get(area, ())
 
     template_order = ["tecnico_mobile_tools.html", "tickets_mobile.html", "tickets.html"]
     return render_best(template_order,
@@ -1407,6 +1678,93 @@ def api_tech_shift():
 
 
 # ---------------------------- tickets list & filters ----------------------------
+# The user's areas as a subquery (same rule as user_area_codes(): OrgUserAreas,
+# else OrgUsers.default_area), so scoping costs no extra round-trip.
+# Params: (org_id, user_id) x 3.
+AREA_SCOPE_SQL = """area IN (
+        SELECT area_code FROM OrgUserAreas WHERE org_id=? AND user_id=?
+        UNION
+        SELECT default_area FROM OrgUsers
+         WHERE org_id=? AND user_id=? AND default_area IS NOT NULL
+           AND NOT EXISTS (SELECT 1 FROM OrgUserAreas WHERE org_id=? AND user_id=?)
+    )"""
+
+# ---- Pagination: ?page=&page_size= (offset) or ?cursor=created_at|id (keyset) ----
+TICKETS_PAGE_SIZE = 100
+TICKETS_PAGE_MAX = 200
+INBOX_LIMIT = 500
+# Rows strictly after the cursor in (created_at DESC, id DESC) order. Params: (created_at, created_at, id)
+KEYSET_SQL = "(created_at < ? OR (created_at = ? AND id < ?))"
+
+def _parse_cursor(raw: str | None):
+    """'created_at|id' -> (created_at, id) or None if missing/malformed."""
+    if not raw or '|' not in raw:
+        return None
+    created, _, tid = raw.rpartition('|')
+    try:
+        return created, int(tid)
+    except ValueError:
+        return None
+
+def _next_page_url(rows, limit: int) -> str | None:
+    """Link to the next keyset page (same filters) when this page came back full."""
+    if not rows or len(rows) < limit:
+        return None
+    last = rows[-1]
+    args = request.args.to_dict()
+    args.pop('page', None)
+    args['cursor'] = f"{last['created_at']}|{last['id']}"
+    return url_for(request.endpoint, **args)
+
+PERIOD_DAYS_BACK = {'today': 0, '7d': 7, '30d': 30}
+
+@lru_cache(maxsize=16)
+def _period_cutoff(period: str, today: date) -> tuple[str | None, str | None]:
+    """(created_at >= lo, created_at < hi) ISO bounds for a period filter; (None, None) = all."""
+    sod = datetime.combine(today, datetime.min.time())
+    if period == 'yesterday':
+        return (sod - timedelta(days=1)).isoformat(), sod.isoformat()
+    if period in PERIOD_DAYS_BACK:
+        return (sod - timedelta(days=PERIOD_DAYS_BACK[period])).isoformat(), None
+    return None, None
+
+@lru_cache(maxsize=256)
+def _build_tickets_sql(area_scoped: bool, assigned_only: bool, has_q: bool, has_area: bool,
+                       has_prio: bool, has_estado: bool, has_since: bool, has_until: bool,
+                       keyset: bool = False) -> str:
+    """
+    SQL text for /tickets, cached by filter shape. Only params vary between
+    requests, so identical text also lets the driver reuse its statement cache.
+    """
+    # If you want hotel-level filtering by default, add "hotel_id=?" here.
+    where = ["org_id=?"]
+    if area_scoped:
+        where.append(AREA_SCOPE_SQL)
+    elif assigned_only:
+        where.append("assigned_to=?")
+    if has_q:
+        where.append("(detalle LIKE ? OR ubicacion LIKE ? OR huesped_id LIKE ?)")
+    if has_area:
+        where.append("area=?")
+    if has_prio:
+        where.append("prioridad=?")
+    if has_estado:
+        where.append("estado=?")
+    if has_since:
+        where.append("created_at >= ?")
+    if has_until:
+        where.append("created_at < ?")
+    if keyset:
+        where.append(KEYSET_SQL)
+    return f"""SELECT id, area, prioridad, estado, detalle, ubicacion, created_at,
+                   due_at, assigned_to, canal_origen AS canal,
+                   (due_at IS NOT NULL AND due_at <= ?) AS is_critical
+            FROM Tickets
+            WHERE {' AND '.join(where)}
+            ORDER BY created_at DESC, id DESC
+            LIMIT ? OFFSET ?
+        """
+
 @app.route('/tickets')
 def tickets():
     if 'user' not in session:
@@ -1423,78 +1781,64 @@ def tickets():
     estado = request.args.get('estado') or None
     period = request.args.get('period', 'today')  # today|yesterday|7d|30d|all
 
-    # RBAC scoping
-    where, params = ["org_id=?"], [org_id]
-    role = current_org_role()
+    now = datetime.now()
 
-    # If you want hotel-level filtering by default, uncomment:
-    # if hotel_id: where.append("hotel_id=?"); params.append(hotel_id)
+    # RBAC scoping (params must follow the order used in _build_tickets_sql;
+    # the first one feeds the is_critical column)
+    params = [critical_cutoff_iso(now), org_id]
+    area_scoped, assigned_only = False, False
+    uid = session['user']['id']
 
     if not has_perm('ticket.view.all'):
         # area-scoped or assigned-only
         if has_perm('ticket.view.area'):
-            my_areas = user_area_codes(org_id, session['user']['id'])
-            if my_areas:
-                where.append("area IN (%s)" % ",".join(["?"]*len(my_areas)))
-                params += list(my_areas)
+            area_scoped = True
+            params += [org_id, uid] * 3
         else:
             # only my assigned
-            where.append("assigned_to=?")
-            params.append(session['user']['id'])
+            assigned_only = True
+            params.append(uid)
 
     if q:
-        where.append("(detalle LIKE ? OR ubicacion LIKE ? OR huesped_id LIKE ?)")
         like = f"%{q}%"; params += [like, like, like]
     if area:
-        where.append("area=?"); params.append(area)
+        params.append(area)
     if prioridad:
-        where.append("prioridad=?"); params.append(prioridad)
+        params.append(prioridad)
     if estado:
-        where.append("estado=?"); params.append(estado)
-
-    now = datetime.now()
-    sod = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    if period == 'today':
-        where.append("created_at >= ?"); params.append(sod.isoformat())
-    elif period == 'yesterday':
-        y0 = (sod - timedelta(days=1)).isoformat()
-        where.append("created_at >= ? AND created_at < ?"); params += [y0, sod.isoformat()]
-    elif period == '7d':
-        where.append("created_at >= ?"); params.append((sod - timedelta(days=7)).isoformat())
-    elif period == '30d':
-        where.append("created_at >= ?"); params.append((sod - timedelta(days=30)).isoformat())
+        params.append(estado)
+
+    lo, hi = _period_cutoff(period, now.date())
+    if lo:
+        params.append(lo)
+    if hi:
+        params.append(hi)
+
+    page_size = min(max(request.args.get('page_size', TICKETS_PAGE_SIZE, type=int) or TICKETS_PAGE_SIZE, 1),
+                    TICKETS_PAGE_MAX)
+    cursor = _parse_cursor(request.args.get('cursor'))
+    if cursor:
+        params += [cursor[0], cursor[0], cursor[1]]
+        offset = 0
+    else:
+        page = max(request.args.get('page', 1, type=int) or 1, 1)
+        offset = (page - 1) * page_size
+    params += [page_size, offset]
 
+    # Rows already carry the keys the templates read (canal, is_critical)
     rows = fetchall(
-        f"""SELECT id, area, prioridad, estado, detalle, ubicacion, created_at,
-                   due_at, assigned_to, canal_origen
-            FROM Tickets
-            WHERE {' AND '.join(where)}
-            ORDER BY created_at DESC
-        """, params
+        _build_tickets_sql(area_scoped, assigned_only, bool(q), bool(area),
+                           bool(prioridad), bool(estado), bool(lo), bool(hi), bool(cursor)),
+        params
     )
 
-    items = []
-    for r in rows:
-        items.append({
-            "id": r["id"],
-            "area": r["area"],
-            "prioridad": r["prioridad"],
-            "estado": r["estado"],
-            "detalle": r["detalle"],
-            "ubicacion": r["ubicacion"],
-            "created_at": r["created_at"],
-            "due_at": r["due_at"],
-            "is_critical": is_critical(now, r["due_at"]),
-            "assigned_to": r["assigned_to"],
-            "canal": r["canal_origen"],
-        })
-
     view = g.view_mode
 
-    return render_best(
+    return stream_best(
         [f"tickets_{view}.html", "tickets.html"],
-        user=session['user'], tickets=items,
+        user=session['user'], tickets=rows,
         filters={"q": q, "area": area, "prioridad": prioridad, "estado": estado, "period": period},
+        next_url=_next_page_url(rows, page_size),
         device=g.device, view=view
     )
 
@@ -1548,55 +1892,35 @@ def recepcion_inbox():
         flash('Sin contexto de organización.', 'error')
         return redirect(url_for('dashboard'))
 
-    # Inbox: pendientes (típicamente WA huésped o recepcion)
-    rows = fetchall("""
-        SELECT id, area, prioridad, estado, detalle, ubicacion, canal_origen, created_at
+    # Inbox: pendientes (típicamente WA huésped o recepcion), bounded + keyset "load more"
+    cursor = _parse_cursor(request.args.get('cursor'))
+    params = [org_id]
+    if cursor:
+        params += [cursor[0], cursor[0], cursor[1]]
+    params.append(INBOX_LIMIT)
+    rows = fetchall(f"""
+        SELECT id, area, prioridad, estado, detalle, ubicacion, canal_origen AS canal, created_at,
+               NULL AS due_at, 0 AS is_critical, NULL AS assigned_to
         FROM Tickets
         WHERE org_id=? AND estado IN ('PENDIENTE_APROBACION','PENDIENTE')
-        ORDER BY created_at DESC
-    """, (org_id,))
+              {'AND ' + KEYSET_SQL if cursor else ''}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    """, tuple(params))
 
     view = g.view_mode
     return render_best(
         [f"tickets_{view}.html", "tickets.html"],
         user=session['user'],
-        tickets=[{
-            "id": r["id"], "area": r["area"], "prioridad": r["prioridad"], "estado": r["estado"],
-            "detalle": r["detalle"], "ubicacion": r["ubicacion"],
-            "created_at": r["created_at"], "due_at": None, "is_critical": False,
-            "assigned_to": None, "canal": r["canal_origen"]
-        } for r in rows],
+        tickets=rows,
         filters={"q":"", "area":"", "prioridad":"", "estado":"PENDIENTE", "period":"today"},
+        next_url=_next_page_url(rows, INBOX_LIMIT),
         device=g.device, view=view
     )
 
 # ---------- Recepción: helpers ----------
-def _safe_is_critical(now, due_at):
-    # Uses your is_critical() if present; else simple fallback
-    try:
-        return is_critical(now, due_at)
-    except NameError:
-        if not due_at:
-            return False
-        try:
-            dt = datetime.fromisoformat(str(due_at))
-        except Exception:
-            return False
-        return dt <= now
-
 def _period_bounds(period: str):
-    now = datetime.now()
-    sod = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    if period == 'today':
-        return (sod.isoformat(), None)
-    if period == 'yesterday':
-        y0 = (sod - timedelta(days=1)).isoformat()
-        return (y0, sod.isoformat())
-    if period == '7d':
-        return ((sod - timedelta(days=7)).isoformat(), None)
-    if period == '30d':
-        return ((sod - timedelta(days=30)).isoformat(), None)
-    return (None, None)
+    return _period_cutoff(period, date.today())
 
 # ---------- Recepción: page ----------
 @app.route('/recepcion/dashboard')
@@ -1623,7 +1947,8 @@ def api_recepcion_kpis():
         SELECT due_at FROM Tickets
         WHERE org_id=? AND estado IN ('PENDIENTE','ASIGNADO','ACEPTADO','EN_CURSO') AND due_at IS NOT NULL
     """, (org_id,))
-    critical = sum(1 for r in rows_due if _safe_is_critical(now, r.get('due_at')))
+    check = critical_check(now)
+    critical = sum(1 for r in rows_due if check(r['due_at']))
 
     return jsonify({
         "pending": (c1[0]["c"] if c1 else 0),
@@ -1665,7 +1990,7 @@ def api_recepcion_list():
         LIMIT {limit}
     """, tuple(params))
 
-    now = datetime.now()
+    check = critical_check(datetime.now())
     items = []
     for r in rows:
         items.append({
@@ -1679,7 +2004,7 @@ def api_recepcion_list():
             "due_at": r["due_at"],
             "finished_at": r.get("finished_at"),
             "canal": r.get("canal_origen"),
-            "is_critical": _safe_is_critical(now, r.get("due_at")),
+            "is_critical": check(r["due_at"]),
         })
     return jsonify({"items": items, "count": len(items)})
 
@@ -1727,6 +2052,11 @@ def api_feed_recent():
 
 
 # ---------------------------- create & confirm ticket ----------------------------
+# Opciones del formulario de creación
+TICKET_AREAS = ('MANTENCION','HOUSEKEEPING','ROOMSERVICE')
+TICKET_PRIORIDADES = ('BAJA','MEDIA','ALTA','URGENTE')
+TICKET_CANALES = ('recepcion','huesped_whatsapp','housekeeping_whatsapp','mantenimiento_app','roomservice_llamada')
+
 @app.route('/tickets/create', methods=['GET', 'POST'])
 @require_perm('ticket.create')
 def ticket_create():
@@ -1783,11 +2113,8 @@ def ticket_create():
             return redirect(nxt or url_for('tickets'))
 
     # GET (igual que ya tenías)
-    areas = ['MANTENCION','HOUSEKEEPING','ROOMSERVICE']
-    prioridades = ['BAJA','MEDIA','ALTA','URGENTE']
-    canales = ['recepcion','huesped_whatsapp','housekeeping_whatsapp','mantenimiento_app','roomservice_llamada']
     return render_template('ticket_create.html', user=session['user'],
-                           areas=areas, prioridades=prioridades, canales=canales)
+                           areas=TICKET_AREAS, prioridades=TICKET_PRIORIDADES, canales=TICKET_CANALES)
 
 # -------------------- HK: Shift (MVP, session-based) --------------------
 from datetime import datetime, timezone, timedelta
@@ -1917,65 +2244,139 @@ def ticket_confirm(id):
     if current_org_role() == 'SUPERVISOR':
         _require_area_manage(t['area'])
 
-    # Asignación simple (menor backlog del área)
-    assignee = pick_assignee(t['org_id'], t['area'])
-    fields = {"estado": "ASIGNADO"}
-    if assignee:
-        fields["assigned_to"] = assignee
-
-    _update_ticket(id, fields, "CONFIRMADO")
+    # Asignación simple (menor backlog del área); pick + update in one transaction
+    with db_transaction() as conn:
+        assignee = pick_assignee(t['org_id'], t['area'], conn=conn)
+        fields = {"estado": "ASIGNADO"}
+        if assignee:
+            fields["assigned_to"] = assignee
+        _update_ticket(id, fields, "CONFIRMADO", conn=conn)
 
     # Notificar técnico por WhatsApp si hay teléfono
     if assignee:
-        tech = fetchone("SELECT telefono FROM Users WHERE id=?", (assignee,))
-        to_phone = (tech.get('telefono') if tech else None) or ""
-        if to_phone.strip():
-            try:
-                _notify_tech_assignment(
-                    to_phone=to_phone,
-                    ticket_id=id,
-                    area=t['area'],
-                    prioridad=t['prioridad'],
-                    detalle=t['detalle'],
-                    ubicacion=t['ubicacion']
-                )
-            except Exception as e:
-                print(f"[WA] notify tech assignment failed: {e}", flush=True)
+        _notify_assignee(assignee, t)
 
     flash('Ticket confirmado y asignado.' if assignee else 'Ticket confirmado (sin asignar).', 'success')
     return redirect(url_for('tickets'))
 
+def _notify_assignee(assignee: int, t):
+    """WA notice to the assigned tech, if they have a phone. Never raises."""
+    tech = fetchone("SELECT telefono FROM Users WHERE id=?", (assignee,))
+    to_phone = (tech['telefono'] if tech else None) or ""
+    if to_phone.strip():
+        try:
+            _notify_tech_assignment(
+                to_phone=to_phone,
+                ticket_id=t['id'],
+                area=t['area'],
+                prioridad=t['prioridad'],
+                detalle=t['detalle'],
+                ubicacion=t['ubicacion']
+            )
+        except Exception as e:
+            print(f"[WA] notify tech assignment failed: {e}", flush=True)
+
+@app.post('/tickets/bulk/confirm')
+@require_perm('ticket.confirm')
+def tickets_bulk_confirm():
+    """Confirm several pending tickets at once (form field ids=…); one transaction for all of them."""
+    if 'user' not in session:
+        return redirect(url_for('login'))
+
+    org_id, _ = current_scope()
+    ids = [int(x) for x in request.form.getlist('ids') if str(x).isdigit()]
+    if not org_id or not ids:
+        flash('No hay tickets seleccionados.', 'error')
+        return redirect(url_for('tickets'))
+
+    ids_sql, ids_params = _in_clause("id", ids)
+    rows = fetchall(f"""
+        SELECT id, org_id, area, prioridad, estado, detalle, ubicacion, assigned_to
+        FROM Tickets
+        WHERE org_id=? AND estado IN ('PENDIENTE_APROBACION','PENDIENTE')
+          AND {ids_sql}
+        ORDER BY id
+    """, (org_id, *ids_params))
+    if not rows:
+        flash('Solo puedes confirmar/aprobar tickets pendientes.', 'error')
+        return redirect(url_for('tickets'))
+
+    # SUPERVISOR: solo su área
+    if current_org_role() == 'SUPERVISOR':
+        for area in {t['area'] for t in rows}:
+            _require_area_manage(area)
+
+    # Same rule as pick_assignee (least open backlog), but the backlog is read once
+    # per area and bumped locally so a batch spreads across the team.
+    assigned = []
+    with db_transaction() as conn:
+        heaps = {}
+        updates = []
+        for t in rows:
+            if t['area'] not in heaps:
+                heaps[t['area']] = [list(x) for x in tech_backlog(org_id, t['area'], conn=conn)]
+                heapq.heapify(heaps[t['area']])
+            heap = heaps[t['area']]
+            fields = {"estado": "ASIGNADO"}
+            if heap:
+                backlog, assignee = heapq.heappop(heap)
+                heapq.heappush(heap, [backlog + 1, assignee])
+                fields["assigned_to"] = assignee
+                assigned.append((assignee, t))
+            updates.append((t['id'], fields, "CONFIRMADO", None))
+        _update_tickets_bulk(updates, conn=conn)
+
+    for assignee, t in assigned:
+        _notify_assignee(assignee, t)
+
+    flash(f'{len(rows)} tickets confirmados ({len(assigned)} asignados).', 'success')
+    return redirect(url_for('tickets'))
+
+
+
+# States that count towards a technician's backlog when auto-assigning
+BACKLOG_STATES = ('PENDIENTE','ASIGNADO','ACEPTADO','EN_CURSO','PAUSADO','DERIVADO')
+_BACKLOG_STATES_PH = ",".join(["?"] * len(BACKLOG_STATES))
 
+# One round-trip: rank techs by open backlog in SQL (DISTINCT because a
+# tech can match through several OrgUserAreas rows).
+_TECH_BACKLOG_SQL = f"""
+    SELECT u.id, COUNT(DISTINCT t.id) AS backlog
+    FROM Users u
+    JOIN OrgUsers ou ON ou.user_id=u.id AND ou.org_id=?
+    LEFT JOIN OrgUserAreas oa ON oa.org_id=ou.org_id AND oa.user_id=ou.user_id
+    LEFT JOIN Tickets t ON t.assigned_to=u.id AND t.org_id=?
+                       AND t.estado IN ({_BACKLOG_STATES_PH})
+    WHERE ou.role='TECNICO' AND (oa.area_code=? OR u.area=?)
+    GROUP BY u.id
+    ORDER BY backlog ASC, u.id ASC
+"""
 
-def pick_assignee(org_id: int, area: str) -> int | None:
+def pick_assignee(org_id: int, area: str, conn=None) -> int | None:
     """
     MVP assignment:
     - Busca técnicos del área en la org (via OrgUsers.role='TECNICO' + OrgUserAreas)
     - Elige el de menor backlog abierto
+    Pass conn to run inside an open db_transaction(); errors then propagate, since
+    on Postgres a failed statement has already aborted the caller's transaction.
     """
+    query = _TECH_BACKLOG_SQL + " LIMIT 1"
+    params = (org_id, org_id, *BACKLOG_STATES, area, area)
+    if conn is not None:
+        row = _execute(conn, query, params).fetchone()
+        return row['id'] if row else None
     try:
-        techs = fetchall("""
-            SELECT u.id
-            FROM Users u
-            JOIN OrgUsers ou ON ou.user_id=u.id AND ou.org_id=?
-            LEFT JOIN OrgUserAreas oa ON oa.org_id=ou.org_id AND oa.user_id=ou.user_id
-            WHERE ou.role='TECNICO' AND (oa.area_code=? OR u.area=?)
-        """, (org_id, area, area))
-        if not techs:
-            return None
-        # pick least loaded
-        best = None
-        best_count = 1e9
-        for r in techs:
-            c = fetchone("""
-                SELECT COUNT(1) c FROM Tickets
-                 WHERE org_id=? AND assigned_to=? AND estado IN ('PENDIENTE','ASIGNADO','ACEPTADO','EN_CURSO','PAUSADO','DERIVADO')
-            """, (org_id, r['id']))['c']
-            if c < best_count:
-                best = r['id']; best_count = c
-        return best
+        row = fetchone(query, params)
+        return row['id'] if row else None
     except Exception:
         return None
+
+def tech_backlog(org_id: int, area: str, conn=None) -> list[tuple[int, int]]:
+    """(backlog, user_id) for every tech of the area, least loaded first."""
+    params = (org_id, org_id, *BACKLOG_STATES, area, area)
+    rows = (_execute(conn, _TECH_BACKLOG_SQL, params).fetchall() if conn is not None
+            else fetchall(_TECH_BACKLOG_SQL, params))
+    return [(r['backlog'], r['id']) for r in rows]
     
 # --- Logical state guards for transitions (backend truth) ---
 ALLOWED_TRANSITIONS = {
@@ -2001,16 +2402,46 @@ def _guard_transition(t, allowed: set, verb_es: str):
 
 
 # ---------------------------- transitions ----------------------------
-def _update_ticket(id, fields: dict, action: str, motivo: str | None = None):
-    sets = ", ".join([f"{k}=?" for k in fields.keys()])
+@lru_cache(maxsize=64)
+def _update_sql(keys: tuple[str, ...]) -> str:
+    """UPDATE text per field-set shape (ordered, since params follow the keys)."""
+    sets = ", ".join([f"{k}=?" for k in keys])
+    return f"UPDATE Tickets SET {sets} WHERE id=?"
+
+def _update_ticket(id, fields: dict, action: str, motivo: str | None = None, conn=None):
+    """UPDATE Tickets + TicketHistory row as one transaction (or inside the caller's)."""
+    if conn is None:
+        with db_transaction() as conn:
+            return _update_ticket(id, fields, action, motivo, conn=conn)
     params = list(fields.values()) + [id]
-    execute(f"UPDATE Tickets SET {sets} WHERE id=?", params)
-    execute("""INSERT INTO TicketHistory(ticket_id, actor_user_id, action, motivo, at)
+    _execute(conn, _update_sql(tuple(fields.keys())), params)
+    _execute(conn, """INSERT INTO TicketHistory(ticket_id, actor_user_id, action, motivo, at)
                VALUES (?,?,?,?,?)""",
-            (id, session['user']['id'], action, motivo, datetime.now().isoformat()))
+             (id, session['user']['id'], action, motivo, datetime.now().isoformat()))
+
+def _update_tickets_bulk(updates, conn=None):
+    """
+    Bulk form of _update_ticket: updates = [(id, fields, action, motivo), ...].
+    One executemany per field-set shape plus one for all TicketHistory rows.
+    """
+    if not updates:
+        return
+    if conn is None:
+        with db_transaction() as conn:
+            return _update_tickets_bulk(updates, conn=conn)
+    by_shape = {}
+    for id, fields, _action, _motivo in updates:
+        by_shape.setdefault(tuple(fields.keys()), []).append([*fields.values(), id])
+    for keys, rows in by_shape.items():
+        _executemany(conn, _update_sql(keys), rows)
+    actor, at = session['user']['id'], datetime.now().isoformat()
+    _executemany(conn, """INSERT INTO TicketHistory(ticket_id, actor_user_id, action, motivo, at)
+                   VALUES (?,?,?,?,?)""",
+                 [(id, actor, action, motivo, at) for id, _f, action, motivo in updates])
 
 def _get_ticket_or_abort(id: int):
-    t = fetchone("SELECT * FROM Tickets WHERE id=?", (id,))
+    # Only what the transition guards/handlers read; add columns here if a handler needs more.
+    t = fetchone("SELECT id, org_id, area, estado, assigned_to, created_at FROM Tickets WHERE id=?", (id,))
     if not t:
         flash('Ticket no encontrado.', 'error')
         return None
@@ -2021,34 +2452,49 @@ def _get_ticket_or_abort(id: int):
         return None
     return t
 
+def with_ticket(verb_es: str, transition: str | None = None, allow_unassigned: bool = False):
+    """
+    Common guards for ticket transition handlers; the view receives (id, t).
+    Order: login -> ticket in org -> active shift -> state flow -> role scope.
+    TECNICO must be the assignee (allow_unassigned: or nobody is assigned);
+    SUPERVISOR must manage the ticket's area.
+    """
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(id, *a, **kw):
+            if 'user' not in session:
+                return _err_or_redirect('No autenticado.', 401)
+
+            t = _get_ticket_or_abort(id)
+            if t is None:
+                return _err_or_redirect('Ticket no encontrado.', 404)
+
+            bad = _guard_active_shift(t['area'])
+            if bad:
+                return bad
+
+            # Enforce logical flow
+            if transition:
+                bad = _guard_transition(t, ALLOWED_TRANSITIONS[transition], verb_es)
+                if bad:
+                    return bad
+
+            role = current_org_role()
+            if role == 'TECNICO' and t['assigned_to'] != session['user']['id'] \
+                    and (t['assigned_to'] or not allow_unassigned):
+                return _err_or_redirect(f'Solo puedes {verb_es} tus tickets.', 403)
+            if role == 'SUPERVISOR':
+                _require_area_manage(t['area'])
+
+            return fn(id, t, *a, **kw)
+        return wrapper
+    return deco
+
 @app.post('/tickets/<int:id>/accept')
 @require_perm('ticket.transition.accept')
-def ticket_accept(id):
-    if 'user' not in session:
-        return _err_or_redirect('No autenticado.', 401)
-
-    t = _get_ticket_or_abort(id)
-    if t is None:
-        return _err_or_redirect('Ticket no encontrado.', 404)
-    
-    bad_shift = _guard_active_shift(t.get('area'))
-    if bad_shift: 
-        return bad_shift
-
-    # Enforce logical flow
-    bad = _guard_transition(t, ALLOWED_TRANSITIONS["accept"], "aceptar")
-    if bad: return bad
-
-    role = current_org_role()
-
-    # Técnico: solo si es el asignado (o se autoasigna si no hay asignado)
-    if role == 'TECNICO' and t['assigned_to'] and t['assigned_to'] != session['user']['id']:
-        return _err_or_redirect('Solo puedes aceptar tus tickets.', 403)
-
-    # Supervisor: solo su área
-    if role == 'SUPERVISOR':
-        _require_area_manage(t['area'])
-
+@with_ticket('aceptar', 'accept', allow_unassigned=True)
+def ticket_accept(id, t):
+    # Técnico sin asignado se autoasigna
     _update_ticket(
         id,
         {
@@ -2064,28 +2510,8 @@ def ticket_accept(id):
 
 @app.post('/tickets/<int:id>/start')
 @require_perm('ticket.transition.start')
-def ticket_start(id):
-    if 'user' not in session:
-        return _err_or_redirect('No autenticado.', 401)
-
-    t = _get_ticket_or_abort(id)
-    if t is None:
-        return _err_or_redirect('Ticket no encontrado.', 404)
-    
-    bad_shift = _guard_active_shift(t.get('area'))
-    if bad_shift: 
-        return bad_shift
-
-    # Must be ACEPTADO (do not allow from PAUSADO; use /resume)
-    bad = _guard_transition(t, ALLOWED_TRANSITIONS["start"], "iniciar")
-    if bad: return bad
-
-    role = current_org_role()
-    if role == 'TECNICO' and t['assigned_to'] != session['user']['id']:
-        return _err_or_redirect('Solo puedes iniciar tus tickets.', 403)
-    if role == 'SUPERVISOR':
-        _require_area_manage(t['area'])
-
+@with_ticket('iniciar', 'start')   # only from ACEPTADO (PAUSADO goes through /resume)
+def ticket_start(id, t):
     _update_ticket(
         id,
         {"estado": "EN_CURSO", "started_at": datetime.now().isoformat()},
@@ -2097,28 +2523,8 @@ def ticket_start(id):
 
 @app.post('/tickets/<int:id>/pause')
 @require_perm('ticket.transition.pause')
-def ticket_pause(id):
-    if 'user' not in session:
-        return _err_or_redirect('No autenticado.', 401)
-
-    t = _get_ticket_or_abort(id)
-    if t is None:
-        return _err_or_redirect('Ticket no encontrado.', 404)
-    
-    bad_shift = _guard_active_shift(t.get('area'))
-    if bad_shift: 
-        return bad_shift
-
-    # Only from EN_CURSO
-    bad = _guard_transition(t, ALLOWED_TRANSITIONS["pause"], "pausar")
-    if bad: return bad
-
-    role = current_org_role()
-    if role == 'TECNICO' and t['assigned_to'] != session['user']['id']:
-        return _err_or_redirect('Solo puedes pausar tus tickets.', 403)
-    if role == 'SUPERVISOR':
-        _require_area_manage(t['area'])
-
+@with_ticket('pausar', 'pause')
+def ticket_pause(id, t):
     motivo = (request.form.get('motivo') or '').strip()
     _update_ticket(id, {"estado": "PAUSADO"}, "PAUSADO", motivo)
     return _ok_or_redirect('Ticket en pausa.', ticket_id=id, new_estado='PAUSADO')
@@ -2127,28 +2533,8 @@ def ticket_pause(id):
 
 @app.post('/tickets/<int:id>/resume')
 @require_perm('ticket.transition.resume')
-def ticket_resume(id):
-    if 'user' not in session:
-        return _err_or_redirect('No autenticado.', 401)
-
-    t = _get_ticket_or_abort(id)
-    if t is None:
-        return _err_or_redirect('Ticket no encontrado.', 404)
-    
-    bad_shift = _guard_active_shift(t.get('area'))
-    if bad_shift: 
-        return bad_shift
-
-    # Only from PAUSADO
-    bad = _guard_transition(t, ALLOWED_TRANSITIONS["resume"], "reanudar")
-    if bad: return bad
-
-    role = current_org_role()
-    if role == 'TECNICO' and t['assigned_to'] != session['user']['id']:
-        return _err_or_redirect('Solo puedes reanudar tus tickets.', 403)
-    if role == 'SUPERVISOR':
-        _require_area_manage(t['area'])
-
+@with_ticket('reanudar', 'resume')
+def ticket_resume(id, t):
     _update_ticket(id, {"estado": "EN_CURSO"}, "REANUDADO")
     return _ok_or_redirect('Ticket reanudado.', ticket_id=id, new_estado='EN_CURSO')
 
@@ -2156,26 +2542,8 @@ def ticket_resume(id):
 
 @app.post('/tickets/<int:id>/finish')
 @require_perm('ticket.transition.finish')
-def ticket_finish(id):
-    if 'user' not in session:
-        return _err_or_redirect('No autenticado.', 401)
-
-    t = _get_ticket_or_abort(id)
-    if t is None:
-        return _err_or_redirect('Ticket no encontrado.', 404)
-    
-    bad_shift = _guard_active_shift(t.get('area'))
-    if bad_shift: 
-        return bad_shift
-
-    role = current_org_role()
-
-    if role == 'TECNICO' and t['assigned_to'] != session['user']['id']:
-        return _err_or_redirect('Solo puedes finalizar tus tickets.', 403)
-
-    if role == 'SUPERVISOR':
-        _require_area_manage(t['area'])
-
+@with_ticket('finalizar')
+def ticket_finish(id, t):
     _update_ticket(
         id,
         {"estado": "RESUELTO", "finished_at": datetime.now().isoformat()},
@@ -2230,7 +2598,7 @@ def api_sup_backlog_by_tech():
     if not user:
         return _must_login_json()
     org_id, _hotel_id = current_scope()
-    where = ["t.org_id = ?","t.estado IN (" + ",".join(["?"]*len(OPEN_STATES)) + ")"]
+    where = ["t.org_id = ?", f"t.estado IN ({_OPEN_STATES_PH})"]
     params = [org_id, *OPEN_STATES]
 
     rows = fetchall(
@@ -2255,7 +2623,7 @@ def api_sup_open_by_priority():
     if not user:
         return _must_login_json()
     org_id, _hotel_id = current_scope()
-    where = ["org_id = ?","estado IN (" + ",".join(["?"]*len(OPEN_STATES)) + ")"]
+    where = ["org_id = ?", f"estado IN ({_OPEN_STATES_PH})"]
     params = [org_id, *OPEN_STATES]
 
     rows = fetchall(
@@ -2278,6 +2646,43 @@ def api_sup_open_by_priority():
         "values": [r['c'] for r in rows],
     })
 
+# Both chart aggregates in one round trip (first paint of the supervisor dashboard)
+_SUP_SUMMARY_SQL = f"""
+    SELECT 'backlog_by_tech' AS k, COALESCE(u.username,'(sin asignar)') AS label, COUNT(1) AS c, 0 AS ord
+    FROM Tickets t
+    LEFT JOIN Users u ON u.id = t.assigned_to
+    WHERE t.org_id = ? AND t.estado IN ({_OPEN_STATES_PH})
+    GROUP BY 2
+    UNION ALL
+    SELECT 'open_by_priority' AS k, prioridad AS label, COUNT(1) AS c,
+           CASE prioridad
+               WHEN 'URGENTE' THEN 1
+               WHEN 'ALTA'    THEN 2
+               WHEN 'MEDIA'   THEN 3
+               WHEN 'BAJA'    THEN 4
+               ELSE 5 END AS ord
+    FROM Tickets
+    WHERE org_id = ? AND estado IN ({_OPEN_STATES_PH})
+    GROUP BY 2
+    ORDER BY k, ord, c DESC
+"""
+
+@app.get('/api/supervisor/summary')
+def api_sup_summary():
+    user = session.get('user')
+    if not user:
+        return _must_login_json()
+    org_id, _hotel_id = current_scope()
+
+    rows = fetchall(_SUP_SUMMARY_SQL, (org_id, *OPEN_STATES, org_id, *OPEN_STATES))
+    out = {"backlog_by_tech": {"labels": [], "values": []},
+           "open_by_priority": {"labels": [], "values": []}}
+    for r in rows:
+        chart = out[r['k']]
+        chart["labels"].append(r['label'])
+        chart["values"].append(r['c'])
+    return jsonify(out)
+
 # ---------------------------- Supervisor: team performance (30d) ----------------------------
 @app.get('/api/supervisor/team_stats')
 def api_supervisor_team_stats():
@@ -2630,14 +3035,17 @@ def admin_super():
             flash('Organización creada.', 'success')
             return redirect(url_for('admin_super'))
 
-    # orgs with counts
+    # orgs with counts (each table aggregated once, then joined)
     orgs = fetchall("""
         SELECT
           o.id, o.name, o.created_at,
-          (SELECT COUNT(1) FROM Hotels h WHERE h.org_id=o.id) AS hotels,
-          (SELECT COUNT(1) FROM OrgUsers ou WHERE ou.org_id=o.id) AS members,
-          (SELECT COUNT(1) FROM Tickets t WHERE t.org_id=o.id) AS tickets
+          COALESCE(h.c, 0)  AS hotels,
+          COALESCE(ou.c, 0) AS members,
+          COALESCE(t.c, 0)  AS tickets
         FROM Orgs o
+        LEFT JOIN (SELECT org_id, COUNT(1) AS c FROM Hotels   GROUP BY org_id) h  ON h.org_id  = o.id
+        LEFT JOIN (SELECT org_id, COUNT(1) AS c FROM OrgUsers GROUP BY org_id) ou ON ou.org_id = o.id
+        LEFT JOIN (SELECT org_id, COUNT(1) AS c FROM Tickets  GROUP BY org_id) t  ON t.org_id  = o.id
         ORDER BY o.id DESC
     """)
 
@@ -2700,8 +3108,7 @@ def admin_org_members_add(org_id):
         # Use real booleans for Postgres; SQLite will coerce them to 1/0.
         execute("""INSERT INTO Users(username,email,password_hash,role,area,telefono,activo,is_superadmin)
                 VALUES (?,?,?,?,?,?,?,?)""",
-                #Mention and use of hp so we might have to redifine
-                (username, email, hp(password), base_role, default_area, None, True, False))
+                (username, email, hash_password(password), base_role, default_area, None, True, False))
 
         u = fetchone("SELECT id FROM Users WHERE email=?", (email,))
 
@@ -2751,6 +3158,7 @@ def sudo_set():
             hotel_id = h['id'] if h else None
     if hotel_id:
         session['hotel_id'] = hotel_id
+    cache_scope_in_session()
     flash('Contexto actualizado.', 'success')
     return redirect(url_for('admin_super'))
 
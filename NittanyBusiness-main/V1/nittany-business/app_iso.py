@@ -1,12 +1,41 @@
+import atexit
+import gzip
+import io
 import os
+import queue
 import re
 import sqlite3 as sql
-import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, Future
 from datetime import datetime, timedelta
-from typing import Optional, Tuple, Dict, Any, List
+from typing import Optional, Tuple, Dict, Any, List, BinaryIO, Union
 
 from flask import Flask, jsonify, request, send_from_directory, render_template
 
+try:
+    import ahocorasick   # pyahocorasick (C extension); optional, NLU falls back to regex
+except ImportError:
+    ahocorasick = None
+
+try:
+    import orjson   # optional; faster JSON for the API replies
+except ImportError:
+    orjson = None
+
+try:
+    from gevent import monkey as _gevent_monkey
+except ImportError:
+    _gevent_monkey = None
+# True under `gunicorn -k gevent` (the worker patches the stdlib before importing us).
+GEVENT = bool(_gevent_monkey and _gevent_monkey.is_module_patched("threading"))
+
+try:
+    from flask_compress import Compress   # optional; brotli/gzip for every route
+except ImportError:
+    Compress = None
+
 # -----------------------------------------------------------------------------
 # Config
 # -----------------------------------------------------------------------------
@@ -15,37 +44,186 @@ DEFAULT_ORG_ID = int(os.getenv("DEFAULT_ORG_ID", "1"))       # <- set these to s
 DEFAULT_HOTEL_ID = int(os.getenv("DEFAULT_HOTEL_ID", "1"))
 
 STT_BACKEND = os.getenv("STT_BACKEND", "local")              # 'local' (faster-whisper). You can add 'openai' later.
-STT_MODEL = os.getenv("STT_MODEL", "small")                  # tiny|base|small|medium|large-v3 etc.
+# base is enough for short hotel phrases in Spanish; bump to small/medium for noisy lobbies.
+STT_MODEL = os.getenv("STT_MODEL", "base")                   # tiny|base|small|medium|large-v3, or a CT2 model dir (see stt-convert)
 STT_LANGUAGE = os.getenv("STT_LANGUAGE", "es")               # Spanish by default
-COMPUTE_TYPE = os.getenv("STT_COMPUTE_TYPE", "int8")         # int8/int8_float16/float16 depending on CPU/GPU
+STT_DEVICE = os.getenv("STT_DEVICE", "auto")                 # auto|cpu|cuda
+COMPUTE_TYPE = os.getenv("STT_COMPUTE_TYPE", "auto")         # auto = fastest supported (int8 on CPU, int8_float16 on GPU)
+STT_CPU_THREADS = int(os.getenv("STT_CPU_THREADS", str(os.cpu_count() or 4)))
+STT_MODELS_DIR = os.getenv("STT_MODELS_DIR", "models")
+STT_BEAM = int(os.getenv("STT_BEAM", "1"))                   # greedy for short dictations; ?careful=1 uses STT_BEAM_CAREFUL
+STT_BEAM_CAREFUL = int(os.getenv("STT_BEAM_CAREFUL", "5"))
+STT_WORKERS = int(os.getenv("STT_WORKERS", "2"))             # concurrent transcriptions per process
+STT_JOB_TTL = int(os.getenv("STT_JOB_TTL", "300"))           # seconds an unpolled result is kept
+STT_BATCH = int(os.getenv("STT_BATCH", "1"))                 # max utterances per encoder call (opt-in; 1 = no batching)
+STT_BATCH_WAIT_MS = int(os.getenv("STT_BATCH_WAIT_MS", "50"))  # how long the batcher waits to fill a batch
 
 # -----------------------------------------------------------------------------
 # Flask
 # -----------------------------------------------------------------------------
 app = Flask(__name__)
 
+def ojson(payload: Dict[str, Any], status: int = 200):
+    """jsonify() for the API routes, serialized straight to UTF-8 bytes by orjson when available."""
+    if orjson is None:
+        return jsonify(payload), status
+    return app.response_class(orjson.dumps(payload), status=status, mimetype="application/json")
+
+# Compress JSON replies (extract echoes the whole detalle back). flask-compress
+# if installed, otherwise a plain gzip after_request hook.
+COMPRESS_MIN_SIZE = 512
+if Compress is not None:
+    app.config.update(COMPRESS_MIN_SIZE=COMPRESS_MIN_SIZE,
+                      COMPRESS_ALGORITHM=["br", "gzip"],
+                      COMPRESS_MIMETYPES=["application/json", "text/html", "text/css", "application/javascript"])
+    Compress(app)
+else:
+    @app.after_request
+    def _gzip_json(resp):
+        if (resp.mimetype != "application/json" or resp.direct_passthrough
+                or "Content-Encoding" in resp.headers
+                or "gzip" not in request.headers.get("Accept-Encoding", "")):
+            return resp
+        body = resp.get_data()
+        if len(body) < COMPRESS_MIN_SIZE:
+            return resp
+        resp.set_data(gzip.compress(body, compresslevel=6))
+        resp.headers["Content-Encoding"] = "gzip"
+        resp.vary.add("Accept-Encoding")
+        return resp
+
 # -----------------------------------------------------------------------------
 # DB helpers
 # -----------------------------------------------------------------------------
+# Under gevent every request is a greenlet on one OS thread; a real thread-local
+# gives the worker one shared connection instead of one per greenlet (sqlite
+# calls never yield, so `with db()` blocks still run one at a time).
+_local = _gevent_monkey.get_original("threading", "local")() if GEVENT else threading.local()
+_all_conns: List[sql.Connection] = []   # closed at exit
+
 def db():
-    conn = sql.connect(DB_PATH)
-    conn.row_factory = sql.Row
-    conn.execute("PRAGMA foreign_keys = ON;")
+    """
+    One long-lived connection per thread (WAL, relaxed fsync) instead of a
+    connect/PRAGMA/close per query. `with db() as conn:` still commits or
+    rolls back; it just doesn't close.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sql.connect(DB_PATH, check_same_thread=False, cached_statements=512)
+        conn.row_factory = sql.Row
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("PRAGMA temp_store=MEMORY;")
+        conn.execute("PRAGMA cache_size=-20000;")    # ~20 MB page cache
+        conn.execute("PRAGMA foreign_keys = ON;")
+        _local.conn = conn
+        _all_conns.append(conn)
     return conn
 
+@atexit.register
+def _close_conns():
+    for conn in _all_conns:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
 def fetchone(q: str, params=()):
     with db() as conn:
         cur = conn.execute(q, params)
         return cur.fetchone()
 
+def fetchall_tuples(q: str, params=()) -> List[tuple]:
+    """Plain tuple rows (no sqlite3.Row wrapper) for internal lookups; index by column position."""
+    cur = db().cursor()
+    cur.row_factory = None
+    return cur.execute(q, params).fetchall()
+
 def execute(q: str, params=()):
     with db() as conn:
         conn.execute(q, params)
         conn.commit()
 
+# Composite index for the scoped ticket listings (org, hotel, estado, newest first).
+# SLARules(area, prioridad) is already covered by idx_sla_unique from the schema.
+SCOPE_INDEX_SQL = ("CREATE INDEX IF NOT EXISTS idx_tickets_scope_estado "
+                   "ON Tickets(org_id, hotel_id, estado, created_at DESC)")
+
+def ensure_indexes() -> None:
+    """
+    Create the listing index at startup and ANALYZE when it is new, so the
+    planner has stats for it. Uses its own connection: with --preload this runs
+    in the gunicorn master, and a sqlite handle must not cross the fork.
+    Only opens an existing database; a missing file is logged, not created.
+    """
+    if not os.path.exists(DB_PATH):
+        print(f"[BOOT] ensure_indexes skipped: {DB_PATH} not found (run the seeder first)", flush=True)
+        return
+    conn = sql.connect(DB_PATH)
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_tickets_scope_estado'"
+        ).fetchone()
+        if not exists:
+            conn.execute(SCOPE_INDEX_SQL)
+            conn.execute("ANALYZE")
+            conn.commit()
+    except sql.OperationalError as e:    # schema not created yet (run the seeder first)
+        print(f"[BOOT] ensure_indexes skipped: {e}", flush=True)
+    finally:
+        conn.close()
+
+ensure_indexes()
+
+# SLARules is static config: read it once, then every lookup is a dict hit.
+# POST /admin/sla/reload after editing the rules.
+_sla_cache: Optional[Dict[Tuple[str, str], int]] = None
+
+def load_sla_rules() -> Dict[Tuple[str, str], int]:
+    global _sla_cache
+    rows = fetchall_tuples("SELECT area, prioridad, max_minutes FROM SLARules WHERE max_minutes IS NOT NULL")
+    _sla_cache = {(area, prio): int(mins) for area, prio, mins in rows}
+    return _sla_cache
+
 def sla_minutes(area: str, prioridad: str) -> Optional[int]:
-    row = fetchone("SELECT max_minutes FROM SLARules WHERE area=? AND prioridad=?", (area, prioridad))
-    return int(row["max_minutes"]) if row else None
+    rules = _sla_cache if _sla_cache is not None else load_sla_rules()
+    return rules.get((area, prioridad))
+
+# Statement text kept constant so the connection's statement cache reuses the plan.
+INSERT_TICKET_SQL = """
+    INSERT INTO Tickets(
+      org_id, hotel_id, area, prioridad, estado, detalle, canal_origen, ubicacion,
+      huesped_id, created_at, due_at, assigned_to, created_by, confidence_score,
+      qr_required, accepted_at, started_at, finished_at
+    ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+"""
+INSERT_HISTORY_SQL = """
+    INSERT INTO TicketHistory(ticket_id, actor_user_id, action, motivo, at)
+    VALUES(?,?,?,?,?)
+"""
+_CREATED_AT_COL = 9   # position of created_at in an INSERT_TICKET_SQL row
+
+def _insert_tickets_bulk(rows: List[tuple]) -> List[int]:
+    """
+    Insert many tickets (rows in INSERT_TICKET_SQL order) plus their CREADO history
+    in one BEGIN IMMEDIATE transaction, two executemany calls. Returns the new ids.
+    The write lock is held throughout, so the new rowids are consecutive.
+    """
+    if not rows:
+        return []
+    conn = db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(INSERT_TICKET_SQL, rows)
+        last = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        ids = list(range(last - len(rows) + 1, last + 1))
+        conn.executemany(INSERT_HISTORY_SQL,
+                         [(tid, None, "CREADO", None, r[_CREATED_AT_COL]) for tid, r in zip(ids, rows)])
+        conn.commit()
+        return ids
+    except Exception:
+        conn.rollback()
+        raise
 
 def compute_due(created_at: datetime, area: str, prioridad: str) -> Optional[str]:
     mins = sla_minutes(area, prioridad)
@@ -58,22 +236,44 @@ def compute_due(created_at: datetime, area: str, prioridad: str) -> Optional[str
 # -----------------------------------------------------------------------------
 _fw_model = None
 _fw_ready_error = None
+_fw_lock = threading.Lock()   # two first requests must not both build a WhisperModel
 
 def _load_fw():
-    """Lazy-load faster-whisper to speed app boot."""
+    """Load faster-whisper once per process (at import when PRELOAD_STT=1, else on first use)."""
     global _fw_model, _fw_ready_error
     if _fw_model is not None or _fw_ready_error:
         return
+    with _fw_lock:
+        if _fw_model is not None or _fw_ready_error:
+            return
+        _build_fw()
+
+def _build_fw():
+    global _fw_model, _fw_ready_error
     try:
         # Import here so you can still run the app without the package installed
         from faster_whisper import WhisperModel
-        _fw_model = WhisperModel(STT_MODEL, device="cpu", compute_type=COMPUTE_TYPE)
+        _fw_model = WhisperModel(
+            STT_MODEL,
+            device=STT_DEVICE,
+            compute_type=COMPUTE_TYPE,
+            cpu_threads=STT_CPU_THREADS,
+            num_workers=STT_WORKERS,
+        )
     except Exception as e:
         _fw_ready_error = f"faster-whisper not available: {e}"
 
-def stt_local_whisper(file_path: str) -> Tuple[Optional[str], Optional[str]]:
+# Warm the model when the worker imports the app, not on the first /api/stt.
+# With gunicorn --preload use gunicorn_iso.conf.py (post_fork) instead.
+if os.getenv("PRELOAD_STT", "1") == "1" and STT_BACKEND == "local":
+    _load_fw()
+
+def stt_local_whisper(audio: Union[str, BinaryIO], careful: bool = False) -> Tuple[Optional[str], Optional[str]]:
     """
-    Transcribe with faster-whisper.
+    Transcribe with faster-whisper. `audio` is a path, a file-like object
+    (decoded in-process by PyAV, no temp file needed) or 16 kHz samples.
+    Single-utterance tickets: greedy decoding with a temperature fallback;
+    careful=True re-runs with beam search.
     Returns (text, error).
     """
     _load_fw()
@@ -82,11 +282,15 @@ def stt_local_whisper(file_path: str) -> Tuple[Optional[str], Optional[str]]:
     try:
         # language hints & VAD to improve results with noisy recordings
         segments, info = _fw_model.transcribe(
-            file_path,
+            audio,
             language=STT_LANGUAGE,
             vad_filter=True,
             vad_parameters=dict(min_silence_duration_ms=200),
-            beam_size=5
+            beam_size=STT_BEAM_CAREFUL if careful else STT_BEAM,
+            best_of=1,
+            temperature=[0.0, 0.2],
+            condition_on_previous_text=False,   # avoids repetition loops on silence
+            without_timestamps=True,
         )
         text_parts = []
         for seg in segments:
@@ -97,6 +301,188 @@ def stt_local_whisper(file_path: str) -> Tuple[Optional[str], Optional[str]]:
     except Exception as e:
         return None, f"Error transcribiendo: {e}"
 
+@app.cli.command("stt-convert")
+def stt_convert():
+    """
+    Pre-quantize the Whisper model to an int8 CTranslate2 dir (run once at build time):
+      flask --app app_iso stt-convert
+    then point STT_MODEL at the printed dir so workers mmap it instead of converting on load.
+    """
+    import subprocess
+    name = os.path.basename(STT_MODEL.rstrip("/"))
+    out_dir = os.path.join(STT_MODELS_DIR, f"whisper-{name}-int8")
+    if os.path.isdir(out_dir):
+        print(f"{out_dir} already exists")
+    else:
+        subprocess.run([
+            "ct2-transformers-converter",
+            "--model", f"openai/whisper-{name}",
+            "--quantization", "int8",
+            "--copy_files", "tokenizer.json", "preprocessor_config.json",
+            "--output_dir", out_dir,
+        ], check=True)
+    print(f"export STT_MODEL={out_dir}")
+
+# Background transcription: /api/stt returns a job id right away and the client
+# polls /api/stt/<id>, so HTTP workers aren't held for the whole transcription.
+# Threads are enough: CTranslate2 releases the GIL and the model is shared
+# (num_workers=STT_WORKERS). Jobs live in this process, so run one gunicorn
+# worker (scale with --threads) or route polls back to the same worker.
+# Under gevent, ThreadPoolExecutor would run on greenlets and transcribe() would
+# stall the hub; gevent's executor keeps the work on native threads.
+if GEVENT:
+    from gevent.threadpool import ThreadPoolExecutor as _NativePool
+    STT_EXECUTOR = _NativePool(max_workers=STT_WORKERS)
+else:
+    STT_EXECUTOR = ThreadPoolExecutor(max_workers=STT_WORKERS, thread_name_prefix="stt")
+_stt_jobs: Dict[str, Tuple[Future, float]] = {}
+_stt_jobs_lock = threading.Lock()
+
+# Micro-batching (opt-in, STT_BATCH > 1): short greedy dictations arriving within
+# STT_BATCH_WAIT_MS of each other are VAD-trimmed, padded to one 30 s window each
+# and share a single encode/generate call. faster-whisper's BatchedInferencePipeline
+# only batches chunks of one file, so the batch is built here from the model's own
+# pieces. Longer audio, careful=1 requests and clips whose greedy pass would
+# trigger transcribe()'s temperature fallback go through stt_local_whisper.
+_stt_queue: "queue.Queue[Tuple[BinaryIO, Future]]" = queue.Queue()
+_batcher: Optional[threading.Thread] = None
+_batcher_lock = threading.Lock()
+# transcribe()'s defaults: a window is silent when no_speech_prob is high AND the
+# decode is unsure; low logprob or a repetitive text alone means "retry warmer".
+NO_SPEECH_PROB = 0.6
+LOG_PROB_THRESHOLD = -1.0
+COMPRESSION_RATIO_THRESHOLD = 2.4
+
+def _resolve_error(fut: Future, e: Exception) -> None:
+    if not fut.done():
+        fut.set_result((None, f"Error transcribiendo: {e}"))
+
+def _chain(src: Future, dst: Future) -> None:
+    def done(f: Future) -> None:
+        try:
+            dst.set_result(f.result())
+        except Exception as e:
+            _resolve_error(dst, e)
+    src.add_done_callback(done)
+
+def stt_batch_whisper(batch: List[Tuple[Any, Future]]) -> None:
+    """Decode and VAD-trim every clip, then transcribe the short ones in one batch. Resolves each future with (text, error)."""
+    from faster_whisper.audio import decode_audio, pad_or_trim
+    from faster_whisper.tokenizer import Tokenizer
+    from faster_whisper.transcribe import get_compression_ratio
+    from faster_whisper.vad import VadOptions, collect_chunks, get_speech_timestamps
+    import numpy as np
+
+    fe = _fw_model.feature_extractor
+    vad = VadOptions(min_silence_duration_ms=200)   # same VAD settings as stt_local_whisper
+    short = []
+    for audio, fut in batch:
+        try:
+            samples = decode_audio(audio, sampling_rate=fe.sampling_rate)
+            if len(samples) > fe.n_samples:
+                _chain(STT_EXECUTOR.submit(stt_local_whisper, samples), fut)
+                continue
+            speech = get_speech_timestamps(samples, vad)
+            if not speech:
+                fut.set_result((None, "No se detectó voz en el audio."))
+                continue
+            short.append((samples, np.concatenate(collect_chunks(samples, speech)[0]), fut))
+        except Exception as e:
+            _resolve_error(fut, e)
+    if not short:
+        return
+    try:
+        m = _fw_model
+        features = np.stack([pad_or_trim(fe(voiced)[..., :-1]) for _, voiced, _ in short])
+        tokenizer = Tokenizer(m.hf_tokenizer, m.model.is_multilingual,
+                              task="transcribe", language=STT_LANGUAGE)
+        prompt = m.get_prompt(tokenizer, [], without_timestamps=True)
+        results = m.model.generate(
+            m.encode(features),
+            [prompt] * len(short),
+            beam_size=STT_BEAM,
+            length_penalty=1,
+            max_length=m.max_length,
+            return_scores=True,
+            return_no_speech_prob=True,
+            suppress_blank=True,
+            suppress_tokens=[-1],
+        )
+        for (samples, _, fut), res in zip(short, results):
+            tokens = res.sequences_ids[0]
+            avg_logprob = res.scores[0] * len(tokens) / (len(tokens) + 1)   # as transcribe() recovers it
+            if res.no_speech_prob > NO_SPEECH_PROB and avg_logprob < LOG_PROB_THRESHOLD:
+                fut.set_result((None, "No se detectó voz en el audio."))
+                continue
+            text = tokenizer.decode(tokens).strip()
+            if avg_logprob < LOG_PROB_THRESHOLD or get_compression_ratio(text) > COMPRESSION_RATIO_THRESHOLD:
+                _chain(STT_EXECUTOR.submit(stt_local_whisper, samples), fut)   # temperature fallback
+                continue
+            fut.set_result(((text if text else None), (None if text else "No se detectó voz en el audio.")))
+    except Exception as e:
+        for _, _, fut in short:
+            _resolve_error(fut, e)
+
+def _batch_loop() -> None:
+    while True:
+        batch = [_stt_queue.get()]
+        try:
+            deadline = time.monotonic() + STT_BATCH_WAIT_MS / 1000
+            while len(batch) < STT_BATCH:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                try:
+                    batch.append(_stt_queue.get(timeout=left))
+                except queue.Empty:
+                    break
+            _load_fw()
+            if _fw_ready_error:
+                for _, fut in batch:
+                    fut.set_result((None, _fw_ready_error))
+                continue
+            if GEVENT:
+                STT_EXECUTOR.submit(stt_batch_whisper, batch).result()   # batcher is a greenlet; decode off-hub
+            else:
+                stt_batch_whisper(batch)
+        except Exception as e:
+            # never leave a client polling a future nobody will resolve
+            for _, fut in batch:
+                _resolve_error(fut, e)
+
+def _enqueue_stt(audio: BinaryIO) -> Future:
+    global _batcher
+    if _batcher is None or not _batcher.is_alive():
+        with _batcher_lock:
+            if _batcher is None or not _batcher.is_alive():
+                _batcher = threading.Thread(target=_batch_loop, name="stt-batch", daemon=True)
+                _batcher.start()
+    fut: Future = Future()
+    _stt_queue.put((audio, fut))
+    return fut
+
+def submit_stt_job(audio: BinaryIO, careful: bool = False) -> str:
+    jid = uuid.uuid4().hex
+    if STT_BATCH > 1 and not careful:
+        fut = _enqueue_stt(audio)
+    else:
+        fut = STT_EXECUTOR.submit(stt_local_whisper, audio, careful)
+    now = time.monotonic()
+    with _stt_jobs_lock:
+        for k, (f, t0) in list(_stt_jobs.items()):
+            if f.done() and now - t0 > STT_JOB_TTL:
+                del _stt_jobs[k]
+        _stt_jobs[jid] = (fut, now)
+    return jid
+
+def pop_stt_job(jid: str) -> Optional[Future]:
+    """The job's future; removed from the table once it is done."""
+    with _stt_jobs_lock:
+        entry = _stt_jobs.get(jid)
+        if entry and entry[0].done():
+            del _stt_jobs[jid]
+    return entry[0] if entry else None
+
 # -----------------------------------------------------------------------------
 # Lightweight NLU (Spanish heuristics)
 # -----------------------------------------------------------------------------
@@ -139,22 +525,61 @@ PRIORITY_BAJA = [
 
 ROOM_REGEX = re.compile(r"\b(?:hab(?:\.|itacion|itación)?\s*)?(\d{3,4})\b", re.IGNORECASE)
 
-def detect_area(text: str) -> Tuple[str, float]:
-    t = text.lower()
-    scores = {k: 0 for k in AREA_KEYWORDS.keys()}
-    for area, kws in AREA_KEYWORDS.items():
-        for kw in kws:
-            if kw in t:
-                scores[area] += 1
-    # default bucket if nothing matches: Mantención (most common)
-    best_area = max(scores, key=lambda k: scores[k])
-    conf = 0.5 + min(scores[best_area], 5) * 0.1 if scores[best_area] > 0 else 0.4
-    if all(v == 0 for v in scores.values()):
-        best_area = "MANTENCION"
-    return best_area, min(conf, 0.95)
-
-def detect_priority(text: str) -> Tuple[str, float]:
-    t = text.lower()
+# Built once at import: one alternation over every area keyword, and the per-word
+# location patterns. An area scores one point per distinct keyword present, however
+# often it appears. The lookahead reports the longest keyword starting at each
+# position (alternatives are longest first), and KW_CONTAINS adds the keywords
+# inside it ("toallas" also means "toalla" is present), so the found set is exactly
+# the keywords with `kw in t`.
+AREA_ORDER = tuple(AREA_KEYWORDS)      # scores are a fixed-size list indexed like this
+KW_TO_AREA = {kw: i for i, kws in enumerate(AREA_KEYWORDS.values()) for kw in kws}
+KW_CONTAINS = {kw: frozenset(k for k in KW_TO_AREA if k in kw) for kw in KW_TO_AREA}
+AREA_PATTERN = re.compile(
+    "(?=(" + "|".join(re.escape(k) for k in sorted(KW_TO_AREA, key=len, reverse=True)) + "))"
+)
+LOCATION_PATTERNS = {w: re.compile(rf"{re.escape(w)}\s*\w*", re.IGNORECASE) for w in LOCATION_WORDS}
+
+PRIORITY_TIERS = (("URGENTE", 0.9, PRIORITY_URG), ("ALTA", 0.8, PRIORITY_ALTA), ("BAJA", 0.7, PRIORITY_BAJA))
+
+def _build_automaton():
+    """One Aho–Corasick automaton over area keywords, priority phrases and location words."""
+    tags: Dict[str, list] = {}
+    for kw, idx in KW_TO_AREA.items():
+        tags.setdefault(kw, []).append(("AREA", idx))
+    for level, _conf, phrases in PRIORITY_TIERS:
+        for p in phrases:
+            tags.setdefault(p, []).append(("PRI", level))
+    for w in LOCATION_WORDS:
+        tags.setdefault(w, []).append(("LOC", w))
+    A = ahocorasick.Automaton()
+    for key, kt in tags.items():
+        A.add_word(key, (len(key), tuple(kt)))
+    A.make_automaton()
+    return A
+
+NLU_AUTOMATON = _build_automaton() if ahocorasick is not None else None
+
+# Detectors take an optional pre-lowercased `t` so extract_fields lowers once.
+def detect_area(text: str, t: Optional[str] = None) -> Tuple[str, float]:
+    t = text.lower() if t is None else t
+    found = set()
+    for m in AREA_PATTERN.finditer(t):
+        found |= KW_CONTAINS[m.group(1)]
+    scores = [0] * len(AREA_ORDER)
+    for kw in found:
+        scores[KW_TO_AREA[kw]] += 1
+    return _pick_area(scores)
+
+def _pick_area(scores: List[int]) -> Tuple[str, float]:
+    best = max(range(len(scores)), key=scores.__getitem__)   # first max wins ties
+    n = scores[best]
+    if n == 0:
+        # default bucket if nothing matches: Mantención (most common)
+        return "MANTENCION", 0.4
+    return AREA_ORDER[best], min(0.5 + min(n, 5) * 0.1, 0.95)
+
+def detect_priority(text: str, t: Optional[str] = None) -> Tuple[str, float]:
+    t = text.lower() if t is None else t
     if any(kw in t for kw in PRIORITY_URG):
         return "URGENTE", 0.9
     if any(kw in t for kw in PRIORITY_ALTA):
@@ -163,24 +588,63 @@ def detect_priority(text: str) -> Tuple[str, float]:
         return "BAJA", 0.7
     return "MEDIA", 0.6
 
-def detect_location(text: str) -> Optional[str]:
-    t = text.lower()
-    m = ROOM_REGEX.search(t)
+def detect_location(text: str, t: Optional[str] = None) -> Optional[str]:
+    t = text.lower() if t is None else t
+    m = ROOM_REGEX.search(text)       # case-insensitive; digits are all it captures
     if m:
         return m.group(1)
     for w in LOCATION_WORDS:
         if w in t:
             # allow variants like "pasillo 2F"
             # try to capture word + trailing token
-            patt = re.compile(rf"{w}\s*\w*", re.IGNORECASE)
-            m2 = patt.search(text)
+            m2 = LOCATION_PATTERNS[w].search(text)
             return m2.group(0) if m2 else w
     return None
 
+def _scan(text: str) -> Tuple[Tuple[str, float], Tuple[str, float], Optional[str]]:
+    """
+    detect_area + detect_priority + detect_location in one automaton pass.
+    Same answers as the three detectors: the automaton reports every occurrence,
+    overlapping ones included, so each distinct area keyword scores once; priority
+    and location follow tier/list order, not position.
+    """
+    t = text.lower()
+    area_hits, pri, locs = set(), set(), set()
+    for end, (n, kt) in NLU_AUTOMATON.iter(t):
+        for kind, val in kt:
+            if kind == "AREA":
+                area_hits.add(t[end - n + 1:end + 1])
+            elif kind == "PRI":
+                pri.add(val)
+            else:
+                locs.add(val)
+
+    scores = [0] * len(AREA_ORDER)
+    for kw in area_hits:
+        scores[KW_TO_AREA[kw]] += 1
+    area = _pick_area(scores)
+
+    prioridad = next(((lvl, c) for lvl, c, _ in PRIORITY_TIERS if lvl in pri), ("MEDIA", 0.6))
+
+    ubicacion = None
+    m = ROOM_REGEX.search(text)       # needs a capture group, so stays a regex
+    if m:
+        ubicacion = m.group(1)
+    else:
+        w = next((w for w in LOCATION_WORDS if w in locs), None)
+        if w:
+            m2 = LOCATION_PATTERNS[w].search(text)
+            ubicacion = m2.group(0) if m2 else w
+    return area, prioridad, ubicacion
+
 def extract_fields(text: str) -> Dict[str, Any]:
-    area, a_conf = detect_area(text)
-    prioridad, p_conf = detect_priority(text)
-    ubicacion = detect_location(text)
+    if NLU_AUTOMATON is not None:
+        (area, a_conf), (prioridad, p_conf), ubicacion = _scan(text)
+    else:
+        t = text.lower()
+        area, a_conf = detect_area(text, t)
+        prioridad, p_conf = detect_priority(text, t)
+        ubicacion = detect_location(text, t)
     detalle = text.strip()
     conf = round((a_conf + p_conf + (0.8 if ubicacion else 0.6)) / 3.0, 2)
     return {
@@ -203,34 +667,45 @@ def voice_page():
 def api_stt():
     """
     Multipart form: audio=<file>
-    Returns: { text: "..."} or { error: "..." }
+    Returns: 202 { job_id: "..." } -> poll GET /api/stt/<job_id>, or { error: "..." }
     """
     if "audio" not in request.files:
-        return jsonify({"error": "Falta el archivo 'audio'"}), 400
+        return ojson({"error": "Falta el archivo 'audio'"}, 400)
     f = request.files["audio"]
     if not f or f.filename == "":
-        return jsonify({"error": "Archivo inválido"}), 400
+        return ojson({"error": "Archivo inválido"}, 400)
+
+    # Keep the upload in memory; faster-whisper decodes from the buffer directly
+    audio = io.BytesIO(f.read())
+
+    if STT_BACKEND != "local":
+        # Placeholder for other backends (e.g. OpenAI). Add here if you wish.
+        return ojson({"error": "STT_BACKEND no soportado en este ejemplo. Use 'local'."}, 500)
 
-    # Persist to a temp file
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(f.filename)[1] or ".webm") as tmp:
-        f.save(tmp.name)
-        tmp_path = tmp.name
+    jid = submit_stt_job(audio, careful=request.args.get("careful") == "1")
+    return ojson({"job_id": jid}, 202)
 
+@app.get("/api/stt/<jid>")
+def api_stt_result(jid: str):
+    """
+    Returns: 202 { pending: true } while transcribing, then { text: "..." } or { error: "..." }
+    """
+    fut = pop_stt_job(jid)
+    if fut is None:
+        return ojson({"error": "Trabajo no encontrado"}, 404)
+    if not fut.done():
+        return ojson({"pending": True}, 202)
     try:
-        if STT_BACKEND == "local":
-            text, err = stt_local_whisper(tmp_path)
-        else:
-            # Placeholder for other backends (e.g. OpenAI). Add here if you wish.
-            text, err = None, "STT_BACKEND no soportado en este ejemplo. Use 'local'."
-
-        if err:
-            return jsonify({"error": err}), 500
-        return jsonify({"text": text or ""})
-    finally:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
+        text, err = fut.result()
+    except Exception as e:
+        text, err = None, f"Error transcribiendo: {e}"
+    if err:
+        return ojson({"error": err}, 500)
+    return ojson({"text": text or ""})
+
+@app.post("/admin/sla/reload")
+def admin_sla_reload():
+    return ojson({"ok": True, "rules": len(load_sla_rules())})
 
 @app.post("/api/extract")
 def api_extract():
@@ -241,9 +716,9 @@ def api_extract():
     data = request.get_json(silent=True) or {}
     text = (data.get("text") or "").strip()
     if not text:
-        return jsonify({"error": "Texto vacío"}), 400
+        return ojson({"error": "Texto vacío"}, 400)
     fields = extract_fields(text)
-    return jsonify({"fields": fields})
+    return ojson({"fields": fields})
 
 @app.post("/api/submit")
 def api_submit():
@@ -268,38 +743,30 @@ def api_submit():
     confidence_score = float(data.get("confidence_score") or 0.7)
 
     if not detalle:
-        return jsonify({"error": "Detalle es requerido"}), 400
+        return ojson({"error": "Detalle es requerido"}, 400)
 
     # Scope check
     if not DEFAULT_ORG_ID or not DEFAULT_HOTEL_ID:
-        return jsonify({"error": "DEFAULT_ORG_ID/DEFAULT_HOTEL_ID no configurados"}), 500
+        return ojson({"error": "DEFAULT_ORG_ID/DEFAULT_HOTEL_ID no configurados"}, 500)
 
     created_at = datetime.now()
+    ca = created_at.isoformat(timespec="seconds")
     due_at = compute_due(created_at, area, prioridad)
 
     try:
         with db() as conn:
-            cur = conn.execute("""
-                INSERT INTO Tickets(
-                  org_id, hotel_id, area, prioridad, estado, detalle, canal_origen, ubicacion,
-                  huesped_id, created_at, due_at, assigned_to, created_by, confidence_score,
-                  qr_required, accepted_at, started_at, finished_at
-                ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-            """, (
+            cur = conn.execute(INSERT_TICKET_SQL, (
                 DEFAULT_ORG_ID, DEFAULT_HOTEL_ID, area, prioridad, "PENDIENTE", detalle, canal, ubicacion,
-                huesped_id, created_at.isoformat(timespec="seconds"), due_at, None, None, confidence_score,
+                huesped_id, ca, due_at, None, None, confidence_score,
                 qr_required, None, None, None
             ))
             ticket_id = cur.lastrowid
 
-            conn.execute("""
-                INSERT INTO TicketHistory(ticket_id, actor_user_id, action, motivo, at)
-                VALUES(?,?,?,?,?)
-            """, (ticket_id, None, "CREADO", None, created_at.isoformat(timespec="seconds")))
+            conn.execute(INSERT_HISTORY_SQL, (ticket_id, None, "CREADO", None, ca))
 
-        return jsonify({"ok": True, "ticket_id": ticket_id})
+        return ojson({"ok": True, "ticket_id": ticket_id})
     except Exception as e:
-        return jsonify({"error": f"DB error: {e}"}), 500
+        return ojson({"error": f"DB error: {e}"}, 500)
 
 # -----------------------------------------------------------------------------
 # Run
@@ -1,26 +1,217 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, get_flashed_messages, session
+from flask import Flask, render_template, request, redirect, url_for, flash, get_flashed_messages, session, g
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from functools import lru_cache
 import sqlite3 as sql
 import os
 import hashlib
+import hmac
+import threading
+import time
 import uuid
 
+from initialize_db import create_cart_table, create_indexes, create_listing_seq_table, migrate_product_prices
+
+DATABASE = 'database.db'
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///nittanybusiness.db'
-app.config['SQLALCHEMY_TRACK_CHANGES'] = False
+# Same file the routes use (a relative sqlite URI would resolve under instance/).
+# Routes talk to it through get_db(), whose per-thread connection is the pool.
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.abspath(DATABASE)
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db = SQLAlchemy(app)
 
 Data = os.path.join(os.path.dirname(__file__), 'database.db')
 
-DATABASE = 'database.db'
+# One sqlite connection per worker thread, kept open across requests instead of
+# a connect/close in every route (which also threw away the statement cache).
+_local = threading.local()
+
+def get_db():
+    """The current thread's persistent connection; also kept on g for the request."""
+    if 'db' not in g:
+        connection = getattr(_local, 'connection', None)
+        if connection is None:
+            # room for every statement in this module plus the per-shape /products
+            # and per-subtree-size productListings variants
+            connection = sql.connect(DATABASE, check_same_thread=False, cached_statements=512)
+            connection.row_factory = sql.Row                      # rows index by position or column name
+            connection.execute('PRAGMA journal_mode = WAL')       # readers don't block the writer; commits append
+            connection.execute('PRAGMA synchronous = NORMAL')     # safe with WAL, no fsync per commit
+            connection.execute('PRAGMA temp_store = MEMORY')
+            connection.execute('PRAGMA mmap_size = 268435456')    # 256 MB
+            connection.execute('PRAGMA cache_size = -65536')      # 64 MB page cache
+            connection.execute('PRAGMA cache_spill = 0')
+            _local.connection = connection
+        g.db = connection
+    return g.db
+
+@app.teardown_request
+def release_db(exc):
+    """The connection stays open; anything a route left uncommitted is rolled back, as close() used to."""
+    connection = g.pop('db', None)
+    if connection is not None and connection.in_transaction:
+        connection.rollback()
+
+@app.cli.command("db-upgrade")
+def db_upgrade():
+    """
+    Bring a database.db built by an older initialize_db.py up to date (price column,
+    Cart and ListingSeq tables, indexes). Safe to re-run:
+      flask --app app_old db-upgrade
+    """
+    if not os.path.exists(DATABASE):
+        print(f"{DATABASE} not found; run initialize_db.py first")
+        return
+    migrate_product_prices()   # no-op once product_price holds numbers
+    create_cart_table()
+    create_listing_seq_table()
+    create_indexes()
+    print(f"{DATABASE} is up to date")
+
+@app.cli.command("db-checkpoint")
+def db_checkpoint():
+    """
+    Fold the WAL back into database.db and truncate it (maintenance / before a backup):
+      flask --app app_old db-checkpoint
+    """
+    if not os.path.exists(DATABASE):
+        print(f"{DATABASE} not found; nothing to checkpoint")
+        return
+    connection = sql.connect(DATABASE)
+    try:
+        busy, log_pages, checkpointed = connection.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+    finally:
+        connection.close()
+    if log_pages < 0:
+        print("database is not in WAL mode; nothing to checkpoint")
+    else:
+        print(f"checkpointed {checkpointed}/{log_pages} WAL pages" + (" (busy: readers still active)" if busy else ""))
+
+# Lookups run on every login / product page. Kept as constants so the SQL text,
+# which is the key of the connection's statement cache, is identical on every call.
+LOGIN_USER_SQL = 'SELECT email, password FROM users WHERE email = ?;'
+# Hands out the next listing_id in one statement; the first call starts after
+# the highest existing id.
+NEXT_LISTING_ID_SQL = '''
+    INSERT INTO ListingSeq (id, last_id)
+    VALUES (1, (SELECT COALESCE(MAX(listing_id), 0) + 1 FROM ProductListings))
+    ON CONFLICT (id) DO UPDATE SET last_id = last_id + 1
+    RETURNING last_id;
+'''
+# open requests assigned to a help desk address, named for the request templates
+OPEN_REQUESTS_SQL = '''
+    SELECT request_id, sender_email, helpdesk_staff_email AS helpdesk_email,
+           request_type, request_desc, request_status
+    FROM Requests
+    WHERE request_status = 0 AND helpdesk_staff_email = ?;
+'''
+# Every column that holds a user's email, for help desk email changes:
+# the role table's own column, then the columns that only exist for that role
+EMAIL_COLUMNS = (
+    (('Users', 'email'), [('Requests', 'sender_email')]),
+    (('Buyers', 'email'), [('CreditCards', 'owner_email'), ('Orders', 'buyer_email'), ('Cart', 'buyer_email')]),
+    (('Sellers', 'email'), [('Orders', 'seller_email'), ('ProductListings', 'seller_email'), ('Cart', 'seller_email')]),
+    (('Helpdesk', 'email'), [('Requests', 'helpdesk_staff_email')]),
+)
+
+def _email_update_sql(table, column):
+    return f'UPDATE {table} SET {column} = ? WHERE {column} = ?;'
+
+EMAIL_CHANGE_SQL = tuple(
+    (_email_update_sql(*role), tuple(_email_update_sql(*dep) for dep in dependents))
+    for role, dependents in EMAIL_COLUMNS
+)
+# login: the user's hash and every role they might have, in one lookup
+LOGIN_SQL = '''
+    SELECT u.email, u.password, b.business_name, s.business_name, h.approved
+    FROM Users u
+    LEFT JOIN Buyers b ON b.email = u.email
+    LEFT JOIN Sellers s ON s.email = u.email
+    LEFT JOIN Helpdesk h ON h.email = u.email
+    WHERE u.email = ?;
+'''
+
+# Categories barely change, so the tree is read once and cached. Writes in this
+# process bump the version; other workers reload within CATEGORY_TTL seconds.
+CATEGORY_TTL = 60
+_categories_version = 0
+
+@lru_cache(maxsize=4)
+def _category_tree(version, ttl_bucket):
+    """(category names in table order, parent -> children in table order)."""
+    rows = get_db().execute('SELECT category_name, parent_category FROM Categories ORDER BY rowid').fetchall()
+    children = {}
+    for name, parent in rows:
+        children.setdefault(parent, []).append(name)
+    return tuple(name for name, _ in rows), {parent: tuple(names) for parent, names in children.items()}
+
+@lru_cache(maxsize=4)
+def _category_closure(version, ttl_bucket):
+    """category -> itself and every category below it, for the whole tree at once."""
+    names, children = _category_tree(version, ttl_bucket)
+    closure = {}
+    for category in names:
+        found, stack = [], [category]
+        while stack:
+            name = stack.pop()
+            if name not in found:
+                found.append(name)
+                stack.extend(children.get(name, ()))
+        closure[category] = tuple(found)
+    return closure
+
+def _category_cache_key():
+    return _categories_version, int(time.monotonic() // CATEGORY_TTL)
+
+def category_tree():
+    return _category_tree(*_category_cache_key())
+
+@lru_cache(maxsize=4)
+def _sorted_category_names(version, ttl_bucket):
+    return sorted(_category_tree(version, ttl_bucket)[0])
+
+def category_names():
+    """Every category, alphabetical, for the listing forms' dropdown. Shared; don't mutate."""
+    return _sorted_category_names(*_category_cache_key())
+
+def categories_changed():
+    global _categories_version
+    _categories_version += 1
+
+def subcategories(category):
+    """The category and everything below it."""
+    return _category_closure(*_category_cache_key()).get(category, ())
+
+def parse_price(text):
+    """Form input like '$1,234.56' -> 1234.56. Prices are stored as REAL; format them with |money."""
+    return float(str(text).replace('$', '').replace(',', '').strip())
+
+@app.template_filter('money')
+def money(value):
+    return "${:,.2f}".format(value or 0)
+
+# New hashes are werkzeug's salted scrypt ("scrypt:n:r:p$salt$hash"); legacy rows
+# hold a plain SHA-256 hex digest and are re-hashed on the next successful login.
+def hp(password):
+    """Legacy SHA-256 digest. Only used to verify old hashes."""
+    return hashlib.sha256(password.encode()).hexdigest()
 
 def hash_password(password):
-    """Hash the password using SHA-256."""
-    return hashlib.sha256(password.encode()).hexdigest()
+    return generate_password_hash(password, method="scrypt")
+
+def verify_password(password, stored):
+    if not stored or password is None:
+        return False
+    if stored.startswith("scrypt:"):
+        return check_password_hash(stored, password)
+    return hmac.compare_digest(hp(password), stored)
+
+def password_needs_rehash(stored):
+    return not (stored or "").startswith("scrypt:")
 
 # Sample routes to demonstrate template rendering
 @app.route('/')
@@ -44,46 +235,35 @@ def login():
         # Handle login logic here
         email = request.form.get('email')
         password = request.form.get('password')
-        
-        hashed_password = hash_password(password)
 
         try:
-            connection = sql.connect(DATABASE)
+            connection = get_db()
             cursor = connection.cursor()
-            cursor.execute('SELECT * FROM users WHERE email = ? AND password = ?;', (email, hashed_password))
+            cursor.execute(LOGIN_SQL, (email,))
             user = cursor.fetchone()
-            connection.commit()
-            
+            if user and not verify_password(password, user[1]):
+                user = None
+
+            if user and password_needs_rehash(user[1]):
+                cursor.execute('UPDATE users SET password = ? WHERE email = ?;', (hash_password(password), user[0]))
+                connection.commit()
+
             if user:
-                email = user[0]
+                email, _, buyerName, sellerName, helpdeskApproved = user
                 userName = ""
-                
-                # checks buyer table to see if user is a buyer
-                cursor.execute('SELECT business_name FROM Buyers WHERE email = ?;', (email,))
-                buyerResult = cursor.fetchone()
-                isBuyer = buyerResult is not None
-                connection.commit()
-                
-                # checks sellers table to see if user is a seller
-                cursor.execute('SELECT business_name FROM Sellers WHERE email = ?;', (email,))
-                sellerResult = cursor.fetchone()
-                isSeller = sellerResult is not None
-                connection.commit()
-                
-                # checks helpdesk table to see if user is help desk and approved
-                cursor.execute('SELECT position, approved FROM Helpdesk WHERE email = ?;', (email,))
-                helpdeskResult = cursor.fetchone()
-                isHelpDesk = helpdeskResult is not None and helpdeskResult[1] == 1  # approved == 1
-                connection.commit()
+
+                isBuyer = buyerName is not None
+                isSeller = sellerName is not None
+                isHelpDesk = helpdeskApproved == 1  # approved == 1 (None if not help desk)
                 
                 if isBuyer:
-                    userName = buyerResult[0]
+                    userName = buyerName
                     userType = 'Buyer'
                 elif isSeller:
-                    userName = sellerResult[0]
+                    userName = sellerName
                     userType = 'Seller'
                 elif isHelpDesk:
-                    userName = email  # or helpdeskResult[0] for position if you want
+                    userName = email
                     userType = 'Help Desk'
                 else:
                     user = None  # prevent logging in if not any of the 3
@@ -93,9 +273,6 @@ def login():
 
         except Exception as e:
             print(e)
-        finally:
-            if connection:
-                connection.close() 
 
         if user:
             return redirect(url_for('dashboard'))
@@ -119,12 +296,11 @@ def manage_helpdesk_accounts():
 
     user = session['user']
 
-    connection = sql.connect(DATABASE)
+    connection = get_db()
     cursor = connection.cursor()
 
     cursor.execute('SELECT email, position FROM Helpdesk WHERE approved = 0')
     pending_helpdesks = cursor.fetchall()
-    connection.close()
 
     pending_helpdesks = [{'email': row[0], 'position': row[1]} for row in pending_helpdesks]
 
@@ -140,11 +316,10 @@ def approve_helpdesk(email):
         flash('You are not authorized.', 'error')
         return redirect(url_for('login'))
 
-    connection = sql.connect(DATABASE)
+    connection = get_db()
     cursor = connection.cursor()
     cursor.execute('UPDATE Helpdesk SET approved = 1 WHERE email = ?', (email,))
     connection.commit()
-    connection.close()
 
     flash('HelpDesk account approved successfully!', 'success')
     return redirect(url_for('manage_helpdesk_accounts'))
@@ -157,12 +332,11 @@ def reject_helpdesk(email):
         flash('You are not authorized.', 'error')
         return redirect(url_for('login'))
 
-    connection = sql.connect(DATABASE)
+    connection = get_db()
     cursor = connection.cursor()
     cursor.execute('DELETE FROM Helpdesk WHERE email = ?', (email,))
     cursor.execute('DELETE FROM Users WHERE email = ?', (email,))
     connection.commit()
-    connection.close()
 
     flash('HelpDesk account rejected and removed.', 'success')
     return redirect(url_for('manage_helpdesk_accounts'))
@@ -228,23 +402,21 @@ def registerBuyer():
         # Add validation and database operations
         try:
             # Add the buyer to database
-            connection = sql.connect(DATABASE)
-            cursor = connection.cursor()
-            cursor.execute('''
-                INSERT INTO Users(email,password)
-                VALUES(?,?)
-            ''', (email, password))
-            connection.commit()
-            cursor.execute('''
-                INSERT INTO Buyers(email,business_name,buyer_address_id)
-                VALUES(?,?,?)
-            ''', (email, business_name,address_id))
-            connection.commit()
-            cursor.execute('''
-                INSERT INTO Address(address_ID,zipcode,street_num,street_name)
-                VALUES(?,?,?,?)
-            ''', (address_id, zipcode, street_num, street_name))
-            connection.commit()
+            connection = get_db()
+            with connection:  # one transaction: commit on success, rollback on error
+                cursor = connection.cursor()
+                cursor.execute('''
+                    INSERT INTO Users(email,password)
+                    VALUES(?,?)
+                ''', (email, password))
+                cursor.execute('''
+                    INSERT INTO Buyers(email,business_name,buyer_address_id)
+                    VALUES(?,?,?)
+                ''', (email, business_name,address_id))
+                cursor.execute('''
+                    INSERT INTO Address(address_ID,zipcode,street_num,street_name)
+                    VALUES(?,?,?,?)
+                ''', (address_id, zipcode, street_num, street_name))
             
             message = f'Buyer account created for {business_name}'
             success = True
@@ -254,9 +426,6 @@ def registerBuyer():
         except Exception as e:
             message = f'Failed to create account: {e}'
             success = False
-        finally:
-            if connection:
-                connection.close()
 
     return render_template('registerBuyer.html', message=message, success=success)
 
@@ -273,22 +442,21 @@ def registerHelpDesk():
         position = request.form.get('position')
 
         try:
-            connection = sql.connect(DATABASE)
-            cursor = connection.cursor()
+            connection = get_db()
+            with connection:  # one transaction: commit on success, rollback on error
+                cursor = connection.cursor()
 
-            # Insert into Users
-            cursor.execute('''
-                INSERT INTO Users(email, password)
-                VALUES (?, ?)
-            ''', (email, password))
-            connection.commit()
+                # Insert into Users
+                cursor.execute('''
+                    INSERT INTO Users(email, password)
+                    VALUES (?, ?)
+                ''', (email, password))
 
-            # Insert into Helpdesk with approved = 0
-            cursor.execute('''
-                INSERT INTO Helpdesk (email, position, approved)
-                VALUES (?, ?, 0)
-            ''', (email, position))
-            connection.commit()
+                # Insert into Helpdesk with approved = 0
+                cursor.execute('''
+                    INSERT INTO Helpdesk (email, position, approved)
+                    VALUES (?, ?, 0)
+                ''', (email, position))
 
             message = f'HelpDesk account created successfully! Please wait for approval.'
             success = True
@@ -300,9 +468,6 @@ def registerHelpDesk():
             message = f'Failed to create account: {e}'
             success = False
 
-        finally:
-            if connection:
-                connection.close()
 
     return render_template('registerHelpDesk.html', message=message, success=success)
 
@@ -336,24 +501,21 @@ def registerSeller():
         # Add validation and database operations
         try:
             # Add the seller to database
-            connection = sql.connect(DATABASE)
-            cursor = connection.cursor()
-            cursor.execute('''
-                INSERT INTO Users(email,password)
-                VALUES(?,?)
-            ''', (email, password))
-            connection.commit()
-            cursor.execute('''
-                INSERT INTO Sellers(email, Business_Name, Business_Address_Id, bank_routing_number,bank_account_number, balance)
-                VALUES(?,?,?,?,?,?)
-            ''', (email, Business_Name, address_id, bank_routing_number,bank_account_number, balance))
-            connection.commit()
-            cursor.execute('''
-                INSERT INTO Address(address_ID,zipcode,street_num,street_name)
-                VALUES(?,?,?,?)
-            ''', (address_id, zipcode, street_num, street_name))
-            connection.commit()
-            connection.close()
+            connection = get_db()
+            with connection:  # one transaction: commit on success, rollback on error
+                cursor = connection.cursor()
+                cursor.execute('''
+                    INSERT INTO Users(email,password)
+                    VALUES(?,?)
+                ''', (email, password))
+                cursor.execute('''
+                    INSERT INTO Sellers(email, Business_Name, Business_Address_Id, bank_routing_number,bank_account_number, balance)
+                    VALUES(?,?,?,?,?,?)
+                ''', (email, Business_Name, address_id, bank_routing_number,bank_account_number, balance))
+                cursor.execute('''
+                    INSERT INTO Address(address_ID,zipcode,street_num,street_name)
+                    VALUES(?,?,?,?)
+                ''', (address_id, zipcode, street_num, street_name))
             
             message = f'Seller account created successfully!'
             success = True
@@ -363,104 +525,109 @@ def registerSeller():
         except Exception as e:
             message = f'Failed to create account: {e}'
             success = False
-        finally:
-            if connection:
-                connection.close()
 
     return render_template('registerSeller.html', message=message, success=success)
 
 
+@lru_cache(maxsize=16)
+def _build_products_sql(has_category, has_search, price_filter):
+    """
+    SQL text for /products, cached by filter shape. Only params vary between
+    requests, so the connection's statement cache reuses one statement per shape.
+    """
+    query = '''
+        SELECT p.seller_email, p.listing_id, p.category, p.product_title, p.product_name,
+               p.product_description, p.quantity, p.product_price, p.status,
+               COALESCE(s.business_name, 'Unknown Seller') AS seller_name,
+               COUNT(*) OVER () AS total_rows
+        FROM ProductListings p
+        LEFT JOIN Sellers s ON s.email = p.seller_email
+    '''
+    where_clauses = []
+    if has_category:
+        where_clauses.append('category IN (SELECT category_name FROM Categories WHERE category_name = ? OR parent_category = ?)')
+    if has_search:
+        where_clauses.append("(product_name LIKE ? ESCAPE '!' OR product_description LIKE ? ESCAPE '!' "
+                             "OR product_title LIKE ? ESCAPE '!' OR seller_email LIKE ? ESCAPE '!')")
+    if price_filter == 'between':
+        where_clauses.append('product_price BETWEEN ? AND ?')
+    elif price_filter == 'min':
+        where_clauses.append('product_price >= ?')
+    if where_clauses:
+        query += ' WHERE ' + ' AND '.join(where_clauses)
+    # one page at a time; total_rows above still counts every match
+    query += ' ORDER BY p.listing_id LIMIT ? OFFSET ?'
+    return query
+
+PRODUCTS_PER_PAGE = 10
+ORDERS_PER_PAGE = 20
+PRODUCT_REVIEWS_LIMIT = 20
+
+class Pagination:
+    """The parts of Flask-SQLAlchemy's Pagination that the list templates use."""
+    def __init__(self, page, per_page, total):
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.pages = max(1, -(-total // per_page))
+        self.has_prev = page > 1
+        self.has_next = page < self.pages
+        self.prev_num = page - 1 if self.has_prev else None
+        self.next_num = page + 1 if self.has_next else None
+
+    def iter_pages(self):
+        return list(range(1, self.pages + 1))
+
 @app.route('/products')
 def products():
     user = session.get('user', {})  # Always get user first
 
-    connection = sql.connect(DATABASE)
+    connection = get_db()
     cursor = connection.cursor()
 
     selected_category = request.args.get('category')
     search_query = request.args.get('search')
     price_range = request.args.get('price_range')  # <-- NEW
+    page = max(request.args.get('page', 1, type=int), 1)
 
-    # Start building SQL query
-    base_query = '''
-        SELECT * FROM ProductListings
-    '''
-    where_clauses = []
     params = []
 
     # Category filter
     if selected_category:
-        where_clauses.append('category IN (SELECT category_name FROM Categories WHERE category_name = ? OR parent_category = ?)')
         params.extend([selected_category, selected_category])
 
-    # Build full query
-    if where_clauses:
-        base_query += ' WHERE ' + ' AND '.join(where_clauses)
-
-    cursor.execute(base_query, params)
-
-    attributes = ['seller_email', 'listing_id', 'category', 'product_title', 'product_name', 'product_description', 'quantity', 'product_price', 'status']
-    products = [dict(zip(attributes, row)) for row in cursor.fetchall()]
-
-    # Search filter (in memory after fetching)
+    # Search filter (case-insensitive substring; % and _ in the query are literal)
     if search_query:
-        products = [
-            product for product in products
-            if (search_query.lower() in product['product_name'].lower() or 
-                search_query.lower() in product['product_description'].lower() or
-                search_query.lower() in product['product_title'].lower() or
-                search_query.lower() in product['seller_email'].lower())
-        ]
-
-    # Price range filter (also in memory after fetching)
+        like = '%' + search_query.replace('!', '!!').replace('%', '!%').replace('_', '!_') + '%'
+        params.extend([like] * 4)
+
+    # Price range filter
+    price_filter = None
     if price_range:
         if '-' in price_range:
             min_price, max_price = price_range.split('-')
-            min_price = float(min_price)
-            max_price = float(max_price)
-            products = [
-                p for p in products
-                if min_price <= float(str(p['product_price']).replace('$', '').replace(',', '').strip()) <= max_price
-            ]
+            price_filter = 'between'
+            params.extend([float(min_price), float(max_price)])
         elif price_range == '1000+':
-            products = [
-                p for p in products
-                if float(str(p['product_price']).replace('$', '').replace(',', '').strip()) >= 1000
-            ]
+            price_filter = 'min'
+            params.append(1000.0)
 
-    # Fetch Seller Names
-    for product in products:
-        cursor.execute('SELECT business_name FROM Sellers WHERE email = ?', (product['seller_email'],))
-        seller = cursor.fetchone()
-        product['seller_name'] = seller[0] if seller else 'Unknown Seller'
+    params.extend([PRODUCTS_PER_PAGE, (page - 1) * PRODUCTS_PER_PAGE])
+    cursor.execute(_build_products_sql(bool(selected_category), bool(search_query), price_filter), params)
+    products = cursor.fetchall()
+    total = products[0]['total_rows'] if products else 0
 
     # Fetch Categories
+    names, children = category_tree()
     if selected_category:
-        cursor.execute('''
-            SELECT category_name FROM Categories
-            WHERE parent_category = ? OR category_name = ?
-        ''', (selected_category, selected_category))
+        categories = list(children.get(selected_category, ()))
+        if selected_category in names:
+            categories.append(selected_category)
     else:
-        cursor.execute('SELECT category_name FROM Categories WHERE parent_category = ?', ('Root',))
-    categories = [row[0] for row in cursor.fetchall()]
-
-    # Dummy Pagination
-    class Pagination:
-        def __init__(self):
-            self.page = 1
-            self.per_page = 10
-            self.total = 3
-            self.has_prev = False
-            self.has_next = False
-            self.prev_num = None
-            self.next_num = None
-        
-        def iter_pages(self):
-            return [1]
-    
-    pagination = Pagination()
+        categories = list(children.get('Root', ()))
+
+    pagination = Pagination(page, PRODUCTS_PER_PAGE, total)
 
-    connection.close()
 
     return render_template('products.html',
         user=user,
@@ -473,6 +640,22 @@ def products():
     )
 
 #Cart section
+CART_SQL = '''
+    SELECT c.listing_id, p.product_name, p.product_price, c.quantity, c.seller_email
+    FROM Cart c
+    JOIN ProductListings p ON p.seller_email = c.seller_email AND p.listing_id = c.listing_id
+    WHERE c.buyer_email = ?
+    ORDER BY c.rowid;
+'''
+
+def get_cart(buyer_email, cursor=None):
+    """The buyer's cart items, in the order they were added."""
+    cursor = cursor or get_db().cursor()
+    cursor.execute(CART_SQL, (buyer_email,))
+    return [{'listing_id': listing_id, 'name': name, 'price': price, 'quantity': quantity,
+             'subtotal': price * quantity, 'seller_email': seller_email}
+            for listing_id, name, price, quantity, seller_email in cursor.fetchall()]
+
 @app.route('/cart')
 def cart():
     # Make sure user is logged in
@@ -485,30 +668,24 @@ def cart():
     if user['type'] != 'Buyer':
         return redirect(url_for('dashboard'))
 
-    # Get cart from session
-    cart = session.get('cart', [])
-    
-    # Creates a subtotal for each type of item
-    for item in cart:
-        item['subtotal'] = float(item['price'].replace('$', '')) * float(item['quantity'])
+    cart = get_cart(user['id'])
 
     # final price of all items
-    total_price = sum(float(item['price'].replace('$', '')) * int(item['quantity']) for item in cart)
+    total_price = sum(item['subtotal'] for item in cart)
 
     return render_template('cart.html', user=user, cart=cart, total_price=total_price)
 
 #route to remove the selected item
-@app.route('/remove_from_cart/<int:listing_id>', methods=['POST'])
-def remove_from_cart(listing_id):
-    if 'cart' not in session:
+@app.route('/remove_from_cart/<seller_email>/<int:listing_id>', methods=['POST'])
+def remove_from_cart(seller_email, listing_id):
+    if 'user' not in session:
         return redirect(url_for('cart'))
 
-    cart = session['cart']
-
-    # Keep only the items that are NOT the one we are removing
-    cart = [item for item in cart if item['listing_id'] != listing_id]
-
-    session['cart'] = cart  # Save updated cart back into session
+    # listing ids repeat across sellers, so the line is named by both
+    connection = get_db()
+    connection.execute('DELETE FROM Cart WHERE buyer_email = ? AND seller_email = ? AND listing_id = ?',
+                       (session['user']['id'], seller_email, listing_id))
+    connection.commit()
 
     flash('Item removed from cart.', 'success')
     return redirect(url_for('cart'))
@@ -524,7 +701,7 @@ def checkout(total_price):
 
     user = session['user']
 
-    connection = sql.connect(DATABASE)
+    connection = get_db()
     cursor = connection.cursor()
 
     if request.method == 'POST':
@@ -549,7 +726,6 @@ def checkout(total_price):
     # Fetch buyer's saved cards
     cursor.execute('SELECT credit_card_num, card_type, expire_month, expire_year FROM CreditCards WHERE owner_email = ?', (user['id'],))
     cards = cursor.fetchall()
-    connection.close()
 
     return render_template('checkout.html', 
                            cards=cards,
@@ -569,74 +745,77 @@ def finalize_sale():
         flash('Only buyers can checkout.', 'error')
         return redirect(url_for('dashboard'))
 
-    cart = session.get('cart', [])
-
-    if not cart:
-        flash('Your cart is empty.', 'error')
-        return redirect(url_for('cart'))
-
     try:
-        connection = sql.connect(DATABASE)
+        connection = get_db()
         cursor = connection.cursor()
+        date_now = datetime.now().isoformat(' ', 'seconds')
+
+        # One write transaction for the whole cart
+        cursor.execute('BEGIN IMMEDIATE')
 
+        # Each cart row names its seller's listing, with the price joined in
+        cart = get_cart(user['id'], cursor)
+        if not cart:
+            connection.rollback()
+            flash('Your cart is empty.', 'error')
+            return redirect(url_for('cart'))
+
+        order_rows, stock_rows = [], []
+        seller_totals = {}  # one balance update per seller, however many of their items
         for item in cart:
             listing_id = item['listing_id']
+            seller_email = item['seller_email']
             quantity = item['quantity']
-            price = float(item['price'].replace('$', '')) if isinstance(item['price'], str) else float(item['price'])
-            payment = price * int(quantity)
-            date_now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-            # Get seller email safely
-            cursor.execute('SELECT seller_email FROM ProductListings WHERE listing_id = ?', (listing_id,))
-            result = cursor.fetchone()
-            if not result:
-                continue  # skip if somehow product not found
-            seller_email = result[0]
-
-            # Insert the order
-            cursor.execute('''
-                INSERT INTO Orders (seller_email, buyer_email, listing_id, date, quantity, payment)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (seller_email, user['id'], listing_id, date_now, quantity, payment))
-
-            # Add to seller balance
-            cursor.execute('''
-                UPDATE Sellers 
-                SET balance = balance + ?
-                WHERE email = ?
-            ''', (payment, seller_email))
+            payment = item['price'] * int(quantity)
+            order_rows.append((seller_email, user['id'], listing_id, date_now, quantity, payment))
+            seller_totals[seller_email] = seller_totals.get(seller_email, 0) + payment
+            stock_rows.append((quantity, quantity, seller_email, listing_id))
+
+        # Insert the orders
+        cursor.executemany('''
+            INSERT INTO Orders (seller_email, buyer_email, listing_id, date, quantity, payment)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', order_rows)
+
+        # Add to seller balances
+        cursor.executemany('''
+            UPDATE Sellers 
+            SET balance = balance + ?
+            WHERE email = ?
+        ''', [(total, seller_email) for seller_email, total in seller_totals.items()])
+
+        # Decrease product quantities #https://www.interviewquery.com/p/sql-count-case-when
+        cursor.executemany('''
+            UPDATE ProductListings
+            SET quantity = quantity - ?,
+                Status = CASE
+                            WHEN quantity - ? <= 0 THEN 2
+                            ELSE Status
+                        END
+            WHERE seller_email = ? AND listing_id = ?
+        ''', stock_rows)
 
-            # Decrease product quantity #https://www.interviewquery.com/p/sql-count-case-when
-            cursor.execute('''
-                UPDATE ProductListings
-                SET quantity = quantity - ?,
-                    Status = CASE
-                                WHEN quantity - ? <= 0 THEN 2
-                                ELSE Status
-                            END
-                WHERE listing_id = ?
-            ''', (quantity, quantity, listing_id))
+        # Clear cart after successful checkout
+        cursor.execute('DELETE FROM Cart WHERE buyer_email = ?', (user['id'],))
 
         connection.commit()
+        for seller_email in seller_totals:
+            _balance_cache.pop(seller_email, None)
 
-        # Clear cart after successful checkout
-        session['cart'] = []
         flash('Checkout successful! Your orders have been placed.', 'success')
         return redirect(url_for('thank_you'))
 
     except Exception as e:
+        connection.rollback()
         print(f"Checkout Error: {e}")
         flash('An error occurred during checkout. Please try again.', 'error')
         return redirect(url_for('cart'))
 
-    finally:
-        if connection:
-            connection.close()
 
 # displays sellers listings for editing, creating, deleting
 @app.route('/productListings', methods=['GET', 'POST'])
 def productListings():
-    connection = sql.connect(DATABASE)
+    connection = get_db()
     cursor = connection.cursor()
 
     user = session['user']
@@ -649,62 +828,44 @@ def productListings():
     if flashed:
         success, message = flashed[0]
 
-    # Recursively find all products under the selected category
+    # All products under the selected category (tree walked from the cache)
     if selected_category:
+        under = subcategories(selected_category)
         cursor.execute(f'''
-        WITH RECURSIVE subcategories(category_name) AS (
-            SELECT category_name
-            FROM Categories
-            WHERE category_name = ?
-
-            UNION ALL
-
-            SELECT c.category_name
-            FROM Categories c
-            INNER JOIN subcategories s ON c.parent_category = s.category_name
-        )
-        SELECT * FROM ProductListings
-        WHERE category IN (SELECT category_name FROM subcategories)
+        SELECT P.seller_email, P.listing_id AS id, P.category, P.product_title AS title, P.product_name AS name,
+               P.product_description AS description, P.quantity, P.product_price AS price, P.status,
+               S.business_name AS seller_name
+        FROM ProductListings P
+        LEFT JOIN Sellers S ON S.email = P.Seller_Email
+        WHERE category IN ({','.join('?' * len(under))})
         AND Seller_Email = ?
         AND Status !=2
-        ''', (selected_category, sellerEmail))
+        ORDER BY P.listing_id
+        ''', (*under, sellerEmail))
     else: # select every listing
         cursor.execute('''
-        SELECT * FROM ProductListings
+        SELECT P.seller_email, P.listing_id AS id, P.category, P.product_title AS title, P.product_name AS name,
+               P.product_description AS description, P.quantity, P.product_price AS price, P.status,
+               S.business_name AS seller_name
+        FROM ProductListings P
+        LEFT JOIN Sellers S ON S.email = P.Seller_Email
         WHERE Seller_Email = ?
         AND Status != 2
+        ORDER BY P.listing_id
         ''', (sellerEmail,))
 
-    # Preprocess the products into a better format for HTML
-    attributes = ['seller_email', 'id', 'category', 'title', 'name', 'description', 'quantity', 'price', 'status']
-    products = [dict(zip(attributes, row)) for row in cursor.fetchall()]
-
-    # seller names to display
-    for product in products:
-        cursor.execute('''
-            SELECT (business_name)
-            FROM Sellers S
-            WHERE S.email = ?
-        ''', (product['seller_email'],))
-        product['seller_name'] = cursor.fetchone()[0]
+    # Rows are named for the HTML (seller name joined in above)
+    products = cursor.fetchall()
 
     # find children and current category
+    names, children = category_tree()
     if (selected_category):
-        cursor.execute('''
-            SELECT (category_name)
-            FROM Categories
-            WHERE parent_category=?
-            UNION   
-            SELECT (category_name)
-            FROM Categories
-            WHERE category_name=?    
-            ''', (selected_category,selected_category))
+        categories = set(children.get(selected_category, ()))
+        if selected_category in names:
+            categories.add(selected_category)
+        categories = sorted(categories)
     else: # pick all categories
-        cursor.execute('''SELECT (category_name) 
-            FROM Categories 
-            WHERE parent_category = ?''', ("Root",))
-    
-    categories = [row[0] for row in cursor.fetchall()]
+        categories = list(children.get('Root', ()))
 
     return render_template('productListings.html', 
                           products=products,
@@ -734,11 +895,7 @@ def createProductListing():
 
     if request.method == "GET":
         try:
-            connection = sql.connect(DATABASE)
-            cursor = connection.cursor()
-            cursor.execute('''SELECT category_name FROM Categories;''') # select all categories for the dropdown
-            categories = [row[0] for row in cursor.fetchall()]
-            connection.close()
+            categories = category_names() # all categories for the dropdown
         except Exception as e:
             print(e)
 
@@ -753,9 +910,7 @@ def createProductListing():
             quantity_input = request.form.get('quantity')
             status_input = request.form.get('active')
 
-            # clean price
-            cleaned_price = price_input.replace('$', '').replace(',', '').strip()
-            price = float(cleaned_price)
+            price = parse_price(price_input)
 
             # set quantity and check
             quantity = int(quantity_input)
@@ -765,28 +920,24 @@ def createProductListing():
             # set status
             status = 1 if status_input == 'active' else 0
 
-            connection = sql.connect(DATABASE)
-            cursor = connection.cursor()
+            connection = get_db()
+            with connection:  # one transaction: commit on success, rollback on error
+                cursor = connection.cursor()
 
-            # Find last Listing_ID and increment
-            cursor.execute('SELECT MAX(Listing_ID) FROM ProductListings WHERE Seller_Email = ?', (sellerEmail,))
-            lastID = cursor.fetchone()[0]
-            if lastID:
-                listingID = lastID + 1
-            else:
-                listingID = 1
+                # Allocate the Listing_ID; committed together with the insert below
+                cursor.execute(NEXT_LISTING_ID_SQL)
+                listingID = cursor.fetchone()[0]
 
-            # Insert new product
-            cursor.execute('''
-                INSERT INTO ProductListings(
-                    Seller_Email, Listing_ID, Category, Product_Title, 
-                    Product_Name, Product_Description, Quantity, Product_Price, Status
-                )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (sellerEmail, listingID, category, productTitle,
-                  productName, description, quantity, price, status))
+                # Insert new product
+                cursor.execute('''
+                    INSERT INTO ProductListings(
+                        Seller_Email, Listing_ID, Category, Product_Title, 
+                        Product_Name, Product_Description, Quantity, Product_Price, Status
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (sellerEmail, listingID, category, productTitle,
+                      productName, description, quantity, price, status))
 
-            connection.commit()
             message = f'{productTitle} listed successfully!'
             success = 'success'
             flash(message, success)
@@ -800,9 +951,6 @@ def createProductListing():
             message = f'Failed to list product: {e}'
             success = 'error'
             flash(message, success)
-        finally:
-            if 'connection' in locals():
-                connection.close()
 
     return render_template('createProductListing.html', message=message, success=success, categories=categories,user=user)
 
@@ -830,32 +978,26 @@ def editProductListing():
             listingID = request.args.get('productID')
             session['productID'] = listingID
             
-            connection = sql.connect(DATABASE)
+            connection = get_db()
             cursor = connection.cursor()
-            cursor.execute('''SELECT * FROM ProductListings WHERE Listing_ID = ? AND Seller_Email = ?''', (listingID, sellerEmail))
+            # columns named as the edit form expects them
+            cursor.execute('''
+                SELECT product_title AS productTitle, product_name AS productName,
+                       product_description AS description, category AS productCategory,
+                       product_price AS price, quantity, status
+                FROM ProductListings
+                WHERE Listing_ID = ? AND Seller_Email = ?
+            ''', (listingID, sellerEmail))
             product = cursor.fetchone()
             
             # to display the current editable product in the html
             if product:
-                productData = {
-                                'productTitle': product[3],
-                                'productName': product[4],
-                                'description': product[5],
-                                'productCategory': product[2],
-                                'price': product[7],
-                                'quantity': product[6],
-                                'status': product[8]
-                            }
+                productData = dict(product)
     
-            cursor.execute('''SELECT category_name FROM Categories;''')
-            categories = [row[0] for row in cursor.fetchall()]
-            connection.close()
+            categories = category_names()
             
         except Exception as e:
             print(e)
-        finally:
-            if connection:
-                connection.close()
         
     if request.method == "POST":
         productTitle = request.form.get('productTitle')
@@ -868,7 +1010,8 @@ def editProductListing():
         status = 1 if status == 'active' else 0
         
         try:
-            connection = sql.connect(DATABASE)
+            price = parse_price(price)
+            connection = get_db()
             cursor = connection.cursor()
             
             # change this listing based on the updated fields of the form
@@ -888,9 +1031,6 @@ def editProductListing():
             print(e)
             message = f'Failed to update product: {e}'
             success = False
-        finally:
-            if connection:
-                connection.close()
     
     return render_template('editProductListing.html', message=message, success=success, categories=categories, productData=productData, user=user)
 
@@ -908,7 +1048,7 @@ def deleteProductListing():
         listingID = session.get('productID')
                 
         try:
-            connection = sql.connect(DATABASE)
+            connection = get_db()
             cursor = connection.cursor()
             
             # essentially delete the listing by making its status "sold"
@@ -929,41 +1069,45 @@ def deleteProductListing():
             message = f'Failed to delete product: {e}'
             success = 'error'
             flash(message, success)
-        finally:
-            if connection:
-                connection.close()
     
     return render_template('deleteProductListing.html')
     
 # homepage for all users
+# Seller balances for the dashboard. Checkouts in this process drop the sellers
+# they paid; other workers' checkouts show up within BALANCE_TTL seconds.
+BALANCE_TTL = 30
+_balance_cache = {}
+
+def seller_balance(email):
+    hit = _balance_cache.get(email)
+    now = time.monotonic()
+    if hit and now - hit[1] < BALANCE_TTL:
+        return hit[0]
+    row = get_db().execute('SELECT balance FROM Sellers WHERE email = ?', (email,)).fetchone()
+    balance = row[0] if row else 0
+    _balance_cache[email] = (balance, now)
+    return balance
+
 @app.route('/dashboard')
 def dashboard():
-    message, success = None, False
+    # Check if user is logged in (before reading flashes, so they survive the redirect)
+    user = session.get('user')
+    if user is None:
+        return redirect(url_for('login'))
 
     flashed = get_flashed_messages(with_categories=True)
-    if flashed:
-        success, message = flashed[0]
-            
-    # Check if user is logged in
-    if 'user' not in session:
-        return redirect(url_for('login'))
-    
+    success, message = flashed[0] if flashed else (False, None)
+
+    # same text as strftime('%Y-%m-%d %H:%M:%S'), without parsing a format string
+    last_login = datetime.now().isoformat(' ', 'seconds')
     # Sample user data
-    user = session['user']
     if not isinstance(user, dict):
-        user = {'name': 'Demo User', 'type': 'buyer', 'last_login': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+        user = {'name': 'Demo User', 'type': 'buyer', 'last_login': last_login}
     else:
-        user['last_login'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        user['last_login'] = last_login
     
     if (user['type'] == 'Seller'):
-        connection = sql.connect(DATABASE)
-        cursor = connection.cursor()
-        cursor.execute('''
-            SELECT (balance)
-            FROM Sellers S
-            WHERE S.email = ?
-            ''', (user['id'],))
-        balance = cursor.fetchone()[0]
+        balance = seller_balance(user['id'])
     else:
         balance = 0
 
@@ -973,7 +1117,6 @@ def dashboard():
 @app.route('/logout')
 def logout():
     session.pop('user', None)
-    session.pop('cart', None)  # optional: also clear cart if needed
     session.clear()  # ✅ clear all session data including flashed messages
     return redirect(url_for('login'))
 
@@ -982,72 +1125,45 @@ def logout():
 @app.route('/orders')
 def orders():
     user = session.get('user', {})
+    page = max(request.args.get('page', 1, type=int), 1)
 
-    connection = sql.connect(DATABASE)
+    connection = get_db()
     cursor = connection.cursor()
     
+    # One page of orders with their seller, buyer, product and review in one query
     cursor.execute('''
-        SELECT *
+        SELECT O.order_id, O.seller_email, O.buyer_email, O.listing_id, O.date, O.quantity, O.payment,
+               COALESCE(S.business_name, 'Unknown Seller'),
+               COALESCE(B.business_name, 'Unknown Buyer'),
+               COALESCE(P.product_title, 'Unknown Title'),
+               COALESCE(P.product_name, 'Unknown Product'),
+               R.order_id IS NOT NULL, R.review_desc, R.rating,
+               COUNT(*) OVER () AS total_rows
         FROM Orders O
-        WHERE buyer_email = ?
-        ORDER BY date DESC
-    ''', (user['id'],))
-
-    attributes = ['order_id', 'seller_email', 'buyer_email', 'listing_id', 'date', 'quantity', 'payment']
-    orders = [dict(zip(attributes, row)) for row in cursor.fetchall()]
-    
-    for order in orders:
-        # Find Seller names for display
-        cursor.execute('''
-            SELECT business_name
-            FROM Sellers
-            WHERE email = ?
-        ''', (order['seller_email'],))
-        seller = cursor.fetchone()
-        order['seller_name'] = seller[0] if seller else 'Unknown Seller'
-
-        # Find Buyer names for display
-        cursor.execute('''
-            SELECT business_name
-            FROM Buyers
-            WHERE email = ?
-        ''', (order['buyer_email'],))
-        buyer = cursor.fetchone()
-        order['buyer_name'] = buyer[0] if buyer else 'Unknown Buyer'
-
-        # Find Product Info
-        cursor.execute('''
-            SELECT product_title, product_name
-            FROM ProductListings
-            WHERE listing_id = ?
-        ''', (order['listing_id'],))
-        product = cursor.fetchone()
-        if product:
-            order['product_title'] = product[0]
-            order['product_name'] = product[1]
-        else:
-            order['product_title'] = 'Unknown Title'
-            order['product_name'] = 'Unknown Product'
-
-        # Check if this order has a Review
-        cursor.execute('''
-            SELECT review_desc, rating
-            FROM Reviews
-            WHERE order_id = ?
-        ''', (order['order_id'],))
-        review = cursor.fetchone()
-        if review:
-            order['has_review'] = True
-            order['review_desc'] = review[0]
-            order['rating'] = review[1]
-        else:
-            order['has_review'] = False
-
-    connection.close()
+        LEFT JOIN Sellers S ON S.email = O.seller_email
+        LEFT JOIN Buyers B ON B.email = O.buyer_email
+        LEFT JOIN ProductListings P ON P.seller_email = O.seller_email AND P.listing_id = O.listing_id
+        LEFT JOIN Reviews R ON R.order_id = O.order_id
+        WHERE O.buyer_email = ?
+        ORDER BY O.date DESC, O.order_id DESC
+        LIMIT ? OFFSET ?
+    ''', (user['id'], ORDERS_PER_PAGE, (page - 1) * ORDERS_PER_PAGE))
+
+    attributes = ['order_id', 'seller_email', 'buyer_email', 'listing_id', 'date', 'quantity', 'payment',
+                  'seller_name', 'buyer_name', 'product_title', 'product_name', 'has_review', 'review_desc', 'rating']
+    orders, total = [], 0
+    for row in cursor.fetchall():
+        total = row['total_rows']
+        order = dict(zip(attributes, row))
+        order['has_review'] = bool(order['has_review'])
+        if not order['has_review']:
+            del order['review_desc'], order['rating']
+        orders.append(order)
 
     return render_template('orders.html', 
                            user=user,
-                           orders=orders
+                           orders=orders,
+                           pagination=Pagination(page, ORDERS_PER_PAGE, total)
                            )
 
 @app.route('/leave_review/<int:order_id>', methods=['GET', 'POST'])
@@ -1058,34 +1174,12 @@ def leave_review(order_id):
 
     user = session['user']
 
-    connection = sql.connect(DATABASE)
-    cursor = connection.cursor()
-
-    # First, check if the order actually exists and belongs to this user
-    cursor.execute('''
-        SELECT buyer_email
-        FROM Orders
-        WHERE order_id = ?
-    ''', (order_id,))
-    order = cursor.fetchone()
-    
-    if not order:
-        flash('Order not found.', 'error')
-        connection.close()
-        return redirect(url_for('orders'))
-
-    if order[0] != user['id']:
-        flash('You can only review your own orders.', 'error')
-        connection.close()
-        return redirect(url_for('orders'))
-
     if request.method == 'POST':
         review_desc = request.form.get('review_desc', '')
         rating = request.form.get('rating')
 
         if not rating:
             flash('Rating is required.', 'error')
-            connection.close()
             return redirect(url_for('leave_review', order_id=order_id))
 
         try:
@@ -1094,25 +1188,33 @@ def leave_review(order_id):
                 raise ValueError
         except ValueError:
             flash('Rating must be an integer between 1 and 5.', 'error')
-            connection.close()
             return redirect(url_for('leave_review', order_id=order_id, user=user))
 
-        # Insert into Reviews table
+        connection = get_db()
+        cursor = connection.cursor()
+
+        # Insert into Reviews table, only if the order exists and belongs to this user
         try:
             cursor.execute('''
                 INSERT INTO Reviews (order_id, review_desc, rating)
-                VALUES (?, ?, ?)
-            ''', (order_id, review_desc, rating))
+                SELECT ?, ?, ?
+                WHERE EXISTS (SELECT 1 FROM Orders WHERE order_id = ? AND buyer_email = ?)
+            ''', (order_id, review_desc, rating, order_id, user['id']))
             connection.commit()
-            flash('Review submitted successfully!', 'success')
+            if cursor.rowcount:
+                flash('Review submitted successfully!', 'success')
+            else:
+                # nothing inserted: say why
+                cursor.execute('SELECT 1 FROM Orders WHERE order_id = ?', (order_id,))
+                if cursor.fetchone():
+                    flash('You can only review your own orders.', 'error')
+                else:
+                    flash('Order not found.', 'error')
         except Exception as e:
             flash(f'Failed to submit review: {e}', 'error')
-        finally:
-            connection.close()
 
         return redirect(url_for('orders'))
 
-    connection.close()
     return render_template('leave_review.html', order_id=order_id, user=user)
 
 
@@ -1141,110 +1243,50 @@ def update_request(request_id):
         new_request_status = request.form.get('new_request_status')
 
         try:
-            connection = sql.connect(DATABASE)
-            cursor = connection.cursor()
-
-            # Handle category creation if provided
-            if new_category and parent_category:
-                cursor.execute('''
-                    INSERT INTO Categories (category_name, parent_category)
-                    VALUES (?, ?)
-                ''', (new_category, parent_category))
-                connection.commit()
-
-            # Handle email change if provided
-            if new_sender_email:
-                # Get old email from the request
-                cursor.execute('SELECT sender_email FROM Requests WHERE request_id = ?', (request_id,))
-                old_email = cursor.fetchone()
-                
-                if old_email:
-                    old_email = old_email[0]
-                    
-                    # First update Users table
+            connection = get_db()
+            with connection:  # everything below commits (or rolls back) together
+                cursor = connection.cursor()
+                # take the write lock up front, so the sender_email read below
+                # can't change before the updates that use it
+                cursor.execute('BEGIN IMMEDIATE')
+
+                # Handle category creation if provided
+                if new_category and parent_category:
                     cursor.execute('''
-                        UPDATE Users
-                        SET email = ?
-                        WHERE email = ?
-                    ''', (new_sender_email, old_email))
+                        INSERT INTO Categories (category_name, parent_category)
+                        VALUES (?, ?)
+                    ''', (new_category, parent_category))
+
+                # Handle email change if provided
+                if new_sender_email:
+                    # Get old email from the request
+                    cursor.execute('SELECT sender_email FROM Requests WHERE request_id = ?', (request_id,))
+                    old_email = cursor.fetchone()
+
+                    if old_email:
+                        # Rewrite every column holding the email. A role table's
+                        # rowcount says whether the user has that role at all;
+                        # its dependent columns are only touched if so.
+                        params = (new_sender_email, old_email[0])
+                        for role_statement, dependent_statements in EMAIL_CHANGE_SQL:
+                            cursor.execute(role_statement, params)
+                            if cursor.rowcount:
+                                for statement in dependent_statements:
+                                    cursor.execute(statement, params)
+
+                # Handle request status update (approve/deny)
+                if new_request_status is not None:
                     cursor.execute('''
                         UPDATE Requests
-                        SET sender_email = ?
-                        WHERE sender_email = ?
-                    ''', (new_sender_email, old_email))
-                    
-                    # Second figure out what type the old email was
-                    cursor.execute('SELECT * FROM Buyers WHERE email = ?', (old_email,))
-                    buyer = cursor.fetchone()
-                    
-                    cursor.execute('SELECT * FROM Sellers WHERE email = ?', (old_email,))
-                    seller = cursor.fetchone()
-                    
-                    cursor.execute('SELECT * FROM Helpdesk WHERE email = ?', (old_email,))
-                    helpdesk = cursor.fetchone()
-
-                    # Third update the table
-                    if buyer:
-                        cursor.execute('''
-                            UPDATE Buyers
-                            SET email = ?
-                            WHERE email = ?
-                        ''', (new_sender_email, old_email))
-                        connection.commit()
-                        cursor.execute('''
-                            UPDATE CreditCards
-                            SET owner_email = ?
-                            WHERE owner_email = ?
-                        ''', (new_sender_email, old_email))
-                        connection.commit()
-                        cursor.execute('''
-                            UPDATE Orders
-                            SET buyer_email = ?
-                            WHERE buyer_email = ?
-                        ''', (new_sender_email, old_email))
-                        connection.commit()
-                        
-                    elif seller:
-                        cursor.execute('''
-                            UPDATE Sellers
-                            SET email = ?
-                            WHERE email = ?
-                        ''', (new_sender_email, old_email))
-                        connection.commit()
-                        cursor.execute('''
-                            UPDATE Orders
-                            SET seller_email = ?
-                            WHERE seller_email = ?
-                        ''', (new_sender_email, old_email))
-                        cursor.execute('''
-                            UPDATE ProductListings
-                            SET seller_email = ?
-                            WHERE seller_email = ?
-                        ''', (new_sender_email, old_email))
-                        connection.commit()
-                        
-                    elif helpdesk:
-                        cursor.execute('''
-                            UPDATE Helpdesk
-                            SET email = ?
-                            WHERE email = ?
-                        ''', (new_sender_email, old_email))
-                        connection.commit()
-
-            # Handle request status update (approve/deny)
-            if new_request_status is not None:
-                cursor.execute('''
-                    UPDATE Requests
-                    SET request_status = ?
-                    WHERE request_id = ?
-                ''', (int(new_request_status), request_id))
-                connection.commit()
+                        SET request_status = ?
+                        WHERE request_id = ?
+                    ''', (int(new_request_status), request_id))
+
+            if new_category and parent_category:
+                categories_changed()
             
         except Exception as e:
             print("Error in update_request:", e)
-        finally:
-            if connection:
-                connection.close()
         flash('Request updated successfully!', 'success')
         return redirect(url_for('manage_requests'))
 
@@ -1264,27 +1306,13 @@ def manage_requests():
     
     user = session['user']
 
+    requests = []
     try:
-        connection = sql.connect(DATABASE)
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM Requests WHERE request_status = 0 AND helpdesk_staff_email = ?", (session['user']['id'],))
-        requests_list = cursor.fetchall()
-        requests = []
-        for i,x in enumerate(requests_list):
-            requests.append({})
-            requests[i]['request_id'] = x[0]
-            requests[i]['sender_email'] = x[1]
-            requests[i]['helpdesk_email'] = x[2]
-            requests[i]['request_type'] = x[3]
-            requests[i]['request_desc'] = x[4]
-            requests[i]['request_status'] = x[5]
-        connection.commit()
+        connection = get_db()
+        requests = connection.execute(OPEN_REQUESTS_SQL, (session['user']['id'],)).fetchall()
             
     except Exception as e:
         print(e)
-    finally:
-        if connection:
-            connection.close() 
 
     return render_template('manage_requests.html', 
                            requests=requests,
@@ -1305,7 +1333,7 @@ def claim_requests():
     if request.method == 'POST':
         request_id = request.form.get('request_id')
         try:
-            connection = sql.connect(DATABASE)
+            connection = get_db()
             cursor = connection.cursor()
             cursor.execute("""
                 UPDATE Requests
@@ -1316,31 +1344,14 @@ def claim_requests():
                 
         except Exception as e:
             print(e)
-        finally:
-            if connection:
-                connection.close()
 
     requests = []
     try:
-        connection = sql.connect(DATABASE)
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM Requests WHERE request_status = 0 AND helpdesk_staff_email = ?", ('helpdeskteam@nittybiz.com',))
-        requests_list = cursor.fetchall()
-        for i,x in enumerate(requests_list):
-            requests.append({})
-            requests[i]['request_id'] = x[0]
-            requests[i]['sender_email'] = x[1]
-            requests[i]['helpdesk_email'] = x[2]
-            requests[i]['request_type'] = x[3]
-            requests[i]['request_desc'] = x[4]
-            requests[i]['request_status'] = x[5]
-        connection.commit()
+        connection = get_db()
+        requests = connection.execute(OPEN_REQUESTS_SQL, ('helpdeskteam@nittybiz.com',)).fetchall()
             
     except Exception as e:
         print(e)
-    finally:
-        if connection:
-            connection.close()
 
     return render_template('claim_requests.html', requests=requests, user=user)
 
@@ -1353,7 +1364,7 @@ def payment_methods():
     if user['type'] != 'Buyer':
         return redirect(url_for('dashboard'))  # Only Buyers manage payments
 
-    connection = sql.connect(DATABASE)
+    connection = get_db()
     cursor = connection.cursor()
 
     if request.method == 'POST':
@@ -1376,13 +1387,11 @@ def payment_methods():
                 flash(f'Failed to add credit card: {e}', 'danger')
 
         # ✅ Always redirect after POST (even if success or error)
-        connection.close()
         return redirect(url_for('payment_methods'))
 
     # Fetch buyer's saved cards
     cursor.execute('SELECT credit_card_num, card_type, expire_month, expire_year FROM CreditCards WHERE owner_email = ?', (user['id'],))
     cards = cursor.fetchall()
-    connection.close()
 
     return render_template('payment_methods.html', 
                            cards=cards,
@@ -1394,11 +1403,10 @@ def delete_card(card_num):
     if 'user' not in session:
         return redirect(url_for('login'))
 
-    connection = sql.connect(DATABASE)
+    connection = get_db()
     cursor = connection.cursor()
     cursor.execute('DELETE FROM CreditCards WHERE credit_card_num = ? AND owner_email = ?', (card_num, session['user']['id']))
     connection.commit()
-    connection.close()
 
     flash('Credit card removed.', 'success')
     return redirect(url_for('payment_methods'))
@@ -1407,42 +1415,40 @@ def delete_card(card_num):
 def product_info(product_id):
     user = session['user']
 
-    connection = sql.connect(DATABASE)
+    connection = get_db()
     cursor = connection.cursor()
     cursor.execute('''
-        SELECT *
-        FROM ProductListings
-        WHERE listing_id = ?
+        SELECT P.seller_email, P.listing_id, P.category, P.product_title, P.product_name,
+               P.product_description, P.quantity, P.product_price, P.status,
+               S.business_name AS seller_name
+        FROM ProductListings P
+        LEFT JOIN Sellers S ON S.email = P.seller_email
+        WHERE P.listing_id = ?
         ''', (product_id,))
-    product_row = cursor.fetchone()
+    product = cursor.fetchone()
 
-    if not product_row:
+    if not product:
         flash('Product not found.', 'danger')
         return redirect(url_for('products'))
 
-    product_attributes = ['seller_email', 'listing_id', 'category', 'product_title', 'product_name', 'product_description', 'quantity', 'product_price', 'status']
-    product = dict(zip(product_attributes, product_row))
-
+    # The newest reviews, plus the count and average over all of them
     cursor.execute('''
-            SELECT (business_name)
-            FROM Sellers S
-            WHERE S.email = ?
-        ''', (product['seller_email'],))
-    product['seller_name'] = cursor.fetchone()[0]
-
-    cursor.execute('''
-            SELECT review_desc, rating
+            SELECT review_desc, rating,
+                   COUNT(*) OVER () AS total_reviews, AVG(rating) OVER () AS avg_rating
             FROM Reviews R
             JOIN Orders O ON R.order_id = O.order_id
             WHERE O.listing_id = ?
-        ''', (product['listing_id'],))
-    review_attributes = ['review_desc', 'rating']
-    reviews = [dict(zip(review_attributes, row)) for row in cursor.fetchall()]
-    connection.close()
+            ORDER BY R.order_id DESC
+            LIMIT ?
+        ''', (product['listing_id'], PRODUCT_REVIEWS_LIMIT))
+    reviews = cursor.fetchall()
+    total_reviews, avg_rating = (reviews[0]['total_reviews'], reviews[0]['avg_rating']) if reviews else (0, None)
 
     return render_template('product_info.html',
                            product=product,
                            reviews=reviews,
+                           total_reviews=total_reviews,
+                           avg_rating=avg_rating,
                            user=user)
 
 @app.route('/seller_reviews')
@@ -1456,7 +1462,7 @@ def seller_reviews():
         flash('Only sellers can view their reviews.', 'error')
         return redirect(url_for('dashboard'))
 
-    connection = sql.connect(DATABASE)
+    connection = get_db()
     cursor = connection.cursor()
 
     # Get all orders that belong to this seller
@@ -1468,35 +1474,27 @@ def seller_reviews():
         ORDER BY O.date DESC
     ''', (user['id'],))
 
-    attributes = ['order_id', 'listing_id', 'date', 'quantity', 'payment', 'review_desc', 'rating']
-    reviews = [dict(zip(attributes, row)) for row in cursor.fetchall()]
+    reviews = cursor.fetchall()
 
-    connection.close()
 
     return render_template('seller_reviews.html', user=user, reviews=reviews)
 
 @app.route('/profile', methods=['GET', 'POST'])
 def profile():
-    if 'user' not in session:
+    user = session.get('user')
+    if user is None:
         flash('You must be logged in to access your profile.', 'error')
         return redirect(url_for('login'))
-    user = session['user']
     
     flashed = get_flashed_messages(with_categories=True)
-    if flashed:
-        category, message = flashed[0]
-        success = (category == 'success')
-    else:
-        message, success = None, False
+    category, message = flashed[0] if flashed else (None, None)
+    success = (category == 'success')
 
     if request.method == 'POST':
         
         passcode = request.form.get('passcode')
         new_password = request.form.get('new_password')
         confirm_password = request.form.get('confirm_password')
-        hashed_password = hash_password(passcode)
-
-        user = session['user']
         email = user['id']
         if new_password != confirm_password:
             
@@ -1504,21 +1502,26 @@ def profile():
             return redirect(url_for('profile'))
         
         try:
-            connection = sql.connect(DATABASE)
+            connection = get_db()
             cursor = connection.cursor()
-            cursor.execute('SELECT * FROM users WHERE email = ? AND password = ?;', (email, hashed_password))
+            cursor.execute(LOGIN_USER_SQL, (email,))
             user = cursor.fetchone()
-            connection.commit()
-            if user:
+            if user and verify_password(passcode, user[1]):
                 new_hashed_password = hash_password(new_password)
-                cursor.execute("""
-                    UPDATE users
-                    SET password = ?
-                    WHERE email = ?
-                """, (new_hashed_password, email))
-                connection.commit()
-                flash('Password updated successfully!', 'success')
-                return redirect(url_for('dashboard'))
+                # Salted hashes can't be matched in SQL, so the passcode is checked
+                # above; the UPDATE only lands if the stored hash is still the one
+                # we verified against (no concurrent change in between).
+                with connection:
+                    cursor.execute("""
+                        UPDATE users
+                        SET password = ?
+                        WHERE email = ? AND password = ?
+                    """, (new_hashed_password, email, user[1]))
+                if cursor.rowcount:
+                    flash('Password updated successfully!', 'success')
+                    return redirect(url_for('dashboard'))
+                flash('Invalid passcode.', 'error')
+                return redirect(url_for('profile'))
             else:
                 flash('Invalid passcode.', 'error')
                 success = False
@@ -1526,9 +1529,6 @@ def profile():
             
         except Exception as e:
             print(e)
-        finally:
-            if connection:
-                connection.close() 
         
     return render_template('profile.html', user=user, message=message, success=success)
 
@@ -1549,7 +1549,7 @@ def submit_request():
             flash('All fields are required.', 'error')
             return redirect(url_for('submit_request'))
         try:
-            connection = sql.connect(DATABASE)
+            connection = get_db()
             cursor = connection.cursor()
             cursor.execute("""INSERT INTO Requests (sender_email, helpdesk_staff_email, request_type, request_desc, request_status)
             VALUES (?, ?, ?, ?, ?)""", (email, helpdesk_email, request_type, description, request_status))
@@ -1558,59 +1558,36 @@ def submit_request():
             
         except Exception as e:
             print(e)
-        finally:
-            if connection:
-                connection.close()
 
     return render_template('submit_request.html', user=user)
 
 @app.route('/add_to_cart/<int:product_id>', methods=['POST'])
 def add_to_cart(product_id):
-    connection = sql.connect(DATABASE)
+    if 'user' not in session or session['user']['type'] != 'Buyer':
+        flash('You must be logged in as a buyer to add to cart.', 'error')
+        return redirect(url_for('login'))
+
+    connection = get_db()
     cursor = connection.cursor()
 
-    # ✅ Using correct column names from your ProductListings table
-    cursor.execute('''
-        SELECT seller_email, listing_id, category, product_title, product_name, product_description, quantity, product_price, status
-        FROM ProductListings
-        WHERE listing_id = ?
-    ''', (product_id,))
-    product_row = cursor.fetchone()
-    connection.close()
-
-    if not product_row:
+    # Listing ids repeat across sellers; the cart line is for the first listing with this id
+    cursor.execute('SELECT seller_email FROM ProductListings WHERE listing_id = ? ORDER BY rowid LIMIT 1',
+                   (product_id,))
+    product = cursor.fetchone()
+    if not product:
         flash('Product not found.', 'danger')
         return redirect(url_for('products'))
 
-    attributes = ['seller_email', 'listing_id', 'category', 'product_title', 'product_name', 'product_description', 'quantity', 'product_price', 'status']
-    product = dict(zip(attributes, product_row))
-
-    # Initialize cart if not present
-    if 'cart' not in session:
-        session['cart'] = []
-
-    cart = session['cart']
-
     # Read quantity from form
     form_quantity = int(request.form.get('quantity', 1))  # Default to 1 if missing
-    print(form_quantity)
-
-    for item in cart:
-        if item['listing_id'] == product['listing_id']:
-            # If already exists, increase quantity
-            item['quantity'] += form_quantity
-            break
 
-    else:
-        # Otherwise add new product
-        cart.append({
-            'listing_id': product['listing_id'],
-            'name': product['product_name'],
-            'price': product['product_price'],
-            'quantity': form_quantity
-        })
-
-    session['cart'] = cart  # Save cart back into session
+    # Add the product, or increase its quantity if it's already in the cart
+    cursor.execute('''
+        INSERT INTO Cart (buyer_email, seller_email, listing_id, quantity)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (buyer_email, seller_email, listing_id) DO UPDATE SET quantity = quantity + excluded.quantity
+    ''', (session['user']['id'], product['seller_email'], product_id, form_quantity))
+    connection.commit()
     flash('Product added to cart!', 'success')
 
     return redirect(url_for('products'))
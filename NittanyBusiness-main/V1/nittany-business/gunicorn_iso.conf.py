@@ -0,0 +1,17 @@
+# gunicorn -c gunicorn_iso.conf.py app_iso:app
+# Loads the STT model in each worker once it has imported the app, so no request pays for it
+# (needed with --preload, where the import happens in the master; set PRELOAD_STT=0 then).
+# gevent workers: requests waiting on STT polling or SQLite don't pin a process;
+# transcription itself runs on native threads (see STT_EXECUTOR). Jobs live in
+# the worker that accepted them, so keep one worker unless polls are sticky.
+import os
+
+worker_class = "gevent"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_connections = int(os.getenv("WORKER_CONNECTIONS", "1000"))
+
+# post_worker_init rather than post_fork: the gevent worker monkey-patches the
+# stdlib between the two, and app_iso must be imported after that.
+def post_worker_init(worker):
+    from app_iso import _load_fw
+    _load_fw()
@@ -1,21 +1,26 @@
 import os, csv, hashlib, sqlite3 as sql
 from datetime import datetime
+from functools import lru_cache
 
 DB_NAME = "hestia.db"
 DATA_DIR = os.path.join(os.path.dirname(__file__), "HestiaDataset")
 
+@lru_cache(maxsize=None)  # seed users often share a password
 def hp(p):  # hash password
-    return hashlib.sha256(p.encode("utf-8")).hexdigest()
-
-def run(sql_text, params=None):
-    cur.execute(sql_text, params or ())
+    return hashlib.sha256(p.encode("utf-8"), usedforsecurity=False).hexdigest()
 
 with sql.connect(DB_NAME) as con:
     con.execute("PRAGMA foreign_keys = ON;")
+    con.execute("PRAGMA journal_mode = WAL;")
+    con.execute("PRAGMA synchronous = NORMAL;")
+    con.execute("PRAGMA temp_store = MEMORY;")
+    con.execute("PRAGMA cache_size = -64000;")
     cur = con.cursor()
+    # Schema and seed go in one transaction: a single fsync at the final commit.
+    cur.execute("BEGIN IMMEDIATE;")
 
     # -------------------- Tables --------------------
-    run("""
+    cur.execute("""
     CREATE TABLE IF NOT EXISTS Users(
       id INTEGER PRIMARY KEY,
       username TEXT UNIQUE NOT NULL,
@@ -28,7 +33,7 @@ with sql.connect(DB_NAME) as con:
     );
     """)
 
-    run("""
+    cur.execute("""
     CREATE TABLE IF NOT EXISTS SLARules(
       area TEXT NOT NULL CHECK(area IN ('MANTENCION','HOUSEKEEPING','MANTENCION')),
       prioridad TEXT NOT NULL CHECK(prioridad IN ('BAJA','MEDIA','ALTA','URGENTE')),
@@ -37,7 +42,7 @@ with sql.connect(DB_NAME) as con:
     );
     """)
 
-    run("""
+    cur.execute("""
     CREATE TABLE IF NOT EXISTS Tickets(
       id INTEGER PRIMARY KEY,
       area TEXT NOT NULL CHECK(area IN ('MANTENCION','HOUSEKEEPING','MANTENCION')),
@@ -61,7 +66,7 @@ with sql.connect(DB_NAME) as con:
     );
     """)
 
-    run("""
+    cur.execute("""
     CREATE TABLE IF NOT EXISTS TicketHistory(
       id INTEGER PRIMARY KEY AUTOINCREMENT,
       ticket_id INTEGER NOT NULL,
@@ -74,7 +79,7 @@ with sql.connect(DB_NAME) as con:
     );
     """)
 
-    run("""
+    cur.execute("""
     CREATE TABLE IF NOT EXISTS Attachments(
       id INTEGER PRIMARY KEY AUTOINCREMENT,
       ticket_id INTEGER NOT NULL,
@@ -87,7 +92,7 @@ with sql.connect(DB_NAME) as con:
     );
     """)
 
-    run("""
+    cur.execute("""
     CREATE TABLE IF NOT EXISTS PMSGuests(
       huesped_id TEXT PRIMARY KEY,
       nombre TEXT,
@@ -98,68 +103,79 @@ with sql.connect(DB_NAME) as con:
     );
     """)
 
-    con.commit()
-
     # -------------------- Seed from CSV --------------------
-    def load_csv(name):
+    # One executemany per table (the INSERT is prepared once and reused) and a
+    # single commit at the end.
+    # Streams each CSV row as a tuple of `fields` (in that order); nothing is
+    # materialized, executemany consumes the rows as they are read.
+    def iter_csv(name, fields):
         with open(os.path.join(DATA_DIR, name), newline='', encoding='utf-8') as f:
-            return list(csv.DictReader(f))
+            reader = csv.reader(f)
+            header = next(reader)
+            idx = [header.index(x) for x in fields]
+            for row in reader:
+                if row:
+                    yield tuple(row[i] for i in idx)
+
+    def nz(v): return v if v else None
 
     # Users (hash passwords)
-    for r in load_csv("users.csv"):
-        run("""INSERT OR IGNORE INTO Users(id,username,email,password_hash,role,turno,telefono,activo)
-               VALUES(?,?,?,?,?,?,?,?);""",
-            (int(r["id"]), r["username"].strip(), r["email"].strip(),
-             hp(r["password"].strip()), r["role"].strip(),
-             (r["turno"] or None), (r["telefono"] or None), int(r["activo"])))
-    con.commit()
+    cur.executemany("""INSERT OR IGNORE INTO Users(id,username,email,password_hash,role,turno,telefono,activo)
+                       VALUES(?,?,?,?,?,?,?,?);""",
+        ((int(id_), username.strip(), email.strip(), hp(password.strip()), role.strip(),
+          turno or None, telefono or None, int(activo))
+         for id_, username, email, password, role, turno, telefono, activo in iter_csv(
+             "users.csv", ["id", "username", "email", "password", "role", "turno", "telefono", "activo"])))
 
     # SLA
-    for r in load_csv("sla_rules.csv"):
-        run("""INSERT OR IGNORE INTO SLARules(area,prioridad,max_minutes)
-               VALUES(?,?,?);""",
-            (r["area"].strip(), r["prioridad"].strip(), int(r["max_minutes"])))
-    con.commit()
+    cur.executemany("""INSERT OR IGNORE INTO SLARules(area,prioridad,max_minutes)
+                       VALUES(?,?,?);""",
+        ((area.strip(), prioridad.strip(), int(max_minutes))
+         for area, prioridad, max_minutes in iter_csv(
+             "sla_rules.csv", ["area", "prioridad", "max_minutes"])))
 
     # Tickets
-    def nz(v): return v if v else None
-    for r in load_csv("tickets.csv"):
-        run("""INSERT OR IGNORE INTO Tickets(
-            id,area,prioridad,estado,detalle,canal_origen,ubicacion,huesped_id,
-            created_at,accepted_at,started_at,finished_at,due_at,
-            assigned_to,created_by,confidence_score,qr_required
-        ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);""",
-        (int(r["id"]), r["area"], r["prioridad"], r["estado"], r["detalle"],
-         r["canal_origen"], r["ubicacion"], nz(r["huesped_id"]),
-         r["created_at"], nz(r["accepted_at"]), nz(r["started_at"]),
-         nz(r["finished_at"]), nz(r["due_at"]),
-         int(r["assigned_to"]) if r["assigned_to"] else None,
-         int(r["created_by"]) if r["created_by"] else None,
-         float(r["confidence_score"]) if r["confidence_score"] else None,
-         int(r["qr_required"]) if r["qr_required"] else 0))
-    con.commit()
+    TICKET_FIELDS = ["id", "area", "prioridad", "estado", "detalle", "canal_origen", "ubicacion", "huesped_id",
+                     "created_at", "accepted_at", "started_at", "finished_at", "due_at",
+                     "assigned_to", "created_by", "confidence_score", "qr_required"]
+
+    def coerce_ticket(r):
+        (id_, area, prioridad, estado, detalle, canal_origen, ubicacion, huesped_id,
+         created_at, accepted_at, started_at, finished_at, due_at,
+         assigned_to, created_by, confidence_score, qr_required) = r
+        return (int(id_), area, prioridad, estado, detalle, canal_origen, ubicacion, huesped_id or None,
+                created_at, accepted_at or None, started_at or None, finished_at or None, due_at or None,
+                int(assigned_to) if assigned_to else None,
+                int(created_by) if created_by else None,
+                float(confidence_score) if confidence_score else None,
+                int(qr_required) if qr_required else 0)
+
+    cur.executemany("""INSERT OR IGNORE INTO Tickets(
+        id,area,prioridad,estado,detalle,canal_origen,ubicacion,huesped_id,
+        created_at,accepted_at,started_at,finished_at,due_at,
+        assigned_to,created_by,confidence_score,qr_required
+    ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);""",
+        (coerce_ticket(r) for r in iter_csv("tickets.csv", TICKET_FIELDS)))
 
     # Ticket history
-    for r in load_csv("ticket_history.csv"):
-        run("""INSERT OR IGNORE INTO TicketHistory(id,ticket_id,actor_user_id,action,motivo,at)
-               VALUES(?,?,?,?,?,?);""",
-            (int(r["id"]), int(r["ticket_id"]), int(r["actor_user_id"]) if r["actor_user_id"] else None,
-             r["action"], nz(r["motivo"]), r["at"]))
-    con.commit()
+    cur.executemany("""INSERT OR IGNORE INTO TicketHistory(id,ticket_id,actor_user_id,action,motivo,at)
+                       VALUES(?,?,?,?,?,?);""",
+        ((int(id_), int(ticket_id), int(actor_user_id) if actor_user_id else None, action, nz(motivo), at)
+         for id_, ticket_id, actor_user_id, action, motivo, at in iter_csv(
+             "ticket_history.csv", ["id", "ticket_id", "actor_user_id", "action", "motivo", "at"])))
 
     # Attachments
-    for r in load_csv("attachments.csv"):
-        run("""INSERT OR IGNORE INTO Attachments(id,ticket_id,url,kind,at,uploaded_by)
-               VALUES(?,?,?,?,?,?);""",
-            (int(r["id"]), int(r["ticket_id"]), r["url"], r["kind"], r["at"],
-             int(r["uploaded_by"]) if r["uploaded_by"] else None))
-    con.commit()
+    cur.executemany("""INSERT OR IGNORE INTO Attachments(id,ticket_id,url,kind,at,uploaded_by)
+                       VALUES(?,?,?,?,?,?);""",
+        ((int(id_), int(ticket_id), url, kind, at, int(uploaded_by) if uploaded_by else None)
+         for id_, ticket_id, url, kind, at, uploaded_by in iter_csv(
+             "attachments.csv", ["id", "ticket_id", "url", "kind", "at", "uploaded_by"])))
+
+    # PMS cache (no conversions: the CSV columns go in as-is)
+    cur.executemany("""INSERT OR IGNORE INTO PMSGuests(huesped_id,nombre,habitacion,checkin_at,checkout_at,status)
+                       VALUES(?,?,?,?,?,?);""",
+        iter_csv("pms_guests.csv", ["huesped_id", "nombre", "habitacion", "checkin_at", "checkout_at", "status"]))
 
-    # PMS cache
-    for r in load_csv("pms_guests.csv"):
-        run("""INSERT OR IGNORE INTO PMSGuests(huesped_id,nombre,habitacion,checkin_at,checkout_at,status)
-               VALUES(?,?,?,?,?,?);""",
-            (r["huesped_id"], r["nombre"], r["habitacion"], r["checkin_at"], r["checkout_at"], r["status"]))
     con.commit()
 
 print(f"✅ DB created and seeded: {DB_NAME}")
@@ -6,6 +6,13 @@ import os
 DATABASE = 'database.db'
 PARENT_DIR = os.path.dirname(os.path.abspath(__file__))
 
+def parse_price(text):
+    """'$1,234.56' -> 1234.56 (None if empty or not a number)."""
+    try:
+        return float(str(text).replace('$', '').replace(',', '').strip())
+    except ValueError:
+        return None
+
 #------------------------------------------------------------------------------
 # Create Tables with Associated Attributes
 #------------------------------------------------------------------------------
@@ -168,13 +175,31 @@ def create_productlistings_table():
             product_name TEXT NOT NULL,
             product_description TEXT NOT NULL,
             quantity INTEGER NOT NULL,
-            product_price INTEGER NOT NULL,
+            product_price REAL NOT NULL,
             status INTEGER NOT NULL,
             PRIMARY KEY (seller_email, listing_id),
             FOREIGN KEY (seller_email) REFERENCES Sellers (email) ON UPDATE CASCADE,
             FOREIGN KEY (category) REFERENCES Categories (category_name)
         );
     ''')
+    # category + price, for the product search filters
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_listings_category_price
+        ON ProductListings (category, product_price);
+    ''')
+    connection.commit()
+    connection.close()
+
+# Create the ListingSeq Table (single row holding the last listing_id handed out)
+def create_listing_seq_table():
+    connection = sql.connect(DATABASE)
+    cursor = connection.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ListingSeq (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_id INTEGER NOT NULL
+        );
+    ''')
     connection.commit()
     connection.close()
 
@@ -214,6 +239,40 @@ def create_reviews_table():
     connection.commit()
     connection.close()
 
+# Create the Cart Table (a buyer's cart lives here rather than in the session cookie)
+# Listing ids are only unique per seller, so a cart line names both.
+def create_cart_table():
+    connection = sql.connect(DATABASE)
+    cursor = connection.cursor()
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(Cart)')]
+    rebuild = bool(columns) and 'seller_email' not in columns
+    if rebuild:
+        cursor.execute('ALTER TABLE Cart RENAME TO Cart_old')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Cart (
+            buyer_email TEXT NOT NULL,
+            seller_email TEXT NOT NULL,
+            listing_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (buyer_email, seller_email, listing_id),
+            FOREIGN KEY (buyer_email) REFERENCES Buyers (email) ON UPDATE CASCADE,
+            FOREIGN KEY (seller_email, listing_id) REFERENCES ProductListings (seller_email, listing_id)
+        );
+    ''')
+    if rebuild:
+        # carts saved without a seller: pin each line to the listing add_to_cart picks
+        cursor.execute('''
+            INSERT INTO Cart (buyer_email, seller_email, listing_id, quantity)
+            SELECT c.buyer_email, p.seller_email, c.listing_id, c.quantity
+            FROM Cart_old c
+            JOIN ProductListings p ON p.rowid = (
+                SELECT rowid FROM ProductListings WHERE listing_id = c.listing_id ORDER BY rowid LIMIT 1)
+            ORDER BY c.rowid
+        ''')
+        cursor.execute('DROP TABLE Cart_old')
+    connection.commit()
+    connection.close()
+
 #------------------------------------------------------------------------------
 # Populate Tables
 # - Parse CSV files and populate the data into the respective tables
@@ -462,10 +521,10 @@ def populate_productlistings():
             product_name = row.get('Product_Name', '').strip()
             product_description = row.get('Product_Description', '').strip()
             quantity = row.get('Quantity', '').strip()
-            product_price = row.get('Product_Price', '').strip()
+            product_price = parse_price(row.get('Product_Price', ''))
             status = row.get('Status', '').strip()
 
-            if seller_email and listing_id and category and product_title and product_name and product_description and quantity and product_price and status:  # Ensure values exist
+            if seller_email and listing_id and category and product_title and product_name and product_description and quantity and product_price is not None and status:  # Ensure values exist
                 try:
                     cursor.execute('INSERT INTO ProductListings (seller_email, listing_id, category, product_title, product_name, product_description, quantity, product_price, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);', (seller_email, listing_id, category, product_title, product_name, product_description, quantity, product_price, status))
                 except sql.IntegrityError:
@@ -523,6 +582,55 @@ def populate_reviews():
     connection.commit()
     connection.close()
 
+# Secondary indexes for the app's lookups. Users/Buyers/Sellers/Helpdesk are
+# keyed by email, ProductListings by (seller_email, listing_id) and Reviews by
+# order_id already. ANALYZE runs when any of them is new, so the planner has
+# stats for it.
+APP_INDEXES = {
+    'idx_pl_listing': 'ProductListings (listing_id)',
+    'idx_cat_parent': 'Categories (parent_category)',
+    'idx_helpdesk_approved': 'Helpdesk (approved)',
+    'idx_orders_buyer_date': 'Orders (buyer_email, date)',
+    'idx_orders_seller_date': 'Orders (seller_email, date)',
+    'idx_orders_listing': 'Orders (listing_id)',
+    'idx_cards_owner': 'CreditCards (owner_email)',
+    'idx_requests_staff_status': 'Requests (helpdesk_staff_email, request_status)',
+    'idx_requests_sender': 'Requests (sender_email)',
+}
+
+def create_indexes():
+    connection = sql.connect(DATABASE)
+    cursor = connection.cursor()
+    try:
+        existing = {name for (name,) in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        missing = [name for name in APP_INDEXES if name not in existing]
+        for name in missing:
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {APP_INDEXES[name]}')
+        if missing:
+            cursor.execute('DROP INDEX IF EXISTS idx_orders_seller')  # superseded by idx_orders_seller_date
+            cursor.execute('ANALYZE')
+        connection.commit()
+    finally:
+        connection.close()
+
+# Convert a database built before product_price was REAL: '$1,234.56' text -> number.
+def migrate_product_prices():
+    connection = sql.connect(DATABASE)
+    cursor = connection.cursor()
+    try:
+        cursor.execute('''
+            UPDATE ProductListings
+            SET product_price = CAST(TRIM(REPLACE(REPLACE(product_price, '$', ''), ',', '')) AS REAL)
+            WHERE typeof(product_price) = 'text'
+        ''')
+        if cursor.rowcount > 0:
+            # the old index was on the parsed-text expression
+            cursor.execute('DROP INDEX IF EXISTS idx_listings_category_price')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_listings_category_price ON ProductListings (category, product_price)')
+        connection.commit()
+    finally:
+        connection.close()
+
 if __name__ == "__main__":
     # Delete old database to ensure proper password hashing
     if os.path.exists(DATABASE):
@@ -539,8 +647,10 @@ if __name__ == "__main__":
     create_sellers_table()
     create_categories_table()
     create_productlistings_table()  
+    create_listing_seq_table()
     create_orders_table()
     create_reviews_table()
+    create_cart_table()
     
 
     # Call the table population functions - SPECIFIC ORDER TO MAINTAIN DEPENDENCIES
@@ -558,4 +668,7 @@ if __name__ == "__main__":
     populate_categories()
     populate_productlistings()    # Populate after Sellers, Categories
     populate_orders()             # Populate after Buyers, Sellers, ProductListings
-    populate_reviews()            # Populate after Orders
\ No newline at end of file
+    populate_reviews()            # Populate after Orders
+
+    # Indexes last: built over the loaded rows, and ANALYZE then has real data to sample
+    create_indexes()
@@ -22,12 +22,19 @@ ALL_STATES = OPEN_STATES + ("RESUELTO",)
 
 # ---------- helpers ----------
 def hp(password: str) -> str:
-    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+    return hashlib.sha256(password.encode("utf-8"), usedforsecurity=False).hexdigest()
+
+# Every seeded account logs in with demo123; hash it once.
+DEMO_HASH = hp("demo123")
 
 def db():
     conn = sql.connect(DB_PATH)
     conn.row_factory = sql.Row
     conn.execute("PRAGMA foreign_keys = ON;")
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    conn.execute("PRAGMA cache_size = -64000;")
     return conn
 
 def execmany(conn, q, rows):
@@ -172,31 +179,21 @@ CREATE INDEX IF NOT EXISTS idx_tickets_created ON Tickets(created_at);
 CREATE INDEX IF NOT EXISTS idx_tickets_scope ON Tickets(org_id, hotel_id);
 CREATE INDEX IF NOT EXISTS idx_tickets_assigned ON Tickets(assigned_to);
 CREATE INDEX IF NOT EXISTS idx_ticket_history_ticket ON TicketHistory(ticket_id);
+-- Hot list/assignment paths: /tickets, recepcion inbox, pick_assignee, supervisor charts
+CREATE INDEX IF NOT EXISTS idx_tickets_org_created ON Tickets(org_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_tickets_org_estado_assigned ON Tickets(org_id, estado, assigned_to);
+CREATE INDEX IF NOT EXISTS idx_tickets_org_area_estado ON Tickets(org_id, area, estado);
+CREATE INDEX IF NOT EXISTS idx_orgusers_org_role ON OrgUsers(org_id, role);
 CREATE UNIQUE INDEX IF NOT EXISTS idx_sla_unique ON SLARules(area, prioridad);
 """
 
-# ---------- SLA helpers ----------
-def sla_minutes(area: str, prioridad: str) -> int | None:
-    with db() as conn:
-        r = conn.execute(
-            "SELECT max_minutes FROM SLARules WHERE area=? AND prioridad=?",
-            (area, prioridad)
-        ).fetchone()
-        return int(r["max_minutes"]) if r else None
-
-def compute_due(created_at: datetime, area: str, prioridad: str) -> datetime | None:
-    mins = sla_minutes(area, prioridad)
-    return created_at + timedelta(minutes=mins) if mins else None
-
 # ---------- seed routines ----------
 def reset_db():
-    if os.path.exists(DB_PATH):
-        os.remove(DB_PATH)
-    with db() as conn:
-        conn.executescript(SCHEMA_SQL)
-    print("✓ Database created and schema applied.")
+    for path in (DB_PATH, DB_PATH + "-wal", DB_PATH + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
 
-def seed_rbac():
+def seed_rbac(conn):
     roles = [
         ("SUPERADMIN", "Super Admin", None),
         ("GERENTE", "Gerente", None),
@@ -247,47 +244,44 @@ def seed_rbac():
     ]:
         rp.append(("TECNICO", code, 1))
 
-    with db() as conn:
-        execmany(conn, "INSERT OR IGNORE INTO Roles(code,name,inherits_code) VALUES(?,?,?)", roles)
-        execmany(conn, "INSERT OR IGNORE INTO Permissions(code,name) VALUES(?,?)", perms)
-        execmany(conn, """
-            INSERT OR IGNORE INTO RolePermissions(role_code, perm_code, allow)
-            VALUES (?,?,?)
-        """, rp)
+    execmany(conn, "INSERT OR IGNORE INTO Roles(code,name,inherits_code) VALUES(?,?,?)", roles)
+    execmany(conn, "INSERT OR IGNORE INTO Permissions(code,name) VALUES(?,?)", perms)
+    execmany(conn, """
+        INSERT OR IGNORE INTO RolePermissions(role_code, perm_code, allow)
+        VALUES (?,?,?)
+    """, rp)
     print("✓ Seeded RBAC roles, permissions and mappings.")
 
-def seed_orgs_hotels(num_orgs=2, hotels_per_org=2):
+def seed_orgs_hotels(conn, num_orgs=2, hotels_per_org=2):
     """Returns lists: org_rows, hotel_rows"""
     now = datetime.now().isoformat(timespec="seconds")
     org_rows = [(f"Org {i+1}", now) for i in range(num_orgs)]
-    with db() as conn:
-        execmany(conn, "INSERT INTO Orgs(name, created_at) VALUES(?,?)", org_rows)
-        orgs = conn.execute("SELECT id, name FROM Orgs ORDER BY id").fetchall()
-
-        hotels_rows = []
-        for o in orgs:
-            for j in range(hotels_per_org):
-                hotels_rows.append((o["id"], f"{o['name']} - Hotel {j+1}", now))
-        execmany(conn, "INSERT INTO Hotels(org_id, name, created_at) VALUES(?,?,?)", hotels_rows)
-        hotels = conn.execute(
-            "SELECT id, org_id, name FROM Hotels ORDER BY org_id, id"
-        ).fetchall()
+    execmany(conn, "INSERT INTO Orgs(name, created_at) VALUES(?,?)", org_rows)
+    orgs = conn.execute("SELECT id, name FROM Orgs ORDER BY id").fetchall()
+
+    hotels_rows = []
+    for o in orgs:
+        for j in range(hotels_per_org):
+            hotels_rows.append((o["id"], f"{o['name']} - Hotel {j+1}", now))
+    execmany(conn, "INSERT INTO Hotels(org_id, name, created_at) VALUES(?,?,?)", hotels_rows)
+    hotels = conn.execute(
+        "SELECT id, org_id, name FROM Hotels ORDER BY org_id, id"
+    ).fetchall()
 
     print(f"✓ Seeded {len(orgs)} orgs and {len(hotels)} hotels")
     return orgs, hotels
 
-def seed_users(superadmin_email="sudo@demo.local"):
+def seed_users(conn, superadmin_email="sudo@demo.local"):
     # Superadmin
-    users = [("sudo", superadmin_email, hp("demo123"), "GERENTE", None, "+51-900000000", 1, 1)]
-    with db() as conn:
-        execmany(conn, """INSERT INTO Users(username,email,password_hash,role,area,telefono,activo,is_superadmin)
-                          VALUES(?,?,?,?,?,?,?,?)""", users)
-        sudo = conn.execute("SELECT id FROM Users WHERE email=?", (superadmin_email,)).fetchone()
+    users = [("sudo", superadmin_email, DEMO_HASH, "GERENTE", None, "+51-900000000", 1, 1)]
+    execmany(conn, """INSERT INTO Users(username,email,password_hash,role,area,telefono,activo,is_superadmin)
+                      VALUES(?,?,?,?,?,?,?,?)""", users)
+    sudo = conn.execute("SELECT id FROM Users WHERE email=?", (superadmin_email,)).fetchone()
 
     print("✓ Seeded superadmin (sudo@demo.local / demo123)")
     return sudo["id"]
 
-def seed_org_memberships(orgs, hotels):
+def seed_org_memberships(conn, orgs, hotels):
     """
     Create per org:
       - 1 gerente
@@ -295,95 +289,93 @@ def seed_org_memberships(orgs, hotels):
       - 2 recepcionistas (cover all areas via OrgUserAreas)
       - 4 técnicos per area
     """
-    with db() as conn:
-        new_users = []
-        for o in orgs:
-            org_ix = o["id"]
-            # gerente
-            new_users.append((f"gerente_o{org_ix}", f"gerente_o{org_ix}@demo.local", hp("demo123"), "GERENTE", None, f"+51-90000{org_ix:03d}", 1, 0))
-            # supervisors (one per area)
-            for a in AREAS:
-                uname = f"sup_{a.lower()}_o{org_ix}"
-                new_users.append((uname, f"{uname}@demo.local", hp("demo123"), "SUPERVISOR", a, f"+51-9{org_ix:02d}10{AREAS.index(a)}", 1, 0))
-            # recepcion (2 per org)
-            for r in range(1, 3):
-                uname = f"rcpt{r}_o{org_ix}"
-                new_users.append((uname, f"{uname}@demo.local", hp("demo123"), "RECEPCION", None, f"+51-9{org_ix:02d}20{r}", 1, 0))
-            # technicians
-            for a in AREAS:
-                for t in range(1, 5):
-                    uname = f"tech{t}_{a.lower()}_o{org_ix}"
-                    new_users.append((uname, f"{uname}@demo.local", hp("demo123"), "TECNICO", a, f"+51-9{org_ix:02d}{AREAS.index(a)}{t:02d}", 1, 0))
-
-        execmany(conn, """INSERT INTO Users(username,email,password_hash,role,area,telefono,activo,is_superadmin)
-                          VALUES(?,?,?,?,?,?,?,?)""", new_users)
-
-        users = conn.execute("SELECT id, username, email, role, area FROM Users WHERE is_superadmin=0").fetchall()
-        users_by_role = {
-            "GERENTE": [u for u in users if u["role"] == "GERENTE"],
-            "SUPERVISOR": [u for u in users if u["role"] == "SUPERVISOR"],
-            "RECEPCION": [u for u in users if u["role"] == "RECEPCION"],
-            "TECNICO": [u for u in users if u["role"] == "TECNICO"],
-        }
-
-        # Memberships & areas
-        org_users_rows = []
-        ou_areas_rows = []
-        for o in orgs:
-            org_id = o["id"]
-            org_hotels = [h for h in hotels if h["org_id"] == org_id]
-            default_hotel_id = org_hotels[0]["id"] if org_hotels else None
-
-            # gerente
-            g = users_by_role["GERENTE"].pop(0)
-            org_users_rows.append((org_id, g["id"], "GERENTE", None, default_hotel_id))
-
-            # supervisors (bind to their area)
-            for a in AREAS:
-                s = next(u for u in users_by_role["SUPERVISOR"] if u["area"] == a)
-                users_by_role["SUPERVISOR"].remove(s)
-                org_users_rows.append((org_id, s["id"], "SUPERVISOR", a, default_hotel_id))
-                ou_areas_rows.append((org_id, s["id"], a))
-
-            # recepcion (multi-area: grant all ops areas for triage)
-            for _ in range(2):
-                rcpt = users_by_role["RECEPCION"].pop(0)
-                org_users_rows.append((org_id, rcpt["id"], "RECEPCION", None, default_hotel_id))
-                for a in AREAS:
-                    ou_areas_rows.append((org_id, rcpt["id"], a))
-
-            # technicians (bind to their area)
+    new_users = []
+    for o in orgs:
+        org_ix = o["id"]
+        # gerente
+        new_users.append((f"gerente_o{org_ix}", f"gerente_o{org_ix}@demo.local", DEMO_HASH, "GERENTE", None, f"+51-90000{org_ix:03d}", 1, 0))
+        # supervisors (one per area)
+        for a in AREAS:
+            uname = f"sup_{a.lower()}_o{org_ix}"
+            new_users.append((uname, f"{uname}@demo.local", DEMO_HASH, "SUPERVISOR", a, f"+51-9{org_ix:02d}10{AREAS.index(a)}", 1, 0))
+        # recepcion (2 per org)
+        for r in range(1, 3):
+            uname = f"rcpt{r}_o{org_ix}"
+            new_users.append((uname, f"{uname}@demo.local", DEMO_HASH, "RECEPCION", None, f"+51-9{org_ix:02d}20{r}", 1, 0))
+        # technicians
+        for a in AREAS:
+            for t in range(1, 5):
+                uname = f"tech{t}_{a.lower()}_o{org_ix}"
+                new_users.append((uname, f"{uname}@demo.local", DEMO_HASH, "TECNICO", a, f"+51-9{org_ix:02d}{AREAS.index(a)}{t:02d}", 1, 0))
+
+    execmany(conn, """INSERT INTO Users(username,email,password_hash,role,area,telefono,activo,is_superadmin)
+                      VALUES(?,?,?,?,?,?,?,?)""", new_users)
+
+    users = conn.execute("SELECT id, username, email, role, area FROM Users WHERE is_superadmin=0").fetchall()
+    users_by_role = {
+        "GERENTE": [u for u in users if u["role"] == "GERENTE"],
+        "SUPERVISOR": [u for u in users if u["role"] == "SUPERVISOR"],
+        "RECEPCION": [u for u in users if u["role"] == "RECEPCION"],
+        "TECNICO": [u for u in users if u["role"] == "TECNICO"],
+    }
+
+    # Memberships & areas
+    org_users_rows = []
+    ou_areas_rows = []
+    for o in orgs:
+        org_id = o["id"]
+        org_hotels = [h for h in hotels if h["org_id"] == org_id]
+        default_hotel_id = org_hotels[0]["id"] if org_hotels else None
+
+        # gerente
+        g = users_by_role["GERENTE"].pop(0)
+        org_users_rows.append((org_id, g["id"], "GERENTE", None, default_hotel_id))
+
+        # supervisors (bind to their area)
+        for a in AREAS:
+            s = next(u for u in users_by_role["SUPERVISOR"] if u["area"] == a)
+            users_by_role["SUPERVISOR"].remove(s)
+            org_users_rows.append((org_id, s["id"], "SUPERVISOR", a, default_hotel_id))
+            ou_areas_rows.append((org_id, s["id"], a))
+
+        # recepcion (multi-area: grant all ops areas for triage)
+        for _ in range(2):
+            rcpt = users_by_role["RECEPCION"].pop(0)
+            org_users_rows.append((org_id, rcpt["id"], "RECEPCION", None, default_hotel_id))
             for a in AREAS:
-                techs = [u for u in users_by_role["TECNICO"] if u["area"] == a][:4]
-                for t in techs:
-                    users_by_role["TECNICO"].remove(t)
-                    org_users_rows.append((org_id, t["id"], "TECNICO", a, default_hotel_id))
-                    ou_areas_rows.append((org_id, t["id"], a))
-
-        execmany(conn, """
-            INSERT INTO OrgUsers(org_id, user_id, role, default_area, default_hotel_id)
-            VALUES(?,?,?,?,?)
-        """, org_users_rows)
-        execmany(conn, """
-            INSERT OR IGNORE INTO OrgUserAreas(org_id, user_id, area_code)
-            VALUES(?,?,?)
-        """, ou_areas_rows)
+                ou_areas_rows.append((org_id, rcpt["id"], a))
+
+        # technicians (bind to their area)
+        for a in AREAS:
+            techs = [u for u in users_by_role["TECNICO"] if u["area"] == a][:4]
+            for t in techs:
+                users_by_role["TECNICO"].remove(t)
+                org_users_rows.append((org_id, t["id"], "TECNICO", a, default_hotel_id))
+                ou_areas_rows.append((org_id, t["id"], a))
+
+    execmany(conn, """
+        INSERT INTO OrgUsers(org_id, user_id, role, default_area, default_hotel_id)
+        VALUES(?,?,?,?,?)
+    """, org_users_rows)
+    execmany(conn, """
+        INSERT OR IGNORE INTO OrgUserAreas(org_id, user_id, area_code)
+        VALUES(?,?,?)
+    """, ou_areas_rows)
 
     print(f"✓ Seeded {len(org_users_rows)} org memberships and {len(ou_areas_rows)} area links")
     return True
 
-def seed_sla():
+def seed_sla(conn):
     rows = []
     default = {"BAJA": 240, "MEDIA": 180, "ALTA": 90, "URGENTE": 45}
     for area in AREAS:
         for p, m in default.items():
             tweak = m + (0 if area == "MANTENCION" else (10 if area == "HOUSEKEEPING" else 20))
             rows.append((area, p, tweak))
-    with db() as conn:
-        execmany(conn, "INSERT OR IGNORE INTO SLARules(area,prioridad,max_minutes) VALUES(?,?,?)", rows)
+    execmany(conn, "INSERT OR IGNORE INTO SLARules(area,prioridad,max_minutes) VALUES(?,?,?)", rows)
     print(f"✓ Seeded SLA rules ({len(rows)} rows)")
 
-def seed_pms(num_rooms=60):
+def seed_pms(conn, num_rooms=60):
     rooms = []
     today = datetime.now().date()
     for r in range(101, 101 + num_rooms):
@@ -395,14 +387,14 @@ def seed_pms(num_rooms=60):
             f"PMS{r}", f"Huesped {r}", str(r),
             status, checkin.isoformat(timespec="seconds"), checkout.isoformat(timespec="seconds")
         ))
-    with db() as conn:
-        execmany(conn, """INSERT INTO PMSGuests(huesped_id,nombre,habitacion,status,checkin,checkout)
-                          VALUES(?,?,?,?,?,?)""", rooms)
+    execmany(conn, """INSERT INTO PMSGuests(huesped_id,nombre,habitacion,status,checkin,checkout)
+                      VALUES(?,?,?,?,?,?)""", rooms)
     print(f"✓ Seeded PMSGuests ({len(rooms)} rooms)")
 
-def random_ticket_times(base: datetime, estado: str, area: str, prioridad: str):
+def random_ticket_times(sla_map: dict, base: datetime, estado: str, area: str, prioridad: str):
     created_at = base
-    due_dt = compute_due(created_at, area, prioridad)
+    mins = sla_map.get((area, prioridad))
+    due_dt = created_at + timedelta(minutes=mins) if mins else None
 
     accepted_at = None
     started_at = None
@@ -425,25 +417,30 @@ def random_ticket_times(base: datetime, estado: str, area: str, prioridad: str):
         "finished_at": fmt(finished_at),
     }
 
-def seed_tickets(total=150, days_back=10):
-    with db() as conn:
-        creators = conn.execute("""
-            SELECT u.id, u.role, ou.org_id, ou.default_hotel_id AS hotel_id
-            FROM Users u
-            JOIN OrgUsers ou ON ou.user_id = u.id
-            WHERE ou.role IN ('GERENTE','SUPERVISOR','RECEPCION')
-        """).fetchall()
-
-        techs = conn.execute("""
-            SELECT u.id, u.area, ou.org_id, ou.default_hotel_id AS hotel_id
-            FROM Users u
-            JOIN OrgUsers ou ON ou.user_id = u.id
-            WHERE ou.role = 'TECNICO'
-        """).fetchall()
-
-        rooms_in = conn.execute(
-            "SELECT huesped_id, habitacion FROM PMSGuests WHERE status='IN_HOUSE'"
-        ).fetchall()
+def seed_tickets(conn, total=150, days_back=10):
+    # SLA minutes per (area, prioridad), loaded once instead of one query per ticket
+    sla_map = {
+        (r["area"], r["prioridad"]): int(r["max_minutes"])
+        for r in conn.execute("SELECT area, prioridad, max_minutes FROM SLARules")
+    }
+
+    creators = conn.execute("""
+        SELECT u.id, u.role, ou.org_id, ou.default_hotel_id AS hotel_id
+        FROM Users u
+        JOIN OrgUsers ou ON ou.user_id = u.id
+        WHERE ou.role IN ('GERENTE','SUPERVISOR','RECEPCION')
+    """).fetchall()
+
+    techs = conn.execute("""
+        SELECT u.id, u.area, ou.org_id, ou.default_hotel_id AS hotel_id
+        FROM Users u
+        JOIN OrgUsers ou ON ou.user_id = u.id
+        WHERE ou.role = 'TECNICO'
+    """).fetchall()
+
+    rooms_in = conn.execute(
+        "SELECT huesped_id, habitacion FROM PMSGuests WHERE status='IN_HOUSE'"
+    ).fetchall()
 
     rows_t = []
     rows_h = []
@@ -459,7 +456,7 @@ def seed_tickets(total=150, days_back=10):
         estado = RNG.choices(ALL_STATES, weights=[2, 2, 2, 2, 1, 1, 3], k=1)[0]
 
         created_at = now - timedelta(days=RNG.uniform(0, days_back), minutes=RNG.randint(0, 600))
-        timeline = random_ticket_times(created_at, estado, area, prioridad)
+        timeline = random_ticket_times(sla_map, created_at, estado, area, prioridad)
 
         canal = RNG.choices(
             ["recepcion", "huesped_whatsapp", "housekeeping_whatsapp", "mantenimiento_app", "roomservice_llamada"],
@@ -501,45 +498,43 @@ def seed_tickets(total=150, days_back=10):
             timeline["accepted_at"], timeline["started_at"], timeline["finished_at"]
         ))
 
-    with db() as conn:
-        execmany(conn, """
-            INSERT INTO Tickets(
-              org_id, hotel_id, area, prioridad, estado, detalle, canal_origen, ubicacion, huesped_id,
-              created_at, due_at, assigned_to, created_by, confidence_score,
-              qr_required, accepted_at, started_at, finished_at
-            ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-        """, rows_t)
-
-        cur = conn.execute("""
-            SELECT id, created_by, accepted_at, started_at, finished_at, created_at
-            FROM Tickets
-        """)
-        for row in cur.fetchall():
-            tid = row["id"]
-            creator = row["created_by"]
-            rows_h.append((tid, creator, "CREADO", None, row["created_at"]))
-            if row["accepted_at"]:
-                rows_h.append((tid, creator, "ACEPTADO", None, row["accepted_at"]))
-            if row["started_at"]:
-                rows_h.append((tid, creator, "INICIADO", None, row["started_at"]))
-            if row["finished_at"]:
-                rows_h.append((tid, creator, "RESUELTO", None, row["finished_at"]))
-
-        execmany(conn, """
-            INSERT INTO TicketHistory(ticket_id, actor_user_id, action, motivo, at)
-            VALUES(?,?,?,?,?)
-        """, rows_h)
+    execmany(conn, """
+        INSERT INTO Tickets(
+          org_id, hotel_id, area, prioridad, estado, detalle, canal_origen, ubicacion, huesped_id,
+          created_at, due_at, assigned_to, created_by, confidence_score,
+          qr_required, accepted_at, started_at, finished_at
+        ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+    """, rows_t)
+
+    cur = conn.execute("""
+        SELECT id, created_by, accepted_at, started_at, finished_at, created_at
+        FROM Tickets
+    """)
+    for row in cur.fetchall():
+        tid = row["id"]
+        creator = row["created_by"]
+        rows_h.append((tid, creator, "CREADO", None, row["created_at"]))
+        if row["accepted_at"]:
+            rows_h.append((tid, creator, "ACEPTADO", None, row["accepted_at"]))
+        if row["started_at"]:
+            rows_h.append((tid, creator, "INICIADO", None, row["started_at"]))
+        if row["finished_at"]:
+            rows_h.append((tid, creator, "RESUELTO", None, row["finished_at"]))
+
+    execmany(conn, """
+        INSERT INTO TicketHistory(ticket_id, actor_user_id, action, motivo, at)
+        VALUES(?,?,?,?,?)
+    """, rows_h)
 
     print(f"✓ Seeded {len(rows_t)} tickets and {len(rows_h)} history rows")
 
-def seed_summaries():
+def seed_summaries(conn):
     print("\nLogins:")
     print("  Superadmin  -> sudo@demo.local / demo123")
-    with db() as conn:
-        any_gerente = conn.execute("SELECT email FROM Users WHERE role='GERENTE' AND is_superadmin=0 LIMIT 3").fetchall()
-        any_sup = conn.execute("SELECT email FROM Users WHERE role='SUPERVISOR' LIMIT 3").fetchall()
-        any_rcpt = conn.execute("SELECT email FROM Users WHERE role='RECEPCION' LIMIT 3").fetchall()
-        any_tech = conn.execute("SELECT email FROM Users WHERE role='TECNICO' LIMIT 3").fetchall()
+    any_gerente = conn.execute("SELECT email FROM Users WHERE role='GERENTE' AND is_superadmin=0 LIMIT 3").fetchall()
+    any_sup = conn.execute("SELECT email FROM Users WHERE role='SUPERVISOR' LIMIT 3").fetchall()
+    any_rcpt = conn.execute("SELECT email FROM Users WHERE role='RECEPCION' LIMIT 3").fetchall()
+    any_tech = conn.execute("SELECT email FROM Users WHERE role='TECNICO' LIMIT 3").fetchall()
     print("  Gerentes    -> " + ", ".join([r["email"] for r in any_gerente]))
     print("  Recepción   -> " + ", ".join([r["email"] for r in any_rcpt]))
     print("  Supervisores-> " + ", ".join([r["email"] for r in any_sup]))
@@ -556,30 +551,46 @@ def main():
     p.add_argument("--superadmin-email", type=str, default="sudo@demo.local", help="superadmin email")
     args = p.parse_args()
 
-    if args.reset or not os.path.exists(DB_PATH):
+    fresh = args.reset or not os.path.exists(DB_PATH)
+    if args.reset:
         reset_db()
-    else:
-        with db() as conn:
-            conn.executescript(SCHEMA_SQL)
 
-    # 0) RBAC primitives
-    seed_rbac()
+    # One connection for the whole run; every seeder writes into a single
+    # transaction that is committed once at the end.
+    conn = db()
+    try:
+        conn.executescript(SCHEMA_SQL)
+        if fresh:
+            print("✓ Database created and schema applied.")
+        conn.execute("BEGIN IMMEDIATE;")
+
+        # 0) RBAC primitives
+        seed_rbac(conn)
+
+        # 1) Tenants
+        orgs, hotels = seed_orgs_hotels(conn, args.orgs, args.hotels_per_org)
+
+        # 2) Users (superadmin + org membership)
+        seed_users(conn, args.superadmin_email)
+        seed_org_memberships(conn, orgs, hotels)
+
+        # 3) SLA + PMS
+        seed_sla(conn)
+        seed_pms(conn, num_rooms=60)
 
-    # 1) Tenants
-    orgs, hotels = seed_orgs_hotels(args.orgs, args.hotels_per_org)
+        # 4) Tickets scoped by org/hotel
+        seed_tickets(conn, total=args.tickets, days_back=args.days)
 
-    # 2) Users (superadmin + org membership)
-    seed_users(args.superadmin_email)
-    seed_org_memberships(orgs, hotels)
+        conn.commit()
 
-    # 3) SLA + PMS
-    seed_sla()
-    seed_pms(num_rooms=60)
+        # refresh planner stats so the composite indexes get picked up
+        conn.execute("ANALYZE;")
+        conn.commit()
 
-    # 4) Tickets scoped by org/hotel
-    seed_tickets(total=args.tickets, days_back=args.days)
+        seed_summaries(conn)
+    finally:
+        conn.close()
 
-    seed_summaries()
     print("\n✅ Done. You can now run:  python app.py")
     print("   Superadmin lands on /admin. Use /sudo to switch org/hotel context.")
 
@@ -163,6 +163,11 @@ CREATE INDEX IF NOT EXISTS idx_tickets_state    ON tickets(estado);
 CREATE INDEX IF NOT EXISTS idx_tickets_created  ON tickets(created_at);
 CREATE INDEX IF NOT EXISTS idx_tickets_scope    ON tickets(org_id, hotel_id);
 CREATE INDEX IF NOT EXISTS idx_tickets_assigned ON tickets(assigned_to);
+-- Hot list/assignment paths: /tickets, recepcion inbox, pick_assignee, supervisor charts
+CREATE INDEX IF NOT EXISTS idx_tickets_org_created ON tickets(org_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_tickets_org_estado_assigned ON tickets(org_id, estado, assigned_to);
+CREATE INDEX IF NOT EXISTS idx_tickets_org_area_estado ON tickets(org_id, area, estado);
+CREATE INDEX IF NOT EXISTS idx_orgusers_org_role ON orgusers(org_id, role);
 
 -- Ticket history
 CREATE TABLE IF NOT EXISTS tickethistory (
@@ -490,6 +495,7 @@ def main():
         seed_sla(conn)
         seed_pms(conn, num_rooms=60)
         seed_tickets(conn, total=args.tickets, days_back=args.days)
+        exec_sql(conn, "ANALYZE;")  # refresh planner stats after bulk load
         seed_summaries(conn)
         print("\n✅ Done. Your Supabase is ready.")
     finally:
@@ -243,6 +243,11 @@ CREATE INDEX IF NOT EXISTS idx_tickets_hotel_created_desc ON tickets(hotel_id, c
 CREATE INDEX IF NOT EXISTS idx_tickets_critical ON tickets(due_at)
   WHERE estado IN ('PENDIENTE','ASIGNADO','ACEPTADO','EN_CURSO','PAUSADO','DERIVADO') AND due_at IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_tickets_guest_fields ON tickets(ubicacion, huesped_id);
+-- Hot list/assignment paths: /tickets, recepcion inbox, pick_assignee, supervisor charts
+CREATE INDEX IF NOT EXISTS idx_tickets_org_created ON tickets(org_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_tickets_org_estado_assigned ON tickets(org_id, estado, assigned_to);
+CREATE INDEX IF NOT EXISTS idx_tickets_org_area_estado ON tickets(org_id, area, estado);
+CREATE INDEX IF NOT EXISTS idx_orgusers_org_role ON orgusers(org_id, role);
 
 -- ========== HISTORY / COMMENTS / ATTACHMENTS / VOICE ==========
 CREATE TABLE IF NOT EXISTS tickethistory (
@@ -979,6 +984,7 @@ def main():
         if not args.skip_kpis:
             seed_kpis(conn, days_back=args.days)
         seed_webhooks_sample(conn, orgs)
+        exec_sql(conn, "ANALYZE;")  # refresh planner stats after bulk load
         seed_summaries(conn)
         print("\n✅ Done. Your new Supabase is ready.")
     finally: